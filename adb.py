@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 """ ADB related Exceptions and methods """
 
+import os
 import re
 import time
 import socket
 import logging
+import threading
 
 import utils
+import tracing
 
 
 logger = logging.getLogger("ADBDriver")
@@ -15,6 +18,18 @@ logger.setLevel(logging.INFO)
 LOCAL_HOST = "127.0.0.1"
 ADB_HOST_PORT_DEFAULT = 5037
 ADB_DEVICE_PORT_DEFUALT = 5555
+ADB_HOST_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT",
+                                   ADB_HOST_PORT_DEFAULT))
+#same env variable the adb binary honours, keeps both paths on one server
+ADB_CONNECT_TIMEOUT = 5
+
+NATIVE_CLIENT = True
+#talk to adb server over socket, set False to always spawn the adb binary
+SHELL_RET_MARKER = "__ADB_SHELL_RET__"
+
+STATIC_PROP_PREFIX = "ro."
+#read-only props, they only change across reboot or flash
+PROP_LINE_RE = re.compile(r'^\[(?P<name>[^\]]+)\]: \[(?P<value>.*)$')
 
 DEVICE_STATUS = {"online": "device", "offline": "offline",
                  "all": "device|offline"}
@@ -28,18 +43,514 @@ class ADBConnectionException(Exception):
     """Device did not connected."""
     pass
 
+class ADBProtocolException(Exception):
+    """ADB server refused request or replied something unexpected."""
+    pass
+
+ADB_CMD_PREFIX_RE = re.compile(r'^adb(\s+-s\s+(?P<serial>\S+))?(?P<args>.*)$')
+
+def _recv_exact(sock, size):
+    """ read exactly size bytes from socket """
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ADBProtocolException("Connection closed by adb server.")
+        data += chunk
+    return data
+
+def _recv_all(sock, bufsize=65536):
+    """ read from socket until peer closed it """
+    chunks = []
+    while True:
+        chunk = sock.recv(bufsize)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def _recv_buffer(sock, bufsize=256 * 1024):
+    """ read from socket until peer closed it, straight into a growing
+        bytearray so large binary output is not copied chunk by chunk
+    """
+    data = bytearray(bufsize)
+    view = memoryview(data)
+    size = 0
+    while True:
+        if size == len(data):
+            del view #bytearray could not be resized while it is exported
+            data.extend(bytearray(len(data)))
+            view = memoryview(data)
+        received = sock.recv_into(view[size:])
+        if not received:
+            break
+        size += received
+    del view
+    del data[size:]
+    return data
+
+def _read_status(sock):
+    """ read OKAY/FAIL status, raise ADBProtocolException for FAIL """
+    status = _recv_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        message = _read_length_prefixed(sock)
+        raise ADBProtocolException(message.decode("utf-8", "replace"))
+    raise ADBProtocolException("Unexpected adb server status %r" %status)
+
+def _read_length_prefixed(sock):
+    """ read a 4 hex digits length prefixed payload """
+    length = int(_recv_exact(sock, 4), 16)
+    return _recv_exact(sock, length)
+
+def _send_request(sock, service):
+    """ send service request in adb smart socket format """
+    request = service.encode("utf-8")
+    sock.sendall(b"%04x" %len(request) + request)
+
+def _connect_adb_server(host=LOCAL_HOST, port=None):
+    """ open a socket to adb server """
+    port = ADB_HOST_PORT if port is None else port
+    sock = socket.create_connection((host, port), ADB_CONNECT_TIMEOUT)
+    sock.settimeout(None)
+    return sock
+
+def host_request(service):
+    """ send host:<service> to adb server and return its payload (bytes)
+        e.g. host_request("host:devices")
+    """
+    sock = _connect_adb_server()
+    try:
+        _send_request(sock, service)
+        _read_status(sock)
+        return _read_length_prefixed(sock)
+    finally:
+        sock.close()
+
+def open_transport(serial, service):
+    """ switch a new connection to transport of serial (any device if None),
+        open service such as 'shell:ls' on it and return the socket.
+    """
+    utils.check_cancelled()
+    sock = _connect_adb_server()
+    try:
+        if serial:
+            _send_request(sock, "host:transport:%s" %serial)
+        else:
+            _send_request(sock, "host:transport-any")
+        _read_status(sock)
+        _send_request(sock, service)
+        _read_status(sock)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+def exec_out(serial, cmd):
+    """ run cmd with exec: service, return raw output bytes
+        exec: does not allocate pty, so binary output is not mangled.
+    """
+    sock = open_transport(serial, "exec:%s" %cmd)
+    try:
+        with utils.cancellable(sock):
+            return _recv_all(sock)
+    finally:
+        sock.close()
+
+def exec_out_buffer(serial, cmd):
+    """ same as exec_out(), output is returned as a bytearray which could be
+        wrapped in memoryview without copy
+    """
+    sock = open_transport(serial, "exec:%s" %cmd)
+    try:
+        with utils.cancellable(sock):
+            return _recv_buffer(sock)
+    finally:
+        sock.close()
+
+def _split_lines(data, decoder="utf-8"):
+    """ split output the same way utils.execute_shell_cmd does """
+    lines = data.decode(decoder, "replace").replace("\r\n", "\n").split("\n")
+    if lines[-1] == '':
+        lines = lines[:-1]
+    return lines
+
+def parse_getprop(lines):
+    """ {name: value} of 'getprop' output lines, multi-line values kept """
+    props, name, value = {}, None, None
+    for line in lines:
+        match = PROP_LINE_RE.match(line)
+        if match is not None:
+            name, value = match.group("name"), [match.group("value")]
+        elif name is not None:
+            value.append(line)
+        else:
+            continue
+        joined = "\n".join(value)
+        if joined.endswith("]"):
+            props[name] = joined[:-1]
+            name = None
+    return props
+
+_static_props = {}
+#serial -> read-only props of its last getprop snapshot
+_static_props_lock = threading.Lock()
+
+def cache_props(serial, props):
+    """ keep read-only props of a full getprop snapshot of serial """
+    static = dict((k, v) for k, v in props.items()
+                  if k.startswith(STATIC_PROP_PREFIX))
+    with _static_props_lock:
+        _static_props[serial] = static
+
+def cached_props(serial):
+    """ cached read-only props of serial, None if there is no snapshot """
+    with _static_props_lock:
+        return _static_props.get(serial)
+
+def forget_props(serial):
+    """ drop cached props of serial, e.g. it rebooted or was flashed """
+    with _static_props_lock:
+        _static_props.pop(serial, None)
+
+def _forget_props_on_disconnect(serial, old_state, new_state):
+    """ device tracker listener, a device leaving adb may come back with
+        other read-only props
+    """
+    if new_state is None:
+        forget_props(serial)
+
+def shell(serial, cmd):
+    """ run cmd with shell: service
+        shell: does not report exit code, so command is grouped like in
+        ShellSession and followed by an echo of $? behind SHELL_RET_MARKER
+        which is cut from output. Output without marker, e.g. of a command
+        which exits the shell, is an error.
+        return: (return_code(int), output(list of strs))
+    """
+    sock = open_transport(serial, "shell:{ %s\n}\necho %s$?"
+                          %(cmd, SHELL_RET_MARKER))
+    try:
+        with utils.cancellable(sock):
+            data = _recv_all(sock)
+    except socket.error as e:
+        #command already sent, do not let caller fall back and run it again
+        logger.error("Connection lost in shell command %s, see %s",
+                     cmd, str(e))
+        return 1, [str(e)]
+    finally:
+        sock.close()
+    marker = SHELL_RET_MARKER.encode("utf-8")
+    index = data.rfind(marker)
+    if index < 0:
+        msg = "No exit code of shell command %s, output cut off." %cmd
+        logger.error(msg)
+        return 1, _split_lines(data) + [msg]
+    try:
+        ret = int(data[index+len(marker):].strip())
+    except ValueError:
+        ret = 1
+    return ret, _split_lines(data[:index])
+
+
+class ShellSession(object):
+    """ Long-lived 'exec:sh' session on one device, commands run back to back
+        in the same shell, each one followed by an unique sentinel echo with
+        its exit code.
+    """
+    def __init__(self, serial):
+        self.serial = serial
+        self.sock = None
+        self.buffer = b''
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def open(self):
+        """ open shell session, raise socket.error/ADBProtocolException """
+        self.close()
+        self.sock = open_transport(self.serial, "exec:sh")
+        self.buffer = b''
+        return self
+
+    def close(self):
+        """ close session socket if any """
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    @property
+    def alive(self):
+        """ session socket opened or not """
+        return self.sock is not None
+
+    def __read_until_sentinel(self, sentinel):
+        """ read output until sentinel line, return (return_code, output) """
+        buf = bytearray(self.buffer)
+        start = 0
+        while True:
+            index = buf.find(sentinel, start)
+            if index >= 0:
+                end = buf.find(b'\n', index)
+                if end >= 0:
+                    break
+            else:
+                start = max(0, len(buf) - len(sentinel))
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                self.buffer = bytes(buf)
+                raise ADBProtocolException("Shell session closed by device.")
+            buf += chunk
+        output = bytes(buf[:index])
+        ret_str = bytes(buf[index+len(sentinel):end])
+        self.buffer = bytes(buf[end+1:])
+        try:
+            ret = int(ret_str.strip())
+        except ValueError:
+            ret = 1
+        return ret, output
+
+    def run(self, cmd):
+        """ run cmd in session
+            return: (return_code(int), output(list of strs))
+            raise ADBConnectionException if session broken before cmd sent
+        """
+        utils.check_cancelled()
+        with self.lock:
+            if self.sock is None:
+                raise ADBConnectionException("Shell session not opened.")
+            self.count += 1
+            sentinel = "%s_%d_%d:" %(SHELL_RET_MARKER, id(self), self.count)
+            script = "{ %s\n} </dev/null 2>&1\necho %s$?\n" %(cmd, sentinel)
+            try:
+                self.sock.sendall(script.encode("utf-8"))
+            except socket.error as e:
+                self.close()
+                raise ADBConnectionException(str(e))
+            try:
+                with utils.cancellable(self.sock):
+                    ret, output = self.__read_until_sentinel(
+                                                sentinel.encode("utf-8"))
+            except (socket.error, ADBProtocolException) as e:
+                logger.error("Shell session of %s lost in command %s, see %s",
+                             self.serial, cmd, str(e))
+                output, self.buffer = self.buffer, b''
+                self.close()
+                return 1, _split_lines(output) + [str(e)]
+            return ret, _split_lines(output)
+
+
+class DeviceTracker(object):
+    """ serial->state map of adb server, fed by host:track-devices stream
+        which pushes a full device list on every change, so state queries
+        cost nothing and waits return as soon as state flips.
+    """
+    def __init__(self):
+        self.states = {}
+        self.listeners = []
+        self.running = False
+        self.sock = None
+        self.thread = None
+        self.cond = threading.Condition()
+
+    def start(self, timeout=ADB_CONNECT_TIMEOUT):
+        """ connect and start tracking thread, wait for first device list
+            return: True if tracking
+        """
+        with self.cond:
+            if self.running:
+                return True
+            try:
+                self.sock = _connect_adb_server()
+                _send_request(self.sock, "host:track-devices")
+                _read_status(self.sock)
+                self.__update(_read_length_prefixed(self.sock))
+            except (socket.error, ADBProtocolException) as e:
+                logger.debug("Could not track devices, see %s", str(e))
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                return False
+            self.running = True
+            self.thread = threading.Thread(target=self.__track,
+                                           name="adb-track-devices")
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def stop(self):
+        """ stop tracking """
+        with self.cond:
+            self.running = False
+            if self.sock is not None:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            self.cond.notify_all()
+
+    def add_listener(self, callback):
+        """ callback(serial, old_state, new_state) is called from tracking
+            thread on every state change, state None means disconnected.
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """ remove state change callback """
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def __track(self):
+        """ tracking thread body """
+        try:
+            while self.running:
+                self.__update(_read_length_prefixed(self.sock))
+        except (socket.error, ADBProtocolException, ValueError) as e:
+            if self.running:
+                logger.warning("Device tracking stopped, see %s", str(e))
+        finally:
+            with self.cond:
+                self.running = False
+                self.sock.close()
+                self.sock = None
+                self.cond.notify_all()
+
+    def __update(self, payload):
+        """ replace state map with device list payload, notify changes """
+        states = {}
+        for line in _split_lines(payload):
+            fields = line.split("\t")
+            if len(fields) >= 2:
+                states[fields[0]] = fields[1]
+        with self.cond:
+            old_states, self.states = self.states, states
+            self.cond.notify_all()
+        for serial in set(old_states) | set(states):
+            old, new = old_states.get(serial), states.get(serial)
+            if old != new:
+                logger.debug("Device %s state %s -> %s", serial, old, new)
+                for callback in list(self.listeners):
+                    callback(serial, old, new)
+
+    def get_state(self, serial):
+        """ current state such as 'device'/'offline', None if not listed"""
+        return self.states.get(serial)
+
+    def list_devices(self, status=DEVICE_STATUS["online"]):
+        """ serials whose state matches status regex, see list_all_devices """
+        status_re = re.compile(r'^(%s)$' %status)
+        return sorted(s for s, st in self.states.items() if status_re.match(st))
+
+    def __wait(self, predicate, timeout):
+        """ wait until predicate(state map) true or timeout or tracking
+            stopped, return predicate result
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while not predicate(self.states):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    return predicate(self.states)
+                self.cond.wait(remaining)
+            return True
+
+    def wait_for_state(self, serial, state=DEVICE_STATUS["online"],
+                       timeout=1):
+        """ wait until serial in state, return True if it is """
+        return self.__wait(lambda states: states.get(serial) == state, timeout)
+
+    def wait_while_state(self, serial, state=DEVICE_STATUS["online"],
+                         timeout=1):
+        """ wait until serial leaves state, return True if it left """
+        return self.__wait(lambda states: states.get(serial) != state, timeout)
+
+
+device_tracker = DeviceTracker()
+device_tracker.add_listener(_forget_props_on_disconnect)
+
+def get_device_tracker():
+    """ return running device_tracker, started on first call
+        return None if native client disabled or adb server not reachable,
+        callers then poll 'adb devices' instead.
+    """
+    if not NATIVE_CLIENT:
+        return None
+    if device_tracker.running or device_tracker.start():
+        return device_tracker
+    return None
+
+def _list_devices_output():
+    """ build 'adb devices' like output from host:devices """
+    devices = host_request("host:devices")
+    return 0, ["List of devices attached"] + _split_lines(devices)
+
+def _execute_native_adb_cmd(cmd, prefix):
+    """ execute adb command through adb server socket
+        return: (None, None) if command not supported or server not usable,
+                so caller could fall back to adb binary.
+    """
+    prefix_match = ADB_CMD_PREFIX_RE.match(prefix.strip())
+    if prefix_match is None:
+        return None, None
+    serial = prefix_match.group("serial")
+    args = ("%s %s" %(prefix_match.group("args"), cmd)).split(None, 1)
+    try:
+        if args == ["devices"] and serial is None:
+            return _list_devices_output()
+        if len(args) == 2 and args[0] == "shell":
+            return shell(serial, args[1])
+        if len(args) == 2 and args[0] == "exec-out":
+            return 0, _split_lines(exec_out(serial, args[1]))
+    except (socket.error, ADBProtocolException) as e:
+        logger.debug("Native adb client failed on <%s %s>, fall back to adb "
+                     "binary. See %s", prefix, cmd, str(e))
+    return None, None
+
+@tracing.traced("execute_adb_cmd", "adb", arg_index=0)
 def execute_adb_cmd(cmd, prefix="adb"):
-    """ Execute adb command with prefix """
+    """ Execute adb command with prefix
+        devices/shell/exec-out commands are sent to adb server directly if
+        NATIVE_CLIENT set, others and failed ones use adb binary.
+    """
+    if NATIVE_CLIENT:
+        ret, out = _execute_native_adb_cmd(cmd, prefix)
+        if ret is not None:
+            return ret, out
     ret, out = utils.execute_shell_cmd("%s %s" %(prefix, cmd))
     return ret, out
 
-def execute_fastboot_cmd(cmd, prefix="fastboot", rt_output=True):
-    """ Execute fastboot command with prefix """
+@tracing.traced("execute_adb_exec_out", "adb", arg_index=0)
+def execute_adb_exec_out(cmd, prefix="adb"):
+    """ Execute adb exec-out command with prefix, output is kept binary
+        return: return_code, output(bytearray or bytes)
+    """
+    prefix_match = ADB_CMD_PREFIX_RE.match(prefix.strip())
+    if NATIVE_CLIENT and prefix_match is not None and \
+       not prefix_match.group("args").strip():
+        try:
+            return 0, exec_out_buffer(prefix_match.group("serial"), cmd)
+        except (socket.error, ADBProtocolException) as e:
+            logger.debug("Native adb client failed on exec-out %s, fall back "
+                         "to adb binary. See %s", cmd, str(e))
+    shell_cmd = utils.ShellCommand("%s exec-out %s" %(prefix, cmd))
+    try:
+        data = shell_cmd.read()
+    except (OSError, ValueError) as e:
+        logger.error("Exception raised when execute exec-out %s. See %s",
+                     cmd, str(e))
+        return 1, b''
+    return shell_cmd.ret_code, data
+
+def execute_fastboot_cmd(cmd, prefix="fastboot", rt_output=True, cwd=None):
+    """ Execute fastboot command with prefix in working directory cwd """
     ret, out = utils.execute_shell_cmd("%s %s" %(prefix, cmd),
-                                       rt_output=rt_output)
+                                       rt_output=rt_output, cwd=cwd)
     return ret, out
 
-def check_adb_server_alive(port=ADB_HOST_PORT_DEFAULT, host=LOCAL_HOST):
+def check_adb_server_alive(port=ADB_HOST_PORT, host=LOCAL_HOST):
     """ check adb server started or not"""
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -90,6 +601,9 @@ def kill_adb_server():
 
 def list_all_devices(status=DEVICE_STATUS["online"]):
     """ list all device serial numbers that match given status"""
+    tracker = get_device_tracker()
+    if tracker is not None:
+        return tracker.list_devices(status)
     _, out = execute_adb_cmd("devices")
     device_serials = []
     device_match_re = r'(?P<serial>\S+)\t(?P<status>%s)' %status
@@ -117,14 +631,16 @@ def find_devices(serial=None, product=None):
             logger.warning("Did not find device with serial %s, \
                             is device online?", serial)
     elif product is not None:
-        get_product_cmd = "shell getprop | grep ro.product.name"
         for device in all_devices:
-            device_prefix = "adb -s %s" %device
-            _, out = execute_adb_cmd(get_product_cmd, prefix=device_prefix)
-            out = '\n'.join(out)
-            #change out list to str
-            if product in out:
-                logger.debug("Gotcha! Device %s found!", serial)
+            props = cached_props(device)
+            if props is None:
+                _, out = execute_adb_cmd("shell getprop",
+                                         prefix="adb -s %s" %device)
+                props = parse_getprop(out)
+                if props:
+                    cache_props(device, props)
+            if product in props.get("ro.product.name", ""):
+                logger.debug("Gotcha! Device %s found!", device)
                 device_serials.append(device)
     else:
         logger.warning("Serial and product both not set, \
@@ -134,6 +650,14 @@ def find_devices(serial=None, product=None):
 
 def check_device_online(serial, retry_count=1, timeout=1):
     """check given device online or not"""
+    tracker = get_device_tracker()
+    if tracker is not None:
+        if tracker.wait_for_state(serial, DEVICE_STATUS["online"], timeout):
+            logger.info("Device %s online.", serial)
+            return True
+        logger.warning("Device %s keep offline in %d seconds.",
+                       serial, timeout)
+        return False
     count = 1
     while count <= retry_count:
         logger.debug("Try to connect to device %s %d time(s)", serial, count)
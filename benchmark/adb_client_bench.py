@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+""" Benchmark: per command latency of native adb client against spawning
+    adb binary. Both talk to a local fake adb server, the adb binary is the
+    stand-in from benchmark/bin so no real adb or device is needed.
+
+    python benchmark/adb_client_bench.py [-n ITERATIONS]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import adb
+from fake_adb_server import FakeADBServer
+
+SERIAL = "FAKE0001"
+
+
+def measure(func, iterations):
+    """ return average seconds per call """
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - start) / iterations
+
+def main(arg_list):
+    """ run benchmark and print a table """
+    parser = argparse.ArgumentParser(description="adb client benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args(arg_list)
+    server = FakeADBServer(devices={SERIAL: "device"},
+                           responses={"getprop ro.product.name":
+                                      (0, b"fake_product\n")}).start()
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + \
+                         os.environ["PATH"]
+    adb.ADB_HOST_PORT = server.port
+    commands = {
+        "devices": lambda: adb.execute_adb_cmd("devices"),
+        "shell": lambda: adb.execute_adb_cmd("shell getprop ro.product.name",
+                                             prefix="adb -s %s" %SERIAL),
+    }
+    print("%-10s %14s %14s %8s" %("command", "subprocess(ms)", "native(ms)",
+                                  "speedup"))
+    try:
+        for name in sorted(commands):
+            adb.NATIVE_CLIENT = False
+            spawn = measure(commands[name], max(args.iterations // 10, 1))
+            adb.NATIVE_CLIENT = True
+            native = measure(commands[name], args.iterations)
+            print("%-10s %14.3f %14.3f %7.1fx" %(name, spawn * 1000,
+                                                 native * 1000,
+                                                 spawn / native))
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Benchmark: device discovery and reboot handling against a fake adb server
+    with many virtual devices.
+    list: adb.list_all_devices()
+    find product: adb.find_devices(product=...), half of devices match
+    reboot: Device.reboot() then Device.wait_for_boot_complete() on several
+            devices at once
+
+    python benchmark/device_discovery_bench.py [-d DEVICES] [-r REBOOTS]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import adb
+from device import Device
+from fake_adb_server import FakeADBServer, virtual_devices
+
+PRODUCT = "bench"
+
+
+def measure(name, func, iterations=1):
+    """ print seconds per call of func, return its last result """
+    start = time.time()
+    for _ in range(iterations):
+        result = func()
+    print("%-24s %9.1f ms" %(name, (time.time() - start) * 1000 / iterations))
+    return result
+
+def reboot_all(devices):
+    """ reboot devices in parallel and wait for boot completed """
+    results = {}
+    def reboot(device):
+        """ worker body """
+        device.reboot()
+        results[device.serial] = device.wait_for_boot_complete()
+    threads = [threading.Thread(target=reboot, args=(d,)) for d in devices]
+    _ = [t.start() for t in threads]
+    _ = [t.join() for t in threads]
+    return results
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="device discovery benchmark")
+    parser.add_argument("-d", "--devices", type=int, default=200)
+    parser.add_argument("-r", "--reboots", type=int, default=5,
+                        help="devices rebooted at once")
+    parser.add_argument("--reboot-delay", type=float, default=2)
+    parser.add_argument("--boot-delay", type=float, default=3)
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    devices = virtual_devices(args.devices // 2, product=PRODUCT,
+                              prefix="BENCH",
+                              reboot_delay=args.reboot_delay,
+                              boot_delay=args.boot_delay) + \
+              virtual_devices(args.devices - args.devices // 2,
+                              product="other", prefix="OTHER")
+    server = FakeADBServer(devices=devices)
+    server.start()
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + \
+                         os.environ["PATH"]
+    adb.ADB_HOST_PORT = server.port
+    try:
+        print("%d virtual devices" %args.devices)
+        found = measure("list", adb.list_all_devices, 10)
+        assert len(found) == args.devices
+        found = measure("find product", lambda: adb.find_devices(
+                        product=PRODUCT), 3)
+        assert len(found) == args.devices // 2
+        targets = [Device(s, name="bench") for s in found[:args.reboots]]
+        results = measure("reboot %d devices" %len(targets),
+                          lambda: reboot_all(targets))
+        assert all(results.values()), results
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
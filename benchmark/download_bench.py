@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+""" Benchmark and self check of utils.download_image against a local
+    stand-in HTTP server with per connection bandwidth limit:
+    legacy single stream download vs parallel range download, resume of an
+    interrupted download, fallback when HEAD is refused and checksum
+    verification. Exits 1 if any check failed.
+
+    python benchmark/download_bench.py [--size-mb 64] [--rate-mb 20]
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import requests
+import utils
+from fake_http_server import FakeHTTPServer
+
+IMAGE_PATH = "/builds/image.zip"
+
+
+def legacy_download(url, path):
+    """ download_image before range support, kept for comparison """
+    r = requests.Session().get(url, stream=True)
+    local_file = os.path.join(path, url.split('/')[-1])
+    with open(local_file, 'wb') as fd:
+        for chunk in r.iter_content(chunk_size=1024):
+            if chunk:
+                fd.write(chunk)
+    return local_file
+
+def measure(name, size_mb, func, expected):
+    """ run download, check content and print throughput, return True if
+        content is intact
+    """
+    start = time.time()
+    local_file = func()
+    cost = time.time() - start
+    ok = utils.file_checksum(local_file) == expected
+    print("%-24s %8.2f s %8.1f MB/s  content %s"
+          %(name, cost, size_mb / cost, "ok" if ok else "CORRUPTED"))
+    os.remove(local_file)
+    return ok
+
+def check(name, ok):
+    """ print outcome of a self check, return ok """
+    print("%-4s %s" %("ok" if ok else "FAIL", name))
+    return ok
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="download benchmark")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-mb", type=float, default=20,
+                        help="bandwidth limit per connection, 0 unlimited")
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.WARNING)
+    content = os.urandom(args.size_mb * 1024 * 1024)
+    expected = hashlib.sha256(content).hexdigest()
+    server = FakeHTTPServer({IMAGE_PATH: content},
+                            bytes_per_second=args.rate_mb * 1024 * 1024)
+    server.start()
+    url = server.url(IMAGE_PATH)
+    directory = tempfile.mkdtemp(prefix="download_bench_")
+    results = []
+    try:
+        results.append(measure("legacy 1 stream", args.size_mb,
+                               lambda: legacy_download(url, directory),
+                               expected))
+        for workers in (1, 4, 8):
+            results.append(measure(
+                "range, %d workers" %workers, args.size_mb,
+                lambda: utils.download_image(url, path=directory,
+                                             workers=workers,
+                                             checksum="sha256:" + expected),
+                expected))
+        chunks = (len(content) + utils.DEFAULT_DOWNLOAD_CHUNK_SIZE - 1) \
+                 // utils.DEFAULT_DOWNLOAD_CHUNK_SIZE
+        #interrupted download: requests after half of the chunks fail
+        server.fail_after = server.requests + max(chunks // 2, 1)
+        server.fail_requests = 10**6
+        try:
+            utils.download_image(url, path=directory)
+            survived = True
+        except utils.DownloadError:
+            survived = False
+        results.append(check("resume: interrupted download fails",
+                             not survived))
+        server.fail_requests = 0
+        before = server.requests
+        results.append(measure("resume after failure", args.size_mb,
+                               lambda: utils.download_image(
+                                   url, path=directory,
+                                   checksum="sha256:" + expected),
+                               expected))
+        fetched = server.requests - before
+        results.append(check("resume fetched %d of %d chunks"
+                             %(fetched, chunks), fetched < chunks))
+        server.support_head = False
+        results.append(measure("HEAD refused, 1 stream", args.size_mb,
+                               lambda: utils.download_image(
+                                   url, path=directory,
+                                   checksum="sha256:" + expected),
+                               expected))
+        server.support_head = True
+        try:
+            utils.download_image(url, path=directory, checksum="sha256:00")
+            detected = False
+        except utils.DownloadError:
+            detected = True
+        results.append(check("checksum: mismatch detected", detected))
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+    print("%d of %d checks passed" %(sum(results), len(results)))
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+""" Fake adb server speaking the adb host protocol on a local port.
+    Only what framework uses is implemented:
+    host:version, host:devices, host:track-devices,
+    host:transport:<serial>, host:transport-any,
+    shell:<cmd>, exec:<cmd>, interactive exec:sh, reboot:<target> and root:
+    Every serial is a VirtualDevice with its own props, getprop, setprop and
+    reboot shell commands work on them, other shell responses are canned or
+    scripted, see FakeADBServer(responses=...).
+    A reboot drops the device from adb, brings it back offline, then online
+    with sys.boot_completed 0 and finally 1, with VirtualDevice delays.
+
+    python benchmark/fake_adb_server.py -d 200 --product bench
+"""
+
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+logger = logging.getLogger("FakeADBServer")
+logger.setLevel(logging.INFO)
+
+ADB_SERVER_VERSION = 41
+DEFAULT_DROP_DELAY = 0.2
+#seconds between reboot command and device leaving adb
+DEFAULT_REBOOT_DELAY = 2
+#seconds device is away from adb during reboot
+DEFAULT_OFFLINE_DELAY = 0.2
+#seconds device is listed offline before it comes online
+DEFAULT_BOOT_DELAY = 3
+#seconds from adb online to sys.boot_completed=1
+DEFAULT_ADBD_RESTART_DELAY = 0.3
+#seconds device is away while adbd restarts as root
+FASTBOOT_TARGETS = ("bootloader", "fastboot")
+
+_responses_lock = threading.Lock()
+#scripted responses are shared by every connection thread
+
+
+def next_response(response, serial, cmd):
+    """ (return code, output) of a canned response: a tuple, a list of
+        tuples returned one by one with the last one repeated, or a callable
+        taking (serial, cmd)
+    """
+    if callable(response):
+        return response(serial, cmd)
+    if isinstance(response, list):
+        with _responses_lock:
+            return response.pop(0) if len(response) > 1 else response[0]
+    return response
+
+
+class VirtualDevice(object):
+    """ state, props and canned responses of one fake device
+        responses: {shell command: response}, see next_response(), checked
+                   before server wide responses
+    """
+    def __init__(self, serial, state="device", props=None, responses=None,
+                 drop_delay=DEFAULT_DROP_DELAY,
+                 reboot_delay=DEFAULT_REBOOT_DELAY,
+                 boot_delay=DEFAULT_BOOT_DELAY):
+        self.serial = serial
+        self.state = state
+        self.props = {"ro.product.name": "fake",
+                      "ro.product.model": "Fake Device",
+                      "ro.serialno": serial,
+                      "ro.build.fingerprint":
+                          "fake/fake/fake:9/FAKE/1:userdebug/test-keys",
+                      "ro.build.version.sdk": "28",
+                      "sys.boot_completed": "1"}
+        self.props.update(props or {})
+        self.responses = responses if responses is not None else {}
+        self.drop_delay = drop_delay
+        self.reboot_delay = reboot_delay
+        self.boot_delay = boot_delay
+        self.reboots = 0
+        self.generation = 0
+        #bumped by every reboot, transitions of earlier ones stop
+
+    def getprop(self, args):
+        """ output of getprop with args """
+        if args:
+            return (self.props.get(args[0], "") + "\n").encode("utf-8")
+        return "".join("[%s]: [%s]\n" %(k, v) for k, v
+                       in sorted(self.props.items())).encode("utf-8")
+
+    def builtin(self, server, cmd):
+        """ (return code, output) of getprop/setprop/reboot shell commands,
+            None for others
+        """
+        with server.cond:
+            #props change in transition threads too
+            return self.__builtin(server, cmd)
+
+    def __builtin(self, server, cmd):
+        """ builtin() with server.cond held """
+        pipeline = [c.split() for c in cmd.split("|")]
+        args = pipeline[0]
+        if not args:
+            return None
+        if args[0] == "getprop":
+            out = self.getprop(args[1:])
+            for grep in pipeline[1:]:
+                if len(grep) != 2 or grep[0] != "grep":
+                    return None
+                out = b"".join(l for l in out.splitlines(True)
+                               if grep[1].encode("utf-8") in l)
+            return (0 if out or len(pipeline) == 1 else 1), out
+        if len(pipeline) > 1:
+            return None
+        if args[0] == "setprop" and len(args) == 3:
+            self.props[args[1]] = args[2]
+            return 0, b''
+        if args[0] == "reboot":
+            server.reboot(self.serial, args[1] if len(args) > 1 else None)
+            return 0, b''
+        return None
+
+
+class FakeADBHandler(socketserver.BaseRequestHandler):
+    """ one adb client connection """
+
+    def recv_exact(self, size):
+        """ read exactly size bytes, None if client closed connection """
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def read_request(self):
+        """ read one 4 hex digits length prefixed request """
+        length = self.recv_exact(4)
+        if length is None:
+            return None
+        service = self.recv_exact(int(length, 16))
+        return service.decode("utf-8") if service is not None else None
+
+    def okay(self, payload=None):
+        """ reply OKAY, with length prefixed payload if given """
+        reply = b'OKAY'
+        if payload is not None:
+            payload = payload.encode("utf-8")
+            reply += b"%04x" %len(payload) + payload
+        self.request.sendall(reply)
+
+    def payload(self, payload):
+        """ send length prefixed payload without status """
+        payload = payload.encode("utf-8")
+        self.request.sendall(b"%04x" %len(payload) + payload)
+
+    def fail(self, message):
+        """ reply FAIL with message """
+        message = message.encode("utf-8")
+        self.request.sendall(b'FAIL' + b"%04x" %len(message) + message)
+
+    def interactive_shell(self, serial):
+        """ feed lines written by client to server.run_line until closed """
+        status, pending = [0], b''
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            out = b''.join(self.server.run_line(serial, l.decode("utf-8"),
+                                                status) for l in lines)
+            if out:
+                self.request.sendall(out)
+
+    def track_devices(self):
+        """ push device list on connect and on every change """
+        server, version = self.server, None
+        while True:
+            with server.cond:
+                while server.version == version:
+                    server.cond.wait()
+                version = server.version
+                device_list = server.device_list()
+            try:
+                self.payload(device_list)
+            except socket.error:
+                return
+
+    def handle(self):
+        server = self.server
+        serial = None
+        while True:
+            service = self.read_request()
+            if service is None:
+                return
+            if server.latency:
+                time.sleep(server.latency)
+            if service == "host:version":
+                self.okay("%04x" %ADB_SERVER_VERSION)
+                return
+            elif service == "host:devices":
+                self.okay(server.device_list())
+                return
+            elif service == "host:track-devices":
+                self.okay()
+                self.track_devices()
+                return
+            elif service == "host:transport-any":
+                online = [s for s, st in server.devices.items()
+                          if st == "device"]
+                if not online:
+                    self.fail("no devices/emulators found")
+                    return
+                serial = online[0]
+                self.okay()
+            elif service.startswith("host:transport:"):
+                serial = service[len("host:transport:"):]
+                if server.devices.get(serial) != "device":
+                    self.fail("device '%s' not found" %serial)
+                    return
+                self.okay()
+            elif serial is not None and service.startswith("shell:"):
+                self.okay()
+                self.request.sendall(server.run_shell(serial,
+                                                      service[6:]))
+                return
+            elif serial is not None and service == "exec:sh":
+                self.okay()
+                self.interactive_shell(serial)
+                return
+            elif serial is not None and service.startswith("exec:"):
+                self.okay()
+                _, out = server.respond(serial, service[5:])
+                self.request.sendall(out)
+                return
+            elif serial is not None and service.startswith("reboot:"):
+                self.okay()
+                server.reboot(serial, service[7:] or None)
+                return
+            elif serial is not None and service == "root:":
+                self.okay()
+                self.request.sendall(b"restarting adbd as root\n")
+                server.restart_adbd(serial)
+                return
+            else:
+                self.fail("unknown host service")
+                return
+
+
+class FakeADBServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ fake adb server
+        devices: {serial: state} or [VirtualDevice]
+        responses: {shell command: (return code, output bytes)}, values
+                   could also be scripted, see next_response()
+        latency: seconds to sleep before answering every request
+
+        server = FakeADBServer(devices=virtual_devices(200, product="x"))
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, devices=None, responses=None, latency=0):
+        socketserver.TCPServer.__init__(self, ("127.0.0.1", port),
+                                        FakeADBHandler)
+        if devices is None:
+            devices = {"FAKE0001": "device"}
+        if isinstance(devices, dict):
+            devices = [VirtualDevice(s, st) for s, st in devices.items()]
+        self.virtual = dict((d.serial, d) for d in devices)
+        self.devices = dict((d.serial, d.state) for d in devices)
+        #states listed by adb, devices away from adb are not in it
+        self.responses = responses if responses is not None else {}
+        self.latency = latency
+        self.thread = None
+        self.version = 0
+        self.cond = threading.Condition()
+
+    @property
+    def port(self):
+        """ listening port """
+        return self.server_address[1]
+
+    def device_list(self):
+        """ 'serial\tstate\n' lines as host:devices payload """
+        return "".join("%s\t%s\n" %(s, st) for s, st
+                       in sorted(self.devices.items()))
+
+    def set_device_state(self, serial, state):
+        """ change device state, None removes device from adb, trackers
+            notified, unknown serial becomes a new VirtualDevice
+        """
+        with self.cond:
+            if serial not in self.virtual:
+                self.virtual[serial] = VirtualDevice(serial, state)
+            self.virtual[serial].state = state
+            if state is None:
+                self.devices.pop(serial, None)
+            else:
+                self.devices[serial] = state
+            self.version += 1
+            self.cond.notify_all()
+
+    def respond(self, serial, cmd):
+        """ (return code, output) of a command: canned response of device,
+            then of server, then getprop/setprop/reboot, default (0, b'')
+        """
+        device = self.virtual.get(serial)
+        if device is not None and cmd in device.responses:
+            return next_response(device.responses[cmd], serial, cmd)
+        if cmd in self.responses:
+            return next_response(self.responses[cmd], serial, cmd)
+        if device is not None:
+            result = device.builtin(self, cmd)
+            if result is not None:
+                return result
+        return 0, b''
+
+    def __transition(self, serial, steps, restart=False):
+        """ apply [(delay, state, props)] in background, state None removes
+            device from adb, False keeps it. restart: device restarts, the
+            remaining steps of earlier transitions are cancelled, while a
+            later restart cancels this one
+        """
+        device = self.virtual[serial]
+        with self.cond:
+            if restart:
+                device.generation += 1
+            generation = device.generation
+        def run():
+            """ transition thread body """
+            for delay, state, props in steps:
+                time.sleep(delay)
+                with self.cond:
+                    if device.generation != generation:
+                        return
+                    device.props.update(props)
+                    if state is not False:
+                        self.set_device_state(serial, state)
+        thread = threading.Thread(target=run, name="transition-%s" %serial)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def reboot(self, serial, target=None):
+        """ reboot device in background, to bootloader/fastboot it does not
+            come back to adb
+        """
+        device = self.virtual[serial]
+        with self.cond:
+            device.reboots += 1
+        logger.info("Reboot %s %s", serial, target or "")
+        steps = [(device.drop_delay, None, {"sys.boot_completed": "0"})]
+        if target not in FASTBOOT_TARGETS:
+            steps += [(device.reboot_delay, "offline", {}),
+                      (DEFAULT_OFFLINE_DELAY, "device", {}),
+                      (device.boot_delay, False, {"sys.boot_completed": "1"})]
+        return self.__transition(serial, steps, restart=True)
+
+    def restart_adbd(self, serial):
+        """ device leaves adb while adbd restarts, e.g. for adb root """
+        return self.__transition(serial,
+                                 [(0, None, {}),
+                                  (DEFAULT_ADBD_RESTART_DELAY, "device", {})])
+
+    def run_line(self, serial, line, status):
+        """ 'run' one shell line, echo is the only builtin, command groups
+            '{ cmd' ... '}' are unwrapped, status[0] keeps $?
+        """
+        if line.startswith("{ "):
+            line = line[2:]
+        if line.startswith("echo "):
+            return line[5:].replace("$?", str(status[0])).encode("utf-8") \
+                   + b"\n"
+        if not line or line.startswith("}"):
+            return b''
+        status[0], out = self.respond(serial, line)
+        return out
+
+    def run_shell(self, serial, script):
+        """ 'run' script line by line """
+        status = [0]
+        return b''.join(self.run_line(serial, line, status)
+                        for line in script.split("\n"))
+
+    def start(self):
+        """ serve in a daemon thread """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ stop serving and close socket """
+        self.shutdown()
+        self.server_close()
+
+
+def virtual_devices(count, product="fake", props=None, prefix="FAKE",
+                    **kwargs):
+    """ count online VirtualDevice FAKE0000... with ro.product.name product,
+        other keyword arguments are passed to VirtualDevice
+    """
+    devices = []
+    for i in range(count):
+        device_props = {"ro.product.name": product}
+        device_props.update(props or {})
+        devices.append(VirtualDevice("%s%04d" %(prefix, i),
+                                     props=device_props, **kwargs))
+    return devices
+
+def main(arg_list):
+    """ run fake adb server in foreground """
+    parser = argparse.ArgumentParser(description="Fake adb server")
+    parser.add_argument("-p", "--port", type=int, default=5037)
+    parser.add_argument("-d", "--devices", type=int, default=1,
+                        help="number of online fake devices")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds to wait before each reply")
+    parser.add_argument("--product", default="fake",
+                        help="ro.product.name of devices")
+    parser.add_argument("--prop", action="append", default=[],
+                        metavar="NAME=VALUE", help="extra device prop")
+    parser.add_argument("--reboot-delay", type=float,
+                        default=DEFAULT_REBOOT_DELAY,
+                        help="seconds device is away from adb on reboot")
+    parser.add_argument("--boot-delay", type=float,
+                        default=DEFAULT_BOOT_DELAY,
+                        help="seconds from adb online to boot completed")
+    args = parser.parse_args(arg_list)
+    props = dict(p.split("=", 1) for p in args.prop)
+    devices = virtual_devices(args.devices, product=args.product,
+                              props=props, reboot_delay=args.reboot_delay,
+                              boot_delay=args.boot_delay)
+    server = FakeADBServer(port=args.port, devices=devices,
+                           latency=args.latency)
+    logger.info("Fake adb server listening on %d", server.port)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
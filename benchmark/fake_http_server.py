@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+""" Local stand-in of an image server: serves in-memory files with HEAD,
+    ETag and single Range GET support. Per connection bandwidth could be
+    limited to mimic a remote build server, and requests could be made to
+    fail to exercise download retry/resume.
+"""
+
+import time
+import hashlib
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+WRITE_BLOCK = 64 * 1024
+
+
+class FakeHTTPHandler(BaseHTTPRequestHandler):
+    """ HEAD/GET of server.files """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_file_headers(self, content, start, end):
+        """ status and headers of whole file or range """
+        status = 206 if self.server.support_range and \
+                        "Range" in self.headers else 200
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"%s"' %self.server.etags[self.path])
+        if status == 206:
+            self.send_header("Content-Range", "bytes %d-%d/%d"
+                             %(start, end, len(content)))
+        self.end_headers()
+
+    def parse_range(self, size):
+        """ (start, end) of Range header, whole file if none """
+        header = self.headers.get("Range")
+        if not header or not self.server.support_range:
+            return 0, size - 1
+        start, end = header.split("=", 1)[1].split("-", 1)
+        return int(start), min(int(end) if end else size - 1, size - 1)
+
+    def do_HEAD(self):
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        if not self.server.support_head:
+            self.send_error(405)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        if self.server.support_range:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"%s"' %self.server.etags[self.path])
+        self.end_headers()
+
+    def do_GET(self):
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        if self.server.should_fail():
+            self.send_error(503)
+            return
+        start, end = self.parse_range(len(content))
+        self.send_file_headers(content, start, end)
+        rate = self.server.bytes_per_second
+        offset = start
+        while offset <= end:
+            block = content[offset:min(offset + WRITE_BLOCK, end + 1)]
+            self.wfile.write(block)
+            offset += len(block)
+            if rate:
+                time.sleep(float(len(block)) / rate)
+
+
+class FakeHTTPServer(ThreadingMixIn, HTTPServer):
+    """ files: {"/path": bytes}
+        bytes_per_second: bandwidth limit of each connection, 0 unlimited
+        fail_requests: number of GET requests to answer with 503 after
+                       fail_after successful ones
+        support_head: answer HEAD with 405 if False, as some proxies do
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, files, bytes_per_second=0, support_range=True):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeHTTPHandler)
+        self.files = files
+        self.etags = dict((p, hashlib.md5(c).hexdigest())
+                          for p, c in files.items())
+        self.bytes_per_second = bytes_per_second
+        self.support_range = support_range
+        self.support_head = True
+        self.fail_after = None
+        self.fail_requests = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def should_fail(self):
+        """ count request, True if it should be answered with an error """
+        with self.lock:
+            self.requests += 1
+            if self.fail_after is not None and \
+               self.requests > self.fail_after and self.fail_requests > 0:
+                self.fail_requests -= 1
+                return True
+            return False
+
+    def url(self, path):
+        """ full url of served path """
+        return "http://127.0.0.1:%d%s" %(self.server_address[1], path)
+
+    def start(self):
+        """ serve in a daemon thread """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ stop serving and close socket """
+        self.shutdown()
+        self.server_close()
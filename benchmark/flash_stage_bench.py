@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+""" Benchmark: time until the first fastboot flash command could run.
+    serial: previous behaviour, download, then unzip, then reboot device
+    pipelined: image cache fetch extracting while downloading, with reboot
+               to fastboot running at the same time
+    Image comes from a bandwidth limited local HTTP server, reboot is a
+    sleep of --reboot seconds.
+
+    python benchmark/flash_stage_bench.py [--size-mb 64] [--rate-mb 20]
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import logging
+import zipfile
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import utils
+import image_cache
+from fake_http_server import FakeHTTPServer
+
+IMAGE_PATH = "/builds/image.zip"
+PARTITIONS = ("boot.img", "system.img", "vendor.img", "userdata.img")
+
+
+def generate_image(size_mb):
+    """ zip of partition images, half random and half compressible data """
+    member_size = size_mb * 1024 * 1024 // len(PARTITIONS)
+    content = io.BytesIO()
+    archive = zipfile.ZipFile(content, "w", zipfile.ZIP_DEFLATED)
+    for name in PARTITIONS:
+        data = os.urandom(member_size // 2) + b"\0" * (member_size // 2)
+        archive.writestr(name, data)
+    archive.close()
+    return content.getvalue()
+
+def serial_stage(url, directory, reboot):
+    """ download, unzip with shell command, then reboot """
+    local_file = utils.download_image(url, path=directory)
+    utils.execute_shell_cmd("unzip -d %s/ %s" %(local_file[:-4], local_file))
+    time.sleep(reboot)
+    return local_file[:-4]
+
+def pipelined_stage(url, directory, reboot):
+    """ reboot thread next to image cache fetch """
+    reboot_thread = threading.Thread(target=time.sleep, args=(reboot,))
+    reboot_thread.start()
+    with image_cache.ImageCache(directory).open(url) as image_dir:
+        reboot_thread.join()
+        return image_dir
+
+def check(image_dir, content):
+    """ True if every partition image is extracted correctly """
+    archive = zipfile.ZipFile(io.BytesIO(content))
+    for name in PARTITIONS:
+        with open(os.path.join(image_dir, name), "rb") as image_fd:
+            if image_fd.read() != archive.read(name):
+                return False
+    return True
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="flash staging benchmark")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-mb", type=float, default=20,
+                        help="bandwidth limit per connection, 0 unlimited")
+    parser.add_argument("--reboot", type=float, default=10,
+                        help="seconds a reboot to fastboot takes")
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.WARNING)
+    content = generate_image(args.size_mb)
+    server = FakeHTTPServer({IMAGE_PATH: content},
+                            bytes_per_second=args.rate_mb * 1024 * 1024)
+    server.start()
+    url = server.url(IMAGE_PATH)
+    print("%.1f MB zip, reboot %.1f s" %(len(content) / 1048576.0,
+                                         args.reboot))
+    try:
+        for name, stage in (("serial", serial_stage),
+                            ("pipelined", pipelined_stage)):
+            directory = tempfile.mkdtemp(prefix="flash_stage_bench_")
+            try:
+                start = time.time()
+                image_dir = stage(url, directory, args.reboot)
+                cost = time.time() - start
+                print("%-10s %8.2f s to first flash, images %s"
+                      %(name, cost, "ok" if check(image_dir, content)
+                                    else "CORRUPTED"))
+            finally:
+                shutil.rmtree(directory)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+""" Benchmark: framework overhead without boards. Synthetic suites are run
+    through runner.main against a local fake adb server, with stand-in adb
+    and fastboot binaries from benchmark/bin first on PATH. Every scenario
+    runs in its own process, so startup time and peak RSS are its own.
+
+    empty: cases which only pass, per case overhead
+    adb: COMMANDS adb shell commands per case through native client
+    adb-binary: same commands through the stand-in adb binary
+    fastboot: COMMANDS fastboot getvar per case
+    retry: cases failing their first round, per retry overhead without
+           framework.CASE_RETRY_INTERVAL sleep between rounds
+    logcat: empty cases with background logcat capture
+    trace: empty cases with span tracing
+
+    python benchmark/framework_bench.py [-n CASES] [-c COMMANDS]
+        [--latency SECONDS] [--output-bytes BYTES] [--save BASELINE]
+        [--compare BASELINE] [scenario ...]
+
+    --save writes results as JSON, --compare prints change against a saved
+    baseline and exits 1 if a metric regressed more than --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import collections
+import resource
+import tempfile
+import subprocess
+
+PROCESS_STARTED = time.time()
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+SERIAL = "FAKE0001"
+BENCH_CMD = "bench_cmd"
+SCENARIOS = ("empty", "adb", "adb-binary", "fastboot", "retry", "logcat",
+             "trace")
+RETRY_CASES = 10
+#every retry sleeps, keep retry scenario short
+CASE_SOURCES = {
+    "empty": "case_pass(result, 'ok', logger)\n",
+    "adb": "for _ in range(%(commands)d):\n"
+           "    test_device.execute_adb_shell_cmd('" + BENCH_CMD + "')\n"
+           "case_pass(result, 'ok', logger)\n",
+    "fastboot": "for _ in range(%(commands)d):\n"
+                "    test_device.execute_fastboot_cmd('getvar all')\n"
+                "case_pass(result, 'ok', logger)\n",
+    "retry": "try:\n"
+             "    bench_tried\n"
+             "    case_pass(result, 'ok', logger)\n"
+             "except NameError:\n"
+             "    bench_tried = True\n"
+             "    case_fail(result, 'first round', logger)\n",
+}
+CASE_SOURCES["adb-binary"] = CASE_SOURCES["adb"]
+CASE_SOURCES["logcat"] = CASE_SOURCES["trace"] = CASE_SOURCES["empty"]
+HIGHER_IS_BETTER = ("cases_per_s",)
+METRICS = ("startup_s", "cases_per_s", "case_ms", "per_command_ms",
+           "per_retry_ms", "peak_rss_mb")
+
+
+def generate_suite(directory, scenario, cases, commands):
+    """ write suite yaml and case file of scenario, return suite path """
+    with open(os.path.join(directory, "case.py"), "w") as case_fd:
+        case_fd.write(CASE_SOURCES[scenario] %{"commands": commands})
+    suite_path = os.path.join(directory, "suite.yaml")
+    with open(suite_path, "w") as suite_fd:
+        suite_fd.write("suite_name: bench\n")
+        suite_fd.write("test_device: {name: bench, serial: %s}\n" %SERIAL)
+        suite_fd.write("case:\n")
+        for i in range(cases):
+            suite_fd.write("- case_%d:\n    name: bench.case_%d\n"
+                           "    path: case.py\n    retry_count: 2\n"
+                           "    timeout: 60\n" %(i, i))
+    return suite_path
+
+def run_scenario(scenario, directory, cases, commands):
+    """ run suite through runner.main in this process, return metrics """
+    import adb
+    import runner
+    if scenario == "adb-binary":
+        adb.NATIVE_CLIENT = False
+    os.chdir(directory)
+    suite_path = generate_suite(directory, scenario, cases, commands)
+    args = ["-t", suite_path, "--no-history"]
+    if scenario != "logcat":
+        args.append("--no-logcat")
+    if scenario == "trace":
+        args.extend(["--trace", os.path.join(directory, "trace.json")])
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.FileHandler(os.path.join(directory,
+                                                            "bench.log")))
+    root_logger.setLevel(logging.DEBUG)
+    #same log volume as runner, written to a file instead of the terminal
+    runner.main(args)
+    finished = time.time()
+    started = []
+    results_dir = os.path.join(directory, "results")
+    for name in os.listdir(results_dir):
+        if name.endswith(".jsonl"):
+            with open(os.path.join(results_dir, name)) as result_fd:
+                for line in result_fd:
+                    record = json.loads(line)
+                    if record.get("type") == "case":
+                        started.append(record["case"]["started"])
+    first = min(started)
+    return {"cases": len(started),
+            "startup_s": first - PROCESS_STARTED,
+            "cases_per_s": len(started) / (finished - first),
+            "case_ms": (finished - first) * 1000 / len(started),
+            "peak_rss_mb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+def spawn_scenario(scenario, args, env):
+    """ run scenario in a child process, return its metrics """
+    directory = tempfile.mkdtemp(prefix="framework_bench_")
+    try:
+        cases = min(args.cases, RETRY_CASES) if scenario == "retry" \
+                else args.cases
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "--child", scenario,
+             "--dir", directory, "-n", str(cases), "-c", str(args.commands)],
+            env=env)
+        return json.loads(output.decode("utf-8").strip().split("\n")[-1])
+    finally:
+        shutil.rmtree(directory)
+
+def derive(results, commands):
+    """ per command and per retry overhead against empty scenario, the
+        sleep between rounds is not framework overhead
+    """
+    import framework
+    empty = results.get("empty")
+    if empty is None:
+        return
+    for name in ("adb", "adb-binary", "fastboot"):
+        if name in results:
+            results[name]["per_command_ms"] = \
+                (results[name]["case_ms"] - empty["case_ms"]) / commands
+    if "retry" in results:
+        results["retry"]["per_retry_ms"] = \
+            results["retry"]["case_ms"] - empty["case_ms"] - \
+            framework.CASE_RETRY_INTERVAL * 1000
+
+def print_table(results):
+    """ print one row per scenario """
+    print("%-11s %6s %9s %9s %9s %11s %11s %8s" %(
+          "scenario", "cases", "startup", "cases/s", "ms/case", "ms/command",
+          "ms/retry", "RSS MB"))
+    for name, r in results.items():
+        print("%-11s %6d %8.2fs %9.1f %9.2f %11s %11s %8.1f" %(
+              name, r["cases"], r["startup_s"], r["cases_per_s"],
+              r["case_ms"], "%.2f" %r["per_command_ms"]
+              if "per_command_ms" in r else "-", "%.1f" %r["per_retry_ms"]
+              if "per_retry_ms" in r else "-", r["peak_rss_mb"]))
+
+def compare(results, baseline, tolerance):
+    """ print change of every metric against baseline, return regressions """
+    regressions = []
+    for name, r in results.items():
+        for metric in METRICS:
+            old = baseline.get(name, {}).get(metric)
+            if metric not in r or not old:
+                continue
+            change = (r[metric] - old) / abs(old)
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = "REGRESSED" if worse > tolerance else ""
+            print("%-11s %-15s %10.3f -> %10.3f %+7.1f%% %s" %(
+                  name, metric, old, r[metric], change * 100, flag))
+            if flag:
+                regressions.append((name, metric))
+    return regressions
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="framework overhead "
+                                                 "benchmark")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    parser.add_argument("-n", "--cases", type=int, default=200)
+    parser.add_argument("-c", "--commands", type=int, default=5,
+                        help="commands per case")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds fake adb server, adb and fastboot "
+                             "take per command")
+    parser.add_argument("--output-bytes", type=int, default=1024,
+                        help="output size of every fake command")
+    parser.add_argument("--port", type=int, default=0,
+                        help="fake adb server port, e.g. 5037, default any")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression, default "
+                             "%(default)s")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(arg_list)
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.dir, args.cases,
+                                      args.commands)))
+        return 0
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios %s" %", ".join(sorted(unknown)))
+    from fake_adb_server import FakeADBServer
+    logging.disable(logging.CRITICAL)
+    line = b"x" * 63 + b"\n"
+    server = FakeADBServer(port=args.port, devices={SERIAL: "device"},
+                           responses={BENCH_CMD: (0, line * (
+                               args.output_bytes // len(line)))},
+                           latency=args.latency)
+    server.start()
+    env = dict(os.environ)
+    env.update({"ANDROID_ADB_SERVER_PORT": str(server.port),
+                "PATH": os.path.join(BENCH_DIR, "bin") + os.pathsep +
+                        env["PATH"],
+                "FAKE_ADB_LATENCY": str(args.latency),
+                "FAKE_FASTBOOT_LATENCY": str(args.latency),
+                "FAKE_FASTBOOT_OUTPUT_BYTES": str(args.output_bytes)})
+    results = collections.OrderedDict()
+    try:
+        for scenario in SCENARIOS:
+            #empty is the reference of per command and per retry overhead
+            if scenario in args.scenarios or scenario == "empty":
+                results[scenario] = spawn_scenario(scenario, args, env)
+    finally:
+        server.stop()
+    derive(results, args.commands)
+    print("%d cases, %d commands per case, latency %.3fs, output %d bytes"
+          %(args.cases, args.commands, args.latency, args.output_bytes))
+    print_table(results)
+    results = {"config": {"cases": args.cases, "commands": args.commands,
+                          "latency": args.latency,
+                          "output_bytes": args.output_bytes},
+               "scenarios": results}
+    if args.save:
+        with open(args.save, "w") as save_fd:
+            json.dump(results, save_fd, indent=2, sort_keys=True)
+        print("Results saved to %s" %args.save)
+    if args.compare:
+        with open(args.compare) as baseline_fd:
+            baseline = json.load(baseline_fd)
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline config %s differs" %baseline["config"])
+        if compare(results["scenarios"], baseline["scenarios"],
+                   args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
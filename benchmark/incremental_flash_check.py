@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+""" Check and benchmark of incremental flashing with the stand-in fastboot
+    binary in benchmark/bin, which records every command it receives.
+    Every scenario prints the flash commands fastboot got and the time the
+    flash took with --delay seconds per flash command.
+
+    python benchmark/incremental_flash_check.py [--delay 0.5]
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import adb
+import flash_state
+from device import Device
+from fake_adb_server import FakeADBServer
+
+SERIAL = "FAKE0001"
+PARTITIONS = ("boot", "system", "vendor")
+FLASH_COMMANDS = ["erase misc"] + \
+                 ["flash %s %s.img" %(p, p) for p in PARTITIONS] + \
+                 ["reboot"]
+
+
+def write_image(image_dir, partition, content):
+    """ write partition image of staged build """
+    with open(os.path.join(image_dir, "%s.img" %partition), "wb") as img_fd:
+        img_fd.write(content)
+
+def flash(device, image_dir, log_file, incremental=True, commands=None):
+    """ flash and return (success, seconds, commands fastboot received) """
+    open(log_file, "w").close()
+    start = time.time()
+    success = device.fastboot_flash_dir(image_dir, commands or FLASH_COMMANDS,
+                                        incremental=incremental)
+    cost = time.time() - start
+    with open(log_file) as log_fd:
+        received = [line.rstrip("\n").split("\t", 1)[1] for line in log_fd]
+    return success, cost, received
+
+def check(name, outcome, expected_flashed, expected_success=True):
+    """ print scenario outcome, return True if flashed partitions match """
+    success, cost, received = outcome
+    flashed = [c.split()[1] for c in received if c.startswith("flash ")]
+    ok = flashed == list(expected_flashed) and success == expected_success
+    print("%-4s %-34s %6.2f s  flashed %s"
+          %("ok" if ok else "FAIL", name, cost, ",".join(flashed) or "-"))
+    return ok
+
+def main(arg_list):
+    """ run scenarios """
+    parser = argparse.ArgumentParser(description="incremental flash check")
+    parser.add_argument("--delay", type=float, default=0.5,
+                        help="seconds every fake flash command takes")
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    work_dir = tempfile.mkdtemp(prefix="incremental_flash_")
+    image_dir = os.path.join(work_dir, "image")
+    os.makedirs(image_dir)
+    log_file = os.path.join(work_dir, "fastboot.log")
+    for partition in PARTITIONS:
+        write_image(image_dir, partition, os.urandom(1024 * 1024))
+    server = FakeADBServer(devices={SERIAL: "device"})
+    server.start()
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + \
+                         os.environ["PATH"]
+    os.environ["FAKE_FASTBOOT_LOG"] = log_file
+    os.environ["FAKE_FASTBOOT_DEVICES"] = SERIAL
+    os.environ["FAKE_FASTBOOT_DELAY"] = str(args.delay)
+    flash_state.DEFAULT_FLASH_STATE_DIR = os.path.join(work_dir, "state")
+    adb.ADB_HOST_PORT = server.port
+    results = []
+    try:
+        device = Device(SERIAL, name="bench")
+        results.append(check("unknown state: full flash",
+                             flash(device, image_dir, log_file), PARTITIONS))
+        results.append(check("same build: nothing flashed",
+                             flash(device, image_dir, log_file), ()))
+        write_image(image_dir, "boot", os.urandom(1024 * 1024))
+        results.append(check("boot.img changed",
+                             flash(device, image_dir, log_file), ("boot",)))
+        results.append(check("erase system before flash",
+                             flash(device, image_dir, log_file,
+                                   commands=["erase system"] + FLASH_COMMANDS),
+                             ("system",)))
+        write_image(image_dir, "vendor", os.urandom(1024 * 1024))
+        os.environ["FAKE_FASTBOOT_FAIL"] = "flash vendor"
+        results.append(check("vendor flash fails",
+                             flash(device, image_dir, log_file), ("vendor",),
+                             expected_success=False))
+        del os.environ["FAKE_FASTBOOT_FAIL"]
+        results.append(check("retry after failure",
+                             flash(device, image_dir, log_file), ("vendor",)))
+        write_image(image_dir, "boot", os.urandom(1024 * 1024))
+        results.append(check("full flash records state",
+                             flash(device, image_dir, log_file,
+                                   incremental=False), PARTITIONS))
+        results.append(check("incremental after full flash",
+                             flash(device, image_dir, log_file), ()))
+        slot_b = ["flash boot boot.img --slot=b"]
+        results.append(check("boot to slot b",
+                             flash(device, image_dir, log_file,
+                                   commands=slot_b), ("boot",)))
+        results.append(check("same boot to slot b",
+                             flash(device, image_dir, log_file,
+                                   commands=slot_b), ()))
+        results.append(check("active slot after slot b",
+                             flash(device, image_dir, log_file), ("boot",)))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+    print("%d of %d scenarios passed" %(sum(results), len(results)))
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
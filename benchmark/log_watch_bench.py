@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+""" Benchmark: logcat watch throughput on synthetic logs with a few hundred
+    patterns.
+    per pattern: every pattern searched in every line
+    combined: LogWatch, one combined regex per batch of lines
+
+    python benchmark/log_watch_bench.py [-n LINES] [-p PATTERNS]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import log_watch
+
+BATCH_LINES = 500
+#lines parsed from one read of the logcat stream
+TAGS = ["ActivityManager", "WindowManager", "MediaCodec", "wpa_supplicant",
+        "SurfaceFlinger", "chatty", "PackageManager", "audio_hw"]
+
+
+def generate_patterns(count):
+    """ default patterns plus count synthetic service failure patterns """
+    patterns = log_watch.load_patterns(log_watch.DEFAULT_PATTERNS)
+    for i in range(count - len(patterns)):
+        patterns.append(log_watch.WatchPattern(
+            "service_%d" %i, r"E Service%d: (?:fail|error) code \d+" %i))
+    return patterns
+
+def generate_lines(count, hits):
+    """ threadtime style lines, hits of them match some pattern """
+    lines = []
+    for i in range(count):
+        lines.append("10-17 12:00:%02d.%03d  %4d  %4d %s %s: message %d %s"
+                     %(i // 1000 % 60, i % 1000, 1000 + i % 50,
+                       2000 + i % 300, random.choice("VDIWE"),
+                       random.choice(TAGS), i, "x" * random.randint(0, 80)))
+    for i in random.sample(range(count), hits):
+        lines[i] = "10-17 12:00:00.000  1000  1000 E Service%d: fail " \
+                   "code 3" %random.randint(0, 100)
+    return lines
+
+def per_pattern(patterns, lines):
+    """ match count of searching every pattern in every line """
+    return sum(1 for line in lines for p in patterns if p.regex.search(line))
+
+def combined(watch, lines):
+    """ match count of LogWatch over batches of lines """
+    return sum(1 for start in range(0, len(lines), BATCH_LINES)
+               for _ in watch.scan(lines[start:start + BATCH_LINES]))
+
+def measure(name, func, count):
+    """ print lines per second of func, return its result """
+    start = time.time()
+    result = func()
+    cost = time.time() - start
+    print("%-14s %10.0f lines/s %6d matches" %(name, count / cost, result))
+    return result
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="logcat watch benchmark")
+    parser.add_argument("-n", "--lines", type=int, default=200000)
+    parser.add_argument("-p", "--patterns", type=int, default=300)
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    patterns = generate_patterns(args.patterns)
+    lines = generate_lines(args.lines, 50)
+    start = time.time()
+    watch = log_watch.LogWatch(patterns)
+    print("%d patterns compiled in %.1f ms" %(len(watch),
+                                              (time.time() - start) * 1000))
+    expected = measure("per pattern", lambda: per_pattern(patterns, lines),
+                       args.lines)
+    assert measure("combined", lambda: combined(watch, lines),
+                   args.lines) == expected
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
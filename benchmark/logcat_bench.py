@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+""" Benchmark: logcat lines per second captured by LogcatReader from a local
+    fake adb server serving a synthetic binary logcat stream, and the cost
+    of a case window on the case thread.
+
+    python benchmark/logcat_bench.py [-n LINES]
+"""
+
+import os
+import sys
+import time
+import struct
+import shutil
+import random
+import logging
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import adb
+import logcat
+from fake_adb_server import FakeADBServer
+
+SERIAL = "FAKE0001"
+TAGS = [b"ActivityManager", b"WindowManager", b"MediaCodec", b"wpa_supplicant",
+        b"SurfaceFlinger", b"chatty"]
+
+
+def generate_stream(count):
+    """ binary logcat stream of count v4 entries """
+    entries = []
+    base = int(time.time())
+    for i in range(count):
+        message = b"synthetic message %d %s" %(i, b"x" * random.randint(0, 80))
+        payload = struct.pack("<B", random.randint(2, 6)) + \
+                  random.choice(TAGS) + b"\0" + message + b"\0"
+        entries.append(struct.pack("<HHiIIIII", len(payload), 28,
+                                   1000 + i % 50, 2000 + i % 300,
+                                   base + i // 1000, (i % 1000) * 1000000,
+                                   0, 1000) + payload)
+    return b"".join(entries)
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="logcat capture benchmark")
+    parser.add_argument("-n", "--lines", type=int, default=200000)
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    stream = generate_stream(args.lines)
+
+    start = time.time()
+    entries, _ = logcat.parse_entries(bytearray(stream))
+    lines = [l for e in entries for l in logcat.format_entry(e)]
+    cost = time.time() - start
+    print("%-20s %10.0f lines/s" %("parse only", len(lines) / cost))
+
+    server = FakeADBServer(devices={SERIAL: "device"},
+                           responses={logcat.LOGCAT_CMD
+                                      %logcat.LOGCAT_BUFFERS: (0, stream)})
+    server.start()
+    adb.ADB_HOST_PORT = server.port
+    directory = tempfile.mkdtemp(prefix="logcat_bench_")
+    try:
+        reader = logcat.LogcatReader(SERIAL, os.path.join(directory,
+                                                          "spool.gz"),
+                                     ring_size=args.lines // 4)
+        start = time.time()
+        reader.start()
+        while reader.mark() < args.lines:
+            time.sleep(0.01)
+        cost = time.time() - start
+        print("%-20s %10.0f lines/s" %("capture + spool", args.lines / cost))
+        reader.stop()
+        window = args.lines // 10
+        start = time.time()
+        assert len(reader.window(args.lines - window, args.lines)) == window
+        print("%-20s %10.1f ms" %("ring window %d" %window,
+                                  (time.time() - start) * 1000))
+        start = time.time()
+        assert len(reader.window(0, window)) == window
+        print("%-20s %10.1f ms" %("spool window %d" %window,
+                                  (time.time() - start) * 1000))
+        print("spool %.1f MB for %.1f MB binary log" %(
+              os.path.getsize(reader.spool_path) / 1e6, len(stream) / 1e6))
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
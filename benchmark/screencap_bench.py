@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Benchmark: screenshots per second against a local fake adb server
+    serving a 1080x1920 frame.
+    legacy: screencap -p to a device file, then adb pull with adb binary
+    exec-out png: Device.screencap_data()
+    exec-out raw: Device.screencap_image(), raw framebuffer decoded by PIL
+
+    python benchmark/screencap_bench.py [-n ITERATIONS]
+"""
+
+import io
+import os
+import sys
+import time
+import struct
+import shutil
+import logging
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+from PIL import Image
+
+import adb
+from device import Device
+from fake_adb_server import FakeADBServer
+
+SERIAL = "FAKE0001"
+WIDTH, HEIGHT = 1080, 1920
+
+
+def generate_frames():
+    """ (png bytes, raw screencap bytes) of a synthetic frame """
+    pixels = bytearray(os.urandom(WIDTH * HEIGHT * 4 // 8)) * 8
+    image = Image.frombuffer("RGBA", (WIDTH, HEIGHT), bytes(pixels), "raw",
+                             "RGBA", 0, 1)
+    png = io.BytesIO()
+    image.save(png, "PNG")
+    raw = struct.pack("<IIII", WIDTH, HEIGHT, 1, 0) + bytes(pixels)
+    return png.getvalue(), raw
+
+def measure(name, iterations, func):
+    """ print captures per second of func """
+    start = time.time()
+    for _ in range(iterations):
+        assert func() is not None
+    cost = time.time() - start
+    print("%-16s %8.1f captures/s" %(name, iterations / cost))
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="screencap benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    png, raw = generate_frames()
+    server = FakeADBServer(devices={SERIAL: "device"},
+                           responses={"screencap -p": (0, png),
+                                      "screencap": (0, raw)})
+    server.start()
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + \
+                         os.environ["PATH"]
+    adb.ADB_HOST_PORT = server.port
+    directory = tempfile.mkdtemp(prefix="screencap_bench_")
+    try:
+        device = Device(SERIAL, name="bench")
+        def legacy():
+            """ device file and pull """
+            device.screencap("bench.png")
+            return device.pull("/data/bench.png", directory)
+        measure("legacy", max(args.iterations // 10, 1), legacy)
+        measure("exec-out png", args.iterations, device.screencap_data)
+        measure("exec-out raw", args.iterations, device.screencap_image)
+        image = device.screencap_image()
+        print("decoded %s %dx%d" %(image.mode, image.size[0], image.size[1]))
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
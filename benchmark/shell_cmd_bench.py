@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+""" Benchmark: utils.execute_shell_cmd on a fake command with huge output.
+    Legacy readline + concatenation executor is measured on a smaller output
+    since it is quadratic, new executor on full size with and without a
+    max_lines ring buffer. Fake command also writes to stderr, more than a
+    pipe buffer, which the legacy executor would deadlock on, so legacy runs
+    without it.
+
+    python benchmark/shell_cmd_bench.py [--size-mb 100] [--legacy-size-mb 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import utils
+
+LINE = "I/ActivityManager( 1234): fake log line to fill the pipe 0123456789"
+
+FAKE_CMD = """%s -c "
+import sys
+line = ('%s' + chr(10)).encode()
+count = %d * 1024 * 1024 // len(line)
+if %d:
+    sys.stderr.write('E' * 1024 * 1024)
+    sys.stderr.flush()
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+block = line * 1024
+for _ in range(count // 1024):
+    out.write(block)
+"
+"""
+
+
+def fake_command(size_mb, with_stderr):
+    """ shell command line writing size_mb MB of log lines """
+    return FAKE_CMD %(sys.executable, LINE, size_mb, int(with_stderr))
+
+def legacy_execute_shell_cmd(command, use_shell=False, decoder="utf-8"):
+    """ executor before deadline/streaming support, kept for comparison """
+    process_cmd = command if use_shell else command.split()
+    output = b''
+    process = subprocess.Popen(process_cmd, shell=use_shell,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    while True:
+        tmp_out = process.stdout.readline()
+        if not tmp_out and process.poll() is not None:
+            break
+        if tmp_out:
+            output += tmp_out
+    ret_code = process.poll()
+    output = output.decode(decoder).split("\n")
+    if output[-1] == '':
+        output = output[:-1]
+    return ret_code, output
+
+def measure(name, size_mb, func):
+    """ run func, print throughput and peak RSS """
+    start = time.time()
+    ret, out = func()
+    cost = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    print("%-28s %6d MB %8.2f s %8.1f MB/s %8d lines ret=%s peak_rss=%d MB"
+          %(name, size_mb, cost, size_mb / cost, len(out), ret, peak))
+
+def main(arg_list):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(description="shell command benchmark")
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--legacy-size-mb", type=int, default=5)
+    args = parser.parse_args(arg_list)
+    #ring buffer first, so peak RSS is not inflated by the unbounded runs
+    measure("new, max_lines=10000", args.size_mb,
+            lambda: utils.execute_shell_cmd(fake_command(args.size_mb, True),
+                                            use_shell=True, timeout=600,
+                                            max_lines=10000))
+    measure("new, unbounded", args.size_mb,
+            lambda: utils.execute_shell_cmd(fake_command(args.size_mb, True),
+                                            use_shell=True, timeout=600))
+    measure("legacy (no stderr)", args.legacy_size_mb,
+            lambda: legacy_execute_shell_cmd(
+                fake_command(args.legacy_size_mb, False), use_shell=True))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+""" Benchmark: Device.execute_adb_shell_cmd latency with adb binary per
+    command, native client per command and persistent shell session, all
+    against a local fake adb server.
+
+    python benchmark/shell_session_bench.py [-n ITERATIONS]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import adb
+from device import Device
+from fake_adb_server import FakeADBServer
+
+SERIAL = "FAKE0001"
+COMMAND = "dumpsys bluetooth_manager"
+
+
+def measure(device, iterations):
+    """ return average seconds per shell command """
+    start = time.time()
+    for _ in range(iterations):
+        ret, out = device.execute_adb_shell_cmd(COMMAND)
+        assert ret == 0 and out == ["enabled: true"], (ret, out)
+    return (time.time() - start) / iterations
+
+def main(arg_list):
+    """ run benchmark and print a table """
+    parser = argparse.ArgumentParser(description="shell session benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args(arg_list)
+    server = FakeADBServer(devices={SERIAL: "device"},
+                           responses={COMMAND: (0, b"enabled: true\n")})
+    server.start()
+    os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + \
+                         os.environ["PATH"]
+    adb.ADB_HOST_PORT = server.port
+    try:
+        per_process_device = Device(SERIAL, name="bench")
+        session_device = Device(SERIAL, name="bench", persistent_shell=True)
+        adb.NATIVE_CLIENT = False
+        spawn = measure(per_process_device, max(args.iterations // 20, 1))
+        adb.NATIVE_CLIENT = True
+        native = measure(per_process_device, args.iterations)
+        session = measure(session_device, args.iterations)
+    finally:
+        server.stop()
+    print("%-22s %10s" %("mode", "ms/cmd"))
+    print("%-22s %10.3f" %("adb binary", spawn * 1000))
+    print("%-22s %10.3f" %("native per command", native * 1000))
+    print("%-22s %10.3f" %("persistent session", session * 1000))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+""" Benchmark: TestSuite startup on a synthetic suite with 50k cases.
+    eager: previous behaviour, yaml.load whole file and create every TestCase
+    lazy: TestSuite() header pass plus first dequeued case
+    Each mode runs in its own process so peak RSS is comparable.
+
+    python benchmark/suite_load_bench.py [-n CASES]
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import yaml
+import framework
+
+CASE_SOURCE = "case_pass(result, 'ok', logger)\n"
+
+
+def generate_suite(directory, count):
+    """ write suite yaml with count cases sharing one case file """
+    with open(os.path.join(directory, "case.py"), "w") as case_fd:
+        case_fd.write(CASE_SOURCE)
+    suite_path = os.path.join(directory, "suite.yaml")
+    with open(suite_path, "w") as suite_fd:
+        suite_fd.write("suite_name: bench\n")
+        suite_fd.write("test_device: {name: bench, product: bench}\n")
+        suite_fd.write("case:\n")
+        for i in range(count):
+            suite_fd.write("- case_%d:\n    name: bench.case_%d\n"
+                           "    path: case.py\n    retry_count: 1\n"
+                           "    timeout: 30\n" %(i, i))
+    return suite_path
+
+def load(mode, suite_path):
+    """ load suite in given mode, return seconds """
+    start = time.time()
+    if mode == "eager":
+        with open(suite_path, 'r') as suite_fd:
+            config = yaml.load(suite_fd.read(), Loader=yaml.Loader)
+        _ = [framework.TestCase(c) for c in config["case"]]
+    else:
+        suite = framework.TestSuite(suite_path)
+        suite.case_queue.pop(0)
+    return time.time() - start
+
+def main(arg_list):
+    """ run both modes in child processes and print a table """
+    parser = argparse.ArgumentParser(description="suite load benchmark")
+    parser.add_argument("-n", "--cases", type=int, default=50000)
+    parser.add_argument("--mode", choices=("eager", "lazy"),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--suite", help=argparse.SUPPRESS)
+    args = parser.parse_args(arg_list)
+    logging.disable(logging.CRITICAL)
+    if args.mode:
+        os.chdir(os.path.dirname(args.suite))
+        cost = load(args.mode, args.suite)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        print("%-8s %8.2f s %8d MB" %(args.mode, cost, peak))
+        return
+    directory = tempfile.mkdtemp(prefix="suite_bench_")
+    try:
+        suite_path = generate_suite(directory, args.cases)
+        print("%d cases, yaml loader %s" %(args.cases,
+                                           framework.YAML_LOADER.__name__))
+        print("%-8s %10s %11s" %("mode", "startup", "peak RSS"))
+        for mode in ("eager", "lazy"):
+            sys.stdout.flush()
+            subprocess.call([sys.executable, os.path.abspath(__file__),
+                             "--mode", mode, "--suite", suite_path])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
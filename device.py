@@ -1,20 +1,33 @@
 #!/usr/bin/env python
 """ADB wrapper"""
 
+import io
 import os
 import time
+import struct
+import socket
 import logging
+import threading
 
 import adb
 import utils
+import tracing
+import image_cache
+import flash_state
+import push_manifest
+import screen_monitor
 
-#TODO: add Device().getprop() method
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 DEFAULT_FLASH_TIMEOUT = 600
 #flash timeout including download image, flashing and boot, so it tooks longer
 DEFAULT_CONNECT_TIMEOUT = 60
 DEFAULT_BOOT_TIMEOUT = 120
 DEFAULT_REBOOT_TIMEOUT = 30
+DEFAULT_UI_SETTLE_TIMEOUT = 60
 REBOOT_RETRY_COUNT = 3
 
 DEFAULT_TESTDATA_DIR = "/data/"
@@ -22,6 +35,26 @@ DEFAULT_TESTDATA_DIR = "/data/"
 LOG_LVL_DEBUG = 10
 LOG_LVL_INFO = 20
 
+SYNC_HASH_ALGORITHM = "md5"
+#device side tool is <algorithm>sum
+MAX_SHELL_ARGS_LENGTH = 8000
+PULL_ERROR_MARKER = "__PULL_BYTES_FAILED__"
+
+
+def _shell_quote(arg):
+    """ single quote arg for device shell """
+    return "'%s'" %arg.replace("'", "'\\''")
+
+
+def raw_screencap_image(data):
+    """ PIL image of raw "screencap" output """
+    width, height, pixel_format, pixels = \
+        screen_monitor.parse_raw_screencap(data)
+    mode, raw_mode, _ = screen_monitor.RAW_SCREENCAP_FORMATS[pixel_format]
+    return Image.frombuffer(mode, (width, height), pixels, "raw", raw_mode,
+                            0, 1)
+
+
 class DeviceOfflineError(Exception):
     """ Could not find device """
     pass
@@ -31,12 +64,18 @@ class DeviceInitError(Exception):
     pass
 
 
+@tracing.trace_methods
 class Device(object):
-    """ Android device instance. """
-    def __init__(self, serial, name="Unknown"):
+    """ Android device instance.
+        persistent_shell: run shell commands in one long-lived shell session
+                          instead of a new adb shell per command.
+    """
+    def __init__(self, serial, name="Unknown", persistent_shell=False):
         self.name = name
         self.serial = serial
         self.connected = False
+        self.persistent_shell = persistent_shell
+        self.shell_session = None
         self.logger = logging.getLogger(self.name)
         self.logger.setLevel(logging.INFO)
         self.__set_cmd_prefix(serial)
@@ -60,9 +99,9 @@ class Device(object):
         """ base method of execute adb command"""
         return adb.execute_adb_cmd(cmd, prefix)
 
-    def __execute_fastboot_cmd(self, cmd, prefix):
+    def __execute_fastboot_cmd(self, cmd, prefix, cwd=None):
         """ base method of execute fastboot command"""
-        return adb.execute_fastboot_cmd(cmd, prefix)
+        return adb.execute_fastboot_cmd(cmd, prefix, cwd=cwd)
 
     def execute_adb_cmd(self, cmd):
         """ execute adb command with device prefix
@@ -71,17 +110,56 @@ class Device(object):
         ret, out = self.__execute_adb_cmd(cmd, self.adb_cmd_prefix)
         return ret, out
 
-    def execute_fastboot_cmd(self, cmd):
-        """ execute fastboot command with device prefix
+    def execute_fastboot_cmd(self, cmd, cwd=None):
+        """ execute fastboot command with device prefix in working directory
+            cwd, current directory if None
             return: ret_code and output
         """
-        ret, out = self.__execute_fastboot_cmd(cmd, self.fastboot_cmd_prefix)
+        ret, out = self.__execute_fastboot_cmd(cmd, self.fastboot_cmd_prefix,
+                                               cwd)
         return ret, out
 
+    def __open_shell_session(self):
+        """ open persistent shell session, return None if failed"""
+        try:
+            self.shell_session = adb.ShellSession(self.serial).open()
+            self.logger.debug("Shell session of %s opened.", self.serial)
+        except (socket.error, adb.ADBProtocolException) as e:
+            self.logger.warning("Could not open shell session, use adb shell "
+                                "per command. See %s", str(e))
+            self.shell_session = None
+        return self.shell_session
+
+    def __close_shell_session(self):
+        """ close persistent shell session, it will be reopened on demand"""
+        if self.shell_session is not None:
+            self.shell_session.close()
+            self.shell_session = None
+
+    def __execute_session_cmd(self, cmd):
+        """ run cmd in persistent shell session, reopen session once if it
+            was broken, return (None, None) if session not usable.
+        """
+        for _ in range(2):
+            if self.shell_session is None or not self.shell_session.alive:
+                if self.__open_shell_session() is None:
+                    return None, None
+            try:
+                return self.shell_session.run(cmd)
+            except adb.ADBConnectionException as e:
+                self.logger.warning("Shell session broken, reconnect. See %s",
+                                    str(e))
+                self.__close_shell_session()
+        return None, None
+
     def execute_adb_shell_cmd(self, cmd):
         """ execute adb shell command with device prefix
             return: return_code, output(list of str)
         """
+        if self.persistent_shell:
+            ret, out = self.__execute_session_cmd(cmd)
+            if ret is not None:
+                return ret, out
         ret, out = self.__execute_adb_cmd(cmd, self.adb_shell_prefix)
         return ret, out
 
@@ -94,19 +172,40 @@ class Device(object):
         r, o = self.__execute_fastboot_cmd("devices", prefix="fastboot")
         return (self.serial in " ".join(o))
 
+    def __wait_for_adb_online(self, timeout, interval=3):
+        """ wait for device adb online in timeout seconds, event driven if
+            adb device tracker is running, otherwise poll every interval
+            seconds. return True if online
+        """
+        tracker = adb.get_device_tracker()
+        if tracker is not None:
+            return tracker.wait_for_state(self.serial,
+                                          adb.DEVICE_STATUS["online"], timeout)
+        start = time.time()
+        while True:
+            if self.__check_device_connected():
+                return True
+            if time.time() - start >= timeout:
+                return False
+            self.logger.debug("Device %s offline, looping...", self.serial)
+            time.sleep(interval)
+
+    def __wait_for_adb_offline(self, timeout):
+        """ wait for device to drop from adb after reboot command, only
+            possible with adb device tracker, return True if dropped
+        """
+        tracker = adb.get_device_tracker()
+        if tracker is None:
+            return False
+        return tracker.wait_while_state(self.serial,
+                                        adb.DEVICE_STATUS["online"], timeout)
+
     def connect(self, timeout=DEFAULT_CONNECT_TIMEOUT):
         """ Connect to device, update device status"""
         adb.start_adb_server()
-        start, current = time.time(), time.time()
-        while current - start < timeout:
-            if self.__check_device_connected():
-                self.connected = True
-                self.logger.info("Device %s connected.", self.serial)
-                break
-            else:
-                time.sleep(3)
-                self.logger.debug("Device %s offline, looping...", self.serial)
-                current = time.time()
+        if self.__wait_for_adb_online(timeout):
+            self.connected = True
+            self.logger.info("Device %s connected.", self.serial)
         if not self.connected:
             self.logger.error("No device with id %s detected", self.serial)
             self.logger.error("Dump all connected devices.")
@@ -120,8 +219,40 @@ class Device(object):
         """ Check device alive or not """
         return self.__check_device_connected()
 
+    def getprops(self, names=None, refresh=False):
+        """ {name: value} of props names, every prop if None, value None if
+            prop not set. Read-only ro.* props come from the snapshot cached
+            until reboot or flash, others are read from device, refresh also
+            re-reads ro.* ones. Costs one getprop round trip at most.
+        """
+        cached = None if refresh else adb.cached_props(self.serial)
+        if names is not None and cached is not None:
+            missing = [n for n in names if n not in cached]
+            if not missing:
+                return dict((n, cached[n]) for n in names)
+            if len(missing) == 1:
+                #one volatile prop, skip full snapshot
+                r, o = self.execute_adb_shell_cmd("getprop %s" %missing[0])
+                props = dict((n, cached.get(n)) for n in names)
+                props[missing[0]] = "\n".join(o).strip() or None \
+                                    if r == 0 else None
+                return props
+        _, o = self.execute_adb_shell_cmd("getprop")
+        snapshot = adb.parse_getprop(o)
+        if snapshot:
+            adb.cache_props(self.serial, snapshot)
+        if names is None:
+            return snapshot
+        return dict((n, snapshot.get(n)) for n in names)
+
+    def getprop(self, name, refresh=False):
+        """ value of prop name, None if not set, see getprops() """
+        return self.getprops([name], refresh)[name]
+
     def root(self):
         """ ADB Root """
+        #adbd restarts, shell session would be dropped anyway
+        self.__close_shell_session()
         r, o = self.execute_adb_cmd("root")
         self.__output_lines(o, prefix="ADB Root")
         time.sleep(2)
@@ -136,6 +267,104 @@ class Device(object):
         self.__output_lines(o, prefix="ADB Push")
         return r
 
+    def __device_file_batches(self, command, paths):
+        """ yield output lines of command run on paths, as few shell calls
+            as command line length allows
+        """
+        batch, length = [], 0
+        for path in paths + [None]:
+            quoted = _shell_quote(path) if path is not None else None
+            if batch and (quoted is None or
+                          length + len(quoted) > MAX_SHELL_ARGS_LENGTH):
+                _, o = self.execute_adb_shell_cmd("%s %s 2>/dev/null"
+                                                  %(command, " ".join(batch)))
+                for line in o:
+                    yield line
+                batch, length = [], 0
+            if quoted is not None:
+                batch.append(quoted)
+                length += len(quoted) + 1
+
+    def __stat_device_files(self, paths):
+        """ {device path: (size, mtime)} of existing files of paths """
+        stats = {}
+        for line in self.__device_file_batches("stat -c '%s %Y %n'", paths):
+            fields = line.split(" ", 2)
+            if len(fields) == 3 and fields[0].isdigit() and \
+               fields[1].isdigit():
+                stats[fields[2]] = (int(fields[0]), int(fields[1]))
+        return stats
+
+    def __hash_device_files(self, paths):
+        """ {device path: hex digest} of existing files of paths """
+        hashes = {}
+        for line in self.__device_file_batches("%ssum" %SYNC_HASH_ALGORITHM,
+                                               paths):
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                hashes[fields[1].strip()] = fields[0].lower()
+        return hashes
+
+    def sync_push(self, local, remote):
+        """ push file or directory tree local to remote, only files which
+            differ from device are transferred. A file whose host and device
+            size/mtime are as they were after its last push (per device
+            manifest) is not read at all, otherwise hashes of files with
+            equal size are compared. Device side checks are batched into
+            one shell call each.
+            return: 0 if every changed file is pushed, else adb push return
+        """
+        if not os.path.exists(local):
+            self.logger.error("Local path not exist: %s", local)
+            raise OSError("Local %s path not found" %local)
+        files = push_manifest.list_host_files(local, remote)
+        manifest = push_manifest.PushManifest(self.serial).load()
+        device_stats = self.__stat_device_files([d for _, d in files])
+        pending, to_hash = [], []
+        for host_path, device_path in files:
+            device_stat = device_stats.get(device_path)
+            if manifest.unchanged(host_path, device_path, device_stat):
+                continue
+            if device_stat is not None and \
+               device_stat[0] == os.path.getsize(host_path):
+                to_hash.append((host_path, device_path))
+            else:
+                pending.append((host_path, device_path))
+        if to_hash:
+            device_hashes = self.__hash_device_files([d for _, d in to_hash])
+            for host_path, device_path in to_hash:
+                digest = utils.cached_file_checksum(host_path,
+                                                    SYNC_HASH_ALGORITHM)
+                if device_hashes.get(device_path) == digest:
+                    manifest.record(host_path, device_path,
+                                    device_stats[device_path], digest)
+                else:
+                    pending.append((host_path, device_path))
+        ret, pushed = 0, []
+        for host_path, device_path in pending:
+            r = self.push(host_path, device_path)
+            if r != 0:
+                ret = r
+                manifest.forget(device_path)
+            else:
+                pushed.append((host_path, device_path))
+        pushed_stats = self.__stat_device_files([d for _, d in pushed]) \
+                       if pushed else {}
+        for host_path, device_path in pushed:
+            if device_path in pushed_stats:
+                manifest.record(host_path, device_path,
+                                pushed_stats[device_path])
+        manifest.save()
+        failed = len(pending) - len(pushed)
+        if failed:
+            self.logger.error("Synced %s to %s: %d of %d files pushed, %d "
+                              "failed.", local, remote, len(pushed),
+                              len(files), failed)
+        else:
+            self.logger.info("Synced %s to %s: %d of %d files pushed.",
+                             local, remote, len(pushed), len(files))
+        return ret
+
     def pull(self, remote, local):
         """ adb pull command wrapper """
         if not os.path.exists(local):
@@ -156,6 +385,56 @@ class Device(object):
         self.__output_lines(o, prefix="screencap")
         return r
 
+    def screencap_data(self, raw=False, as_view=False):
+        """ capture screen straight into memory with exec-out, nothing is
+            written on device
+            raw: raw framebuffer (see screen_monitor.parse_raw_screencap())
+                 instead of PNG,
+                 saves PNG encoding on device
+            as_view: return memoryview of output
+            return: PNG or raw bytes, None if capture failed
+        """
+        r, data = adb.execute_adb_exec_out("screencap" if raw
+                                           else "screencap -p",
+                                           self.adb_cmd_prefix)
+        if r != 0 or not data:
+            self.logger.error("Screencap failed, return %d.", r)
+            return None
+        return memoryview(data) if as_view else data
+
+    def screencap_image(self, raw=True):
+        """ capture screen as PIL image, return None if capture failed
+            raw: decode raw framebuffer instead of PNG, faster on both sides
+        """
+        if Image is None:
+            self.logger.error("PIL is not installed, see README.")
+            return None
+        data = self.screencap_data(raw=raw)
+        if data is None:
+            return None
+        try:
+            if raw:
+                return raw_screencap_image(data)
+            return Image.open(io.BytesIO(data))
+        except (ValueError, IOError, struct.error) as e:
+            self.logger.error("Could not decode screencap, see %s", str(e))
+            return None
+
+    def pull_bytes(self, remote):
+        """ content of a small remote file through exec-out, without local
+            file. return bytes-like content, None if remote file could not
+            be read
+        """
+        r, data = adb.execute_adb_exec_out("cat %s 2>/dev/null || echo %s"
+                                           %(_shell_quote(remote),
+                                             PULL_ERROR_MARKER),
+                                           self.adb_cmd_prefix)
+        if r != 0 or data.endswith(PULL_ERROR_MARKER.encode("utf-8") +
+                                   b"\n"):
+            self.logger.error("Could not read remote file %s", remote)
+            return None
+        return data
+
     def reboot(self, timeout=DEFAULT_REBOOT_TIMEOUT, retry_count=3):
         """Reboot device and wait for it back"""
         if not self.check_alive():
@@ -163,20 +442,20 @@ class Device(object):
             return
         self.logger.info("Start reboot device and wait for it wake up in \
 %d seconds", timeout)
+        self.__close_shell_session()
         _, o = self.execute_adb_cmd("reboot")
+        adb.forget_props(self.serial)
         self.connected = False
         self.__output_lines(o, prefix="ADB Reboot")
-        count = 1
-        while count <= retry_count:
-            if self.__check_device_connected():
-                self.connected = True
-                self.logger.info("Device %s connected.", self.serial)
-                break
-            else:
-                time.sleep(timeout/retry_count)
-                self.logger.warning("Device %s offline, looping...",
-                                    self.serial)
-                count += 1
+        start = time.time()
+        if self.__wait_for_adb_offline(timeout):
+            self.logger.info("Device %s left adb, wait for it back.",
+                             self.serial)
+        remaining = max(timeout - (time.time() - start), 0)
+        if self.__wait_for_adb_online(remaining,
+                                      interval=float(timeout)/retry_count):
+            self.connected = True
+            self.logger.info("Device %s connected.", self.serial)
         if not self.connected:
             self.logger.error("No device with id %s detected", self.serial)
             self.logger.error("Dump all connected devices.")
@@ -186,95 +465,107 @@ class Device(object):
         self.root()
         return
 
-    def __download_image(self, url, auth):
-        """"""
-        if auth is not None:
-            user, password = auth
-        else:
-            user, password = None, None
-        self.logger.info("Got image url link, starting download to local.")
-        local_image_path = utils.download_image(url, user=user,
-                                                password=password)
-        return local_image_path
-
-    def __reboot_to_fastboot(self, reboot_timeout=10):
+    def reboot_to_fastboot(self, reboot_timeout=10, interval=1):
         """ reboot device to fastboot mode, return True if device fastboot
-            online
+            online within reboot_timeout seconds
         """
+        self.__close_shell_session()
         r, _ = self.execute_adb_cmd("reboot fastboot")
-        time.sleep(reboot_timeout)
-        return self.__check_device_fastboot_connected()
-
-    def __fastboot_flash(self, image, auth=None, flash_commands=None):
-        """ if image is a url link, download it to local, flash with given
-            flash_command list, return bool(boot_complete)
-            image: url link or local zip file
+        adb.forget_props(self.serial)
+        deadline = time.time() + reboot_timeout
+        while True:
+            if self.__check_device_fastboot_connected():
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def __fastboot_flash(self, image, auth=None, flash_commands=None,
+                         checksum=None, incremental=False):
+        """ stage image and reboot device to fastboot at the same time, then
+            flash with given flash_command list, return bool(flash success)
+            image: url link fetched through host image cache, local zip file
+                   or local directory
             auth: (username, password)
+            checksum: "<algorithm>:<hex digest>" of image zip, optional
+            incremental: see fastboot_flash_dir()
         """
         self.logger.info("Use fastboot mode for flash.")
-        is_flash_success = False
         if flash_commands is None:
             self.logger.error("No flash commands given! Exit...")
-            return is_flash_success
-        if image.startswith("http://"):
-            local_image_path = self.__download_image(image, auth)
-        else:
-            local_image_path = image
-        self.logger.info("Use fastboot commands to flash.")
-        if local_image_path.endswith(".zip"):
-            self.logger.info("Local image %s is a zip file, unzip it first",
-                             local_image_path)
-            unzip_cmd = "unzip -d %s/ %s" %(local_image_path[:-4],
-                                            local_image_path)
-            self.logger.info("Unzip command: %s", unzip_cmd)
-            r, _ = utils.execute_shell_cmd(unzip_cmd, rt_output=True)
-            self.logger.info("Unzip command returns %d", r)
-            local_image_path = local_image_path[:-4] #remove .zip postfix
-        self.logger.info("Reboot device to fastboot mode.")
-        device_in_fastboot = self.__reboot_to_fastboot()
-        self.logger.info("Device in fastboot mode: %s", str(device_in_fastboot))
-        if not device_in_fastboot:
-            self.logger.error("Device did not enter fastboot mode, exit")
-            return is_flash_success
+            return False
+        self.logger.info("Reboot device to fastboot mode while staging image.")
+        fastboot = {}
+        reboot_thread = threading.Thread(target=lambda: fastboot.update(
+                                         online=self.reboot_to_fastboot()))
+        reboot_thread.start()
+        try:
+            with image_cache.stage_image(image, auth, checksum) as image_dir:
+                reboot_thread.join()
+                self.logger.info("Device in fastboot mode: %s",
+                                 str(fastboot.get("online")))
+                if not fastboot.get("online"):
+                    self.logger.error("Device did not enter fastboot mode, "
+                                      "exit")
+                    return False
+                return self.fastboot_flash_dir(image_dir, flash_commands,
+                                               incremental)
+        except image_cache.ImageCacheError as e:
+            self.logger.error("Image staging failed, see %s", str(e))
+            reboot_thread.join()
+            self.leave_fastboot(fastboot.get("online"))
+            return False
+        finally:
+            #never leave a reboot running behind an unexpected error
+            reboot_thread.join()
+
+    def leave_fastboot(self, device_in_fastboot):
+        """ flash could not go on, reboot device back from fastboot """
+        if device_in_fastboot:
+            self.logger.info("Reboot device back from fastboot mode.")
+            self.execute_fastboot_cmd("reboot")
+
+    def fastboot_flash_dir(self, image_dir, flash_commands,
+                           incremental=False):
+        """ run flash_commands with extracted image directory as working
+            directory, device is in fastboot mode. return bool(flash success)
+            incremental: skip "flash" commands whose image is the one last
+                         flashed to that partition, every command runs if
+                         flash state of device is unknown
+            flash state is recorded either way, so an incremental flash
+            after a full one only flashes what changed since
+        """
         self.logger.info("Start using fastboot to flash, working dir: %s",
-                         local_image_path)
-        prev_dir = os.getcwd()
-        work_dir = os.path.join(prev_dir, local_image_path)
-        os.chdir(work_dir)
+                         image_dir)
+        adb.forget_props(self.serial)
+        state = flash_state.FlashState(self.serial).load()
         for command in flash_commands:
+            if incremental and state.unchanged(command, image_dir):
+                self.logger.info("Skip command: %s, image unchanged.",
+                                 command)
+                continue
             self.logger.info("Run command: %s", command)
-            r, _ = self.execute_fastboot_cmd(command)
+            r, _ = self.execute_fastboot_cmd(command, cwd=image_dir)
+            state.record(command, image_dir, r == 0)
             if r != 0:
                 self.logger.error("Failed to run command: %s, exit", command)
-                os.chdir(prev_dir)
-                return is_flash_success
+                return False
             self.logger.info("Command %s success.", command)
         #all command passed successfully
         self.logger.info("All flash command runned successfully.")
-        os.chdir(prev_dir)
-        is_flash_success = True
-        self.logger.info("Flash success: %s", str(is_flash_success))
-        return is_flash_success
+        return True
 
     def __check_boot_complete(self):
         """ check device boot complete or not"""
-        _, o = self.execute_adb_shell_cmd("getprop sys.boot_completed")
-        boot_completed = True if '1' in '\n'.join(o) else False
+        boot_completed = self.getprop("sys.boot_completed") == "1"
         self.logger.info("Device boot complete: %s", str(boot_completed))
         return boot_completed
 
-    def __wait_for_boot_complete(self, timeout=DEFAULT_BOOT_TIMEOUT):
+    def wait_for_boot_complete(self, timeout=DEFAULT_BOOT_TIMEOUT):
         """wait for device boot complete"""
         start = current = time.time()
-        boot_complete = adb_online = False
-        while current - start < timeout:
-            adb_online = self.__check_device_connected()
-            if adb_online:
-                break
-            else:
-                self.logger.info("Device keep offline, waiting.")
-                time.sleep(3)
-                current = time.time()
+        boot_complete = False
+        adb_online = self.__wait_for_adb_online(timeout)
         if not adb_online:
             self.logger.error("Device adb offline for %d seconds, abort!",
                               timeout)
@@ -296,16 +587,21 @@ class Device(object):
             self.logger.error("Device did not boot complete, abort.")
         return boot_complete
 
-    def flash(self, image, mode="fastboot", auth=None, flash_commands=None):
+    def flash(self, image, mode="fastboot", auth=None, flash_commands=None,
+              checksum=None, incremental=False):
         """ Flash image to device and then wait for device to boot completed
             image: url link or local directory or local zip file
             mode: fastboot
             auth: (usernam/password)
             flash_commands: only for fastboot mode
+            checksum: "<algorithm>:<hex digest>" of url image, optional
+            incremental: skip flashing partitions whose image did not change
+                         since last incremental flash of this device
             """
         support_flash_mode = ("cflasher", "fastboot")
         if mode == "fastboot":
-            flash_result = self.__fastboot_flash(image, auth, flash_commands)
+            flash_result = self.__fastboot_flash(image, auth, flash_commands,
+                                                 checksum, incremental)
             if flash_result == False:
                 self.logger.error("Flash with mode: %s failed!", mode)
                 return flash_result
@@ -313,16 +609,26 @@ class Device(object):
             self.logger.error("Flash mode: %s not supported.", mode)
             return False
         self.logger.info("Flash passed, wait for device to boot.")
-        if not self.__wait_for_boot_complete():
+        if not self.wait_for_boot_complete():
             return False
-        self.logger.info("Capture home screen after 30 seconds.")
-        time.sleep(30)
+        self.logger.info("Capture home screen once it is stable.")
+        try:
+            monitor = screen_monitor.ScreenMonitor(self)
+            if not monitor.wait_until_stable(
+                    timeout=DEFAULT_UI_SETTLE_TIMEOUT):
+                self.logger.warning("Home screen still changing after %d "
+                                    "seconds, boot screen may not be the "
+                                    "home screen.",
+                                    DEFAULT_UI_SETTLE_TIMEOUT)
+        except ImportError as e:
+            self.logger.warning("%s, capture after 30 seconds.", str(e))
+            time.sleep(30)
         boot_screen = "first_boot.png"
-        self.screencap(boot_screen)
-        self.logger.info("Capture done, pull %s from device...", boot_screen)
-        self.pull(remote=os.path.join(DEFAULT_TESTDATA_DIR, boot_screen),
-                  local=".")
-        self.logger.info("Got device boot_screen in current directory.")
+        data = self.screencap_data()
+        if data is not None:
+            with open(boot_screen, "wb") as screen_fd:
+                screen_fd.write(data)
+            self.logger.info("Got device boot_screen in current directory.")
         return True
 
     def play_video(self, video_path):
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+""" Partition images last flashed to each device, kept as one JSON file per
+    serial, so an incremental flash could skip "fastboot flash" of
+    partitions whose image did not change.
+"""
+
+import os
+import re
+import json
+import logging
+
+import utils
+
+logger = logging.getLogger("FlashState")
+logger.setLevel(logging.INFO)
+
+DEFAULT_FLASH_STATE_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+                                       "android_bat", "flash_state")
+IMAGE_HASH_ALGORITHM = "sha1"
+FASTBOOT_VALUE_OPTIONS = ("-s", "-S", "-i", "-b", "-n", "-c", "--slot",
+                          "--cmdline", "--base", "--kernel-offset",
+                          "--ramdisk-offset", "--tags-offset", "--dtb-offset",
+                          "--page-size", "--header-version", "--os-version",
+                          "--os-patch-level", "--dtb")
+#fastboot options followed by a value
+WIPE_PARTITIONS = ("userdata", "cache", "metadata")
+#partitions erased by "fastboot -w"
+STATE_RESET_COMMANDS = ("update", "flashall", "flashing", "set_active")
+#commands after which no partition content is known
+SLOT_SUFFIX_RE = re.compile(r"^(.+)_([a-z])$")
+#boot_a and boot_b are slots of boot, which means the active one
+
+
+def image_hash(path):
+    """ hash of partition image file, a staged image is hashed once per
+        process
+    """
+    return utils.cached_file_checksum(path, IMAGE_HASH_ALGORITHM)
+
+def parse_command(command):
+    """ (action, partition, image file, wipe, reset) of fastboot command
+        partition is set for flash/erase/format, with _<slot> suffix if
+        --slot names one, image file for flash with an explicit file, wipe
+        if -w is given, reset if command leaves no partition content known,
+        such as --slot=other or --set-active
+    """
+    args, wipe, slot, option = [], False, None, None
+    for arg in command.split():
+        if option is not None:
+            if option == "--slot":
+                slot = arg
+            option = None
+        elif arg == "-w":
+            wipe = True
+        elif arg in FASTBOOT_VALUE_OPTIONS:
+            option = arg
+        elif arg.startswith("--slot="):
+            slot = arg.split("=", 1)[1]
+        elif arg.startswith("--set-active"):
+            slot = "other"
+        elif not arg.startswith("-"):
+            args.append(arg)
+    action = args[0] if args else None
+    partition = args[1] if len(args) > 1 and action is not None and \
+        (action in ("flash", "erase") or action.startswith("format")) \
+        else None
+    image_file = args[2] if action == "flash" and len(args) > 2 else None
+    reset = action in STATE_RESET_COMMANDS or \
+            (slot is not None and len(slot) != 1)
+    if partition is not None and slot is not None and not reset:
+        partition = "%s_%s" %(partition, slot)
+    return action, partition, image_file, wipe, reset
+
+def slot_base(partition):
+    """ partition name without slot suffix, boot of boot_a """
+    match = SLOT_SUFFIX_RE.match(partition)
+    return match.group(1) if match is not None else partition
+
+
+class FlashState(object):
+    """ {partition: image hash} last flashed to serial, a partition and its
+        slots are forgotten together as flashing one may change the other.
+        plan = FlashState(serial).load()
+        for command in flash_commands:
+            if incremental and plan.unchanged(command, image_dir):
+                continue
+            ...run command...
+            plan.record(command, image_dir, success)
+        partitions is None while state is unknown, then nothing is skipped.
+    """
+    def __init__(self, serial, state_dir=None):
+        self.serial = serial
+        self.path = os.path.join(state_dir or DEFAULT_FLASH_STATE_DIR,
+                                 "%s.json" %serial)
+        self.partitions = None
+        self.touched = set()
+
+    def load(self):
+        """ read state of serial, unknown if missing or broken """
+        try:
+            with open(self.path, "r") as state_fd:
+                self.partitions = json.load(state_fd)["partitions"]
+        except (IOError, OSError, ValueError, KeyError):
+            logger.info("No flash state of %s, flash every partition.",
+                        self.serial)
+            self.partitions = None
+        return self
+
+    def save(self):
+        """ write state atomically """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w") as state_fd:
+            json.dump({"serial": self.serial,
+                       "partitions": self.partitions or {}}, state_fd)
+        os.rename(self.path + ".tmp", self.path)
+
+    def unchanged(self, command, image_dir):
+        """ True if command flashes the image already on its partition, and
+            the partition was not erased earlier in this flash
+        """
+        action, partition, image_file, _, reset = parse_command(command)
+        if action != "flash" or image_file is None or reset or \
+           self.partitions is None or slot_base(partition) in self.touched:
+            return False
+        path = os.path.join(image_dir, image_file)
+        if not os.path.isfile(path):
+            return False
+        return self.partitions.get(partition) == image_hash(path)
+
+    def record(self, command, image_dir, success):
+        """ update state with command result and save it """
+        action, partition, image_file, wipe, reset = parse_command(command)
+        if self.partitions is None or reset:
+            self.partitions = {}
+        if wipe:
+            for name in WIPE_PARTITIONS:
+                self.__forget_partition(name)
+        if partition is not None:
+            self.__forget_partition(partition)
+            path = os.path.join(image_dir, image_file) \
+                   if image_file is not None else None
+            if action == "flash" and success and path is not None and \
+               os.path.isfile(path) and not reset:
+                self.partitions[partition] = image_hash(path)
+        self.save()
+
+    def __forget_partition(self, partition):
+        """ drop partition and its slots, they are not skipped any more in
+            this flash
+        """
+        base = slot_base(partition)
+        self.touched.add(base)
+        for name in list(self.partitions):
+            if slot_base(name) == base:
+                del self.partitions[name]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+""" Flash one build to many devices at once. Image is staged once while
+    every device reboots to fastboot, then the fastboot command lists of
+    devices run concurrently, each in the image directory as its working
+    directory, with a cap on parallel USB heavy flashing.
+"""
+
+import time
+import logging
+import threading
+
+import image_cache
+
+logger = logging.getLogger("Fleet")
+logger.setLevel(logging.INFO)
+
+DEFAULT_FLASH_PARALLEL = 4
+
+PHASE_PENDING = "pending"
+PHASE_REBOOT = "reboot"
+PHASE_QUEUED = "queued"
+PHASE_FLASH = "flash"
+PHASE_BOOT = "boot"
+PHASE_DONE = "done"
+
+
+class FleetFlash(object):
+    """ Flash image to every device of devices.
+        image: url link, local zip file or local directory
+        flash_commands: fastboot commands without "fastboot -s <serial>"
+        max_parallel: devices running flash commands at the same time
+        wait_boot: wait for devices to boot complete after flash
+        incremental: skip unchanged partitions, see
+                     Device.fastboot_flash_dir()
+        progress_callback(serial, phase, result): called on every phase
+                                                  change of a device
+
+        results = FleetFlash(devices, url, commands).run()
+        {serial: {"serial", "result": bool, "phase", "error",
+                  "timings": {"reboot", "wait", "flash", "boot", "total"}}}
+    """
+    def __init__(self, devices, image, flash_commands, auth=None,
+                 checksum=None, max_parallel=DEFAULT_FLASH_PARALLEL,
+                 wait_boot=True, progress_callback=None, incremental=False):
+        self.devices = devices
+        self.image = image
+        self.flash_commands = flash_commands
+        self.auth = auth
+        self.checksum = checksum
+        self.wait_boot = wait_boot
+        self.incremental = incremental
+        self.progress_callback = progress_callback
+        self.usb_slots = threading.Semaphore(max_parallel)
+        self.staged = threading.Event()
+        self.image_dir = None
+        self.stage_error = None
+        self.stage_time = None
+        self.lock = threading.Lock()
+        self.results = dict((d.serial, {"serial": d.serial, "result": False,
+                                        "phase": PHASE_PENDING, "error": None,
+                                        "timings": {}})
+                            for d in devices)
+
+    def progress(self, device, phase, error=None):
+        """ record phase change of device and report it """
+        with self.lock:
+            result = self.results[device.serial]
+            result["phase"] = phase
+            if error is not None:
+                result["error"] = error
+        if error is not None:
+            logger.error("%s: %s, %s", device.serial, phase, error)
+        else:
+            logger.info("%s: %s", device.serial, phase)
+        if self.progress_callback is not None:
+            self.progress_callback(device.serial, phase, result)
+
+    def flash_device(self, device):
+        """ per device thread body """
+        result = self.results[device.serial]
+        timings = result["timings"]
+        start = time.time()
+        try:
+            self.progress(device, PHASE_REBOOT)
+            in_fastboot = device.reboot_to_fastboot()
+            timings["reboot"] = time.time() - start
+            self.staged.wait()
+            timings["wait"] = time.time() - start - timings["reboot"]
+            if self.image_dir is None:
+                device.leave_fastboot(in_fastboot)
+                self.progress(device, PHASE_DONE,
+                              "image staging failed: %s" %self.stage_error)
+                return
+            if not in_fastboot:
+                self.progress(device, PHASE_DONE,
+                              "device did not enter fastboot mode")
+                return
+            self.progress(device, PHASE_QUEUED)
+            with self.usb_slots:
+                flash_start = time.time()
+                self.progress(device, PHASE_FLASH)
+                flashed = device.fastboot_flash_dir(self.image_dir,
+                                                    self.flash_commands,
+                                                    self.incremental)
+                timings["flash"] = time.time() - flash_start
+            if not flashed:
+                self.progress(device, PHASE_DONE, "flash command failed")
+                return
+            if self.wait_boot:
+                boot_start = time.time()
+                self.progress(device, PHASE_BOOT)
+                booted = device.wait_for_boot_complete()
+                timings["boot"] = time.time() - boot_start
+                if not booted:
+                    self.progress(device, PHASE_DONE,
+                                  "device did not boot complete")
+                    return
+            result["result"] = True
+            self.progress(device, PHASE_DONE)
+        except Exception as e:
+            self.progress(device, PHASE_DONE, str(e))
+        finally:
+            timings["total"] = time.time() - start
+
+    def run(self):
+        """ flash every device, return results keyed by serial """
+        start = time.time()
+        threads = [threading.Thread(target=self.flash_device, args=(d,))
+                   for d in self.devices]
+        _ = [t.start() for t in threads]
+        try:
+            with image_cache.stage_image(self.image, self.auth,
+                                         self.checksum) as image_dir:
+                self.stage_time = time.time() - start
+                logger.info("Image staged in %.1f seconds: %s",
+                            self.stage_time, image_dir)
+                self.image_dir = image_dir
+                self.staged.set()
+                _ = [t.join() for t in threads]
+        except image_cache.ImageCacheError as e:
+            self.stage_error = str(e)
+            logger.error("Image staging failed, see %s", self.stage_error)
+        finally:
+            self.staged.set()
+            _ = [t.join() for t in threads]
+        passed = sum(1 for r in self.results.values() if r["result"])
+        logger.info("Flashed %d of %d devices in %.1f seconds.", passed,
+                    len(self.results), time.time() - start)
+        return self.results
@@ -6,15 +6,25 @@ csv/yaml file.
 """
 
 import logging
+import hashlib
+import marshal
 import yaml
+import sys
 import os
 import time
+import sqlite3
 import datetime
 import importlib
+import threading
 
 import utils
+import tracing
 import adb
 from device import Device
+from report import ReportSink
+from logcat import LogcatReader
+import log_watch
+import history
 
 #TODO: add test data directory
 
@@ -22,9 +32,16 @@ UTF8 = 'utf-8'
 
 DEFAULT_CASE_RETRY_COUNT = 2
 DEFAULT_CASE_TIMEOUT = 60
+CASE_RETRY_INTERVAL = 1
+#seconds between rounds of a failed case
 DEFAULT_CASE_TYPE = 'auto'
 MANUAL_TYPE = 'manual'
 #manual case will not be executed and only return result as empty
+CASE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+                              "android_bat", "cases")
+#compiled case bytecode cache, set None to always compile from source
+MAX_LOGCAT_MATCHES = 100
+#logcat watch matches kept in a case result
 
 class SuiteNotFoundError(Exception):
     """Suite not found or did not parse successfully."""
@@ -38,6 +55,41 @@ class CaseNotImplementedError(Exception):
     """Could not read case file"""
     pass
 
+class CaseCompileError(CaseNotImplementedError):
+    """Case file could not be compiled"""
+    pass
+
+def compile_case(source, path, cache_dir=CASE_CACHE_DIR):
+    """ compile case source to code object, bytecode is cached in cache_dir
+        keyed by hash of source, path and python version.
+        raise SyntaxError if case could not be compiled.
+    """
+    key = hashlib.sha1(source)
+    key.update(path.encode(UTF8))
+    key.update(sys.version.encode(UTF8))
+    cache_file = os.path.join(cache_dir, key.hexdigest()) if cache_dir \
+                                                          else None
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as cache_fd:
+                return marshal.load(cache_fd)
+        except (EOFError, ValueError, TypeError, IOError) as e:
+            logging.getLogger("CaseCache").warning(
+                "Broken case cache %s, recompile. See %s", cache_file, str(e))
+    code = compile(source, path, 'exec')
+    if cache_file is not None:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = "%s.%d.tmp" %(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as cache_fd:
+                marshal.dump(code, cache_fd)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            logging.getLogger("CaseCache").warning(
+                "Could not write case cache %s, see %s", cache_file, str(e))
+    return code
+
 def case_fail(result, msg, logger, logs=None):
     """fail current case and update result"""
     if logs is not None:
@@ -63,7 +115,7 @@ def case_pass(result, msg, logger, logs=None):
 class TestCase(object):
     """Test case"""
     def __init__(self, case_dict):
-        self.name = case_dict.keys()[0]
+        self.name = list(case_dict.keys())[0]
         self.logger = logging.getLogger("TC_%s" %self.name)
         self.full_name = case_dict[self.name]['name']
         self.result = {"name": self.full_name, "result": "empty",
@@ -84,6 +136,15 @@ class TestCase(object):
         if self.type != 'manual':
             self.__path = os.path.join(os.getcwd(),
                                        case_dict[self.name]['path'])
+        try:
+            self.watch_patterns = log_watch.load_patterns(
+                                    case_dict[self.name].get('logcat_watch'))
+            self.watch = log_watch.LogWatch(self.watch_patterns)
+        except log_watch.WatchPatternError as e:
+            self.logger.error(str(e))
+            raise CaseNotImplementedError(str(e))
+        self.__aborted = None
+        self.__round_done = None
         self.__code = self.__read_case()
         if self.__code is None:
             self.logger.error("Automation case %s not implemented!",
@@ -91,6 +152,7 @@ class TestCase(object):
             raise CaseNotImplementedError()
 
     def __read_case(self):
+        """ read and compile case, return code object """
         if self.type == 'manual':
             return "This is a manual case and will be skippped."
         elif not os.path.exists(self.__path):
@@ -98,13 +160,20 @@ class TestCase(object):
                         self.name, self.__path)
             return None
         else:
-            with open(self.__path, 'r') as case_fd:
-                case_code = case_fd.read()
-            return case_code
+            with open(self.__path, 'rb') as case_fd:
+                case_source = case_fd.read()
+            try:
+                return compile_case(case_source, self.__path)
+            except (SyntaxError, ValueError, TypeError) as e:
+                self.logger.error("Case %s could not be compiled, see %s",
+                                  self.full_name, str(e))
+                raise CaseCompileError("Case %s: %s" %(self.full_name,
+                                                       str(e)))
 
     def execute(self, local_context, global_context):
-        """ case executor"""
-        #TODO: implement timeout
+        """ case executor, every round is limited to self.timeout seconds and
+            a timed out case will not be retried.
+        """
         if self.type == MANUAL_TYPE:
             self.logger.info("Case %s is a manual case, set result to empty.",
                              self.full_name)
@@ -116,22 +185,84 @@ result set to empty' %self.full_name]
             while run_count <= self.retry_count:
                 self.logger.info("Start to run case %s, round %d.",
                                  self.full_name, run_count)
-                r = self.__execute(local_context, global_context)
-                if r['result'] == 'pass':
+                r = self.__execute_with_timeout(local_context,
+                                                global_context)
+                if r['result'] == 'pass' or r.get('timeout') or \
+                   r.get('aborted'):
                     break
                 else:
-                    time.sleep(1)
+                    time.sleep(CASE_RETRY_INTERVAL)
                     self.logger.warning("Case failed, start to re-run current \
 case, retry counts: %d", self.retry_count-run_count)
                     run_count += 1
             self.result.update(r)
+            self.result['rounds'] = min(run_count, self.retry_count)
             self.logger.info("Case %s result %s.",
                              self.full_name, self.result['result'])
         return self.result
 
+    def clear_abort(self):
+        """ forget abort of an earlier run, call before anything that may
+            abort the next run is set up
+        """
+        self.__aborted = None
+
+    def abort(self, reason, logs=None):
+        """ stop current round early and fail the case with reason, such as
+            a crash found in logcat, thread safe. Case is not retried.
+        """
+        if self.__aborted is not None:
+            return
+        self.__aborted = (reason, list(logs or []))
+        done = self.__round_done
+        if done is not None:
+            done.set()
+
+    def __execute_with_timeout(self, local_context, global_context=None):
+        """ run one round in a worker thread, if it does not finish in
+            self.timeout seconds or the case is aborted, kill adb/shell
+            commands it is blocked on, abandon it and return a failed result
+            with timeout or abort reason.
+        """
+        holder = {}
+        done = self.__round_done = threading.Event()
+        waiter = threading.current_thread()
+        def target():
+            """ worker thread body """
+            tracing.link_thread(waiter)
+            try:
+                with tracing.span("TestCase.round", "case", self.full_name):
+                    holder["result"] = self.__execute(local_context,
+                                                      global_context)
+            finally:
+                utils.forget_thread()
+                done.set()
+        worker = threading.Thread(target=target, name="TC_%s" %self.name)
+        worker.daemon = True
+        if self.__aborted is None:
+            worker.start()
+            done.wait(self.timeout)
+            if "result" in holder:
+                worker.join()
+                return holder["result"]
+            utils.cancel_thread(worker.ident)
+            if not worker.is_alive():
+                #finished right before cancel, do not leave stale cancel mark
+                utils.forget_thread(worker.ident)
+        if self.__aborted is not None:
+            reason, logs = self.__aborted
+            msg = "Case %s aborted, %s" %(self.full_name, reason)
+            self.logger.error(msg)
+            return {"result": "fail", "errors": [msg], "logs": logs + [msg],
+                    "aborted": True}
+        msg = "Case %s timeout after %s seconds." %(self.full_name,
+                                                   str(self.timeout))
+        self.logger.error(msg)
+        return {"result": "fail", "errors": [msg], "logs": [msg],
+                "timeout": True}
+
     def __execute(self, local_context, global_context=None):
         """ atomic executor of test script"""
-        #TODO: implement subprocess exec for timer
         self.logger.info("Start execute case %s." %self.full_name)
         result = {"result": "empty", "errors": [], "logs": []}
         if global_context is None:
@@ -154,18 +285,186 @@ saved into errors, see %s", self.full_name, str(e))
             return result
 
 
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+#libyaml based loader if available, pure python one otherwise
+
+
+class SuiteLoader(YAML_LOADER, yaml.composer.Composer):
+    """ YAML loader which could compose top level entries one by one,
+        Composer brings compose_node() to the libyaml based loader.
+    """
+    def __init__(self, stream):
+        YAML_LOADER.__init__(self, stream)
+        self.anchors = {}
+
+    def next_node(self):
+        """ compose and construct next node, forget it afterwards """
+        node = self.compose_node(None, None)
+        data = self.construct_object(node, deep=True)
+        self.constructed_objects = {}
+        self.recursive_objects = {}
+        return data
+
+    def skip_node(self):
+        """ consume events of next node without composing it """
+        depth = 0
+        while True:
+            event = self.get_event()
+            if isinstance(event, (yaml.SequenceStartEvent,
+                                  yaml.MappingStartEvent)):
+                depth += 1
+            elif isinstance(event, (yaml.SequenceEndEvent,
+                                    yaml.MappingEndEvent)):
+                depth -= 1
+            if depth == 0:
+                return
+
+    def top_level_keys(self):
+        """ walk top level mapping, yield its keys, caller must consume the
+            value with next_node() or skip_node()
+        """
+        self.get_event() #StreamStart
+        self.get_event() #DocumentStart
+        if not self.check_event(yaml.MappingStartEvent):
+            raise SuiteNotFoundError("Suite file is not a mapping.")
+        self.get_event()
+        while not self.check_event(yaml.MappingEndEvent):
+            yield self.next_node()
+
+
+def load_suite_header(suite_path):
+    """ load every top level entry of suite file except 'case' list, which is
+        only counted. return (header dict, case count)
+    """
+    header, case_count = {}, 0
+    with open(suite_path, 'rb') as suite_fd:
+        loader = SuiteLoader(suite_fd)
+        try:
+            for key in loader.top_level_keys():
+                if key != "case":
+                    header[key] = loader.next_node()
+                    continue
+                loader.get_event() #SequenceStart
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    loader.skip_node()
+                    case_count += 1
+                loader.get_event()
+        finally:
+            loader.dispose()
+    return header, case_count
+
+def iter_suite_cases(suite_path):
+    """ yield entries of 'case' list in suite file one by one """
+    with open(suite_path, 'rb') as suite_fd:
+        loader = SuiteLoader(suite_fd)
+        try:
+            for key in loader.top_level_keys():
+                if key != "case":
+                    loader.skip_node()
+                    continue
+                loader.get_event() #SequenceStart
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.next_node()
+                return
+        finally:
+            loader.dispose()
+
+
+class CaseQueue(object):
+    """ FIFO of TestCase created from case entries only when dequeued,
+        supports len(), pop(0) and insert(0, case) like the list it replaces.
+        skip: ids of cases which should not be run again
+    """
+    def __init__(self, entries, count, skip=None):
+        self.entries = iter(entries)
+        self.skip = skip if skip is not None else set()
+        self.count = count - len(self.skip)
+        self.returned = []
+
+    def __len__(self):
+        return self.count
+
+    def insert(self, index, case):
+        """ give a dequeued case back to the front of queue """
+        if index != 0:
+            raise IndexError("Only insert to queue front is supported.")
+        self.returned.append(case)
+        self.count += 1
+
+    def pop(self, index=0):
+        """ dequeue next case and create its TestCase, None if no case left
+            raise CaseNotImplementedError(id, full name, reason) if it could
+            not be created, malformed entries included.
+        """
+        if index != 0:
+            raise IndexError("Only pop from queue front is supported.")
+        if self.returned:
+            self.count -= 1
+            return self.returned.pop()
+        for entry in self.entries:
+            try:
+                name = list(entry.keys())[0]
+            except (AttributeError, IndexError):
+                name = str(entry)
+            try:
+                full_name = entry[name].get('name', name)
+            except (AttributeError, TypeError):
+                full_name = name
+            if name in self.skip:
+                continue
+            self.count = max(self.count - 1, 0)
+            try:
+                return TestCase(entry)
+            except CaseNotImplementedError as e:
+                raise CaseNotImplementedError(name, full_name,
+                                              str(e) or "case not implemented")
+            except Exception as e:
+                #malformed entry, e.g. missing path or not a mapping
+                raise CaseNotImplementedError(name, full_name,
+                                              "bad case entry, see %s: %s"
+                                              %(type(e).__name__, str(e)))
+        self.count = 0
+        return None
+
+
 class TestSuite(object):
-    """ Test suite instance"""
-    def __init__(self, suite_path):
+    """ Test suite instance
+        parallel: use every matched device and spread cases across them
+        report_dir: directory of reports, case results are appended to a
+                    JSON lines file there as soon as each case completes
+        resume_path: JSON lines file of an interrupted run of this suite,
+                     cases with final results there are skipped and new
+                     results are appended to it
+        history_path: SQLite case history database, case runs are saved
+                      there and used to estimate suite runtime
+        schedule: reorder cases by history, see history.SCHEDULES
+        logcat: capture logcat of each device in background, log lines of
+                each case are saved next to the report and attached to its
+                result as "logcat", it is matched against logcat_watch
+                patterns of suite and case, see log_watch. On by default,
+                like runner without --no-logcat
+    """
+    def __init__(self, suite_path, parallel=False, report_dir=None,
+                 resume_path=None, history_path=None, schedule=None,
+                 logcat=True):
         self.logger = logging.getLogger("TestSuite")
         self.result = {}
+        self.parallel = parallel
+        self.suite_path = suite_path
+        self.report_dir = report_dir if report_dir is not None else \
+                          os.path.join(os.getcwd(), "results")
+        self.time_stamp = datetime.datetime.now().strftime(
+                                                        "%Y-%m-%d-%H-%M-%S")
+        self.result_lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.logcat = logcat
+        self.logcat_readers = {}
         if not os.path.exists(suite_path):
             self.logger.error("Could not found suite file %s, \
 does it really exists?", suite_path)
             raise SuiteNotFoundError()
         try:
-            with open(suite_path, 'r') as suite_fd:
-                self.__raw_config = yaml.load(suite_fd.read())
+            self.__raw_config, case_count = load_suite_header(suite_path)
             self.name = self.__raw_config["suite_name"]
             self.device_type = self.__raw_config["test_device"]
             if "flash_file" in self.__raw_config:
@@ -182,12 +481,26 @@ does it really exists?", suite_path)
                 self.external_lib = None
             self.mods = self.load_external_libraries() if self.external_lib \
                                                        else None
+            self.watch_patterns = log_watch.load_patterns(
+                self.__raw_config.get("logcat_watch",
+                                      log_watch.DEFAULT_PATTERNS))
+            self.watch = log_watch.LogWatch(self.watch_patterns)
             self.device = None
-            self.case_queue = [TestCase(c) for c in self.__raw_config["case"]]
-            self.result['count'] = {'pass':0, 'fail': 0,
-                                    'empty': 0, 'block': 0,
-                                    'total': len(self.case_queue)}
-            self.result['cases'] = []
+            self.devices = []
+            finished = set()
+            if resume_path is not None:
+                self.report_sink = ReportSink(resume_path)
+                finished = self.__load_checkpoint()
+            else:
+                self.report_sink = ReportSink(os.path.join(self.report_dir,
+                                              "%s_%s.jsonl" %(self.time_stamp,
+                                                              self.name)))
+            self.case_queue = CaseQueue(iter_suite_cases(suite_path),
+                                        case_count, skip=finished)
+            self.result['count'] = self.report_sink.summary(case_count)
+            self.history = history.CaseHistory(history_path) \
+                           if history_path is not None else None
+            self.schedule = schedule
             self.current_case = None
             self.test_context = None
             self.logger.info("Test suite %s, test device %s, case count %s",
@@ -200,6 +513,23 @@ does it really exists?", suite_path)
             self.logger.error("In function name %s", error_name)
             raise SuiteNotFoundError(str(e))
 
+    def __load_checkpoint(self):
+        """ read progress of interrupted run from report sink
+            return ids of cases which already have final results
+        """
+        suite_info = self.report_sink.suite_info()
+        if suite_info.get("name") != self.name:
+            raise SuiteNotFoundError("%s is not a result file of suite %s"
+                                     %(self.report_sink.path, self.name))
+        self.time_stamp = suite_info["time_stamp"]
+        finished, in_flight = self.report_sink.progress()
+        self.logger.info("Resume suite %s from %s, %d cases finished.",
+                         self.name, self.report_sink.path, len(finished))
+        for case_id in in_flight:
+            self.logger.warning("Case %s was interrupted, run it again.",
+                                case_id)
+        return finished
+
     def detect_device(self, device_type):
         """ find device with given device type or serial number, normally
             'device_type' will be like below, priority: "serial" > "product"
@@ -221,6 +551,36 @@ serial=%s and product=%s", serial, product)
             device = Device(serial=devices[0], name=device_type["name"])
         return device
 
+    def detect_devices(self, device_type):
+        """ find every device with given device type or serial number, see
+            detect_device(), devices are connected concurrently.
+            return list of class Device() instances
+        """
+        product = device_type.get("product")
+        serial = device_type.get("serial")
+        serials = adb.find_devices(serial=serial, product=product)
+        if len(serials) == 0:
+            self.logger.error("Did not find any device match \
+serial=%s and product=%s", serial, product)
+            return []
+        self.logger.info("Got %d devices: %s", len(serials), str(serials))
+        devices = {}
+        waiter = threading.current_thread()
+        def connect(serial):
+            """ create Device, leave it out if failed to connect """
+            tracing.link_thread(waiter)
+            try:
+                devices[serial] = Device(serial=serial,
+                                         name=device_type["name"])
+            except Exception as e:
+                self.logger.error("Device %s failed to connect, see %s",
+                                  serial, str(e))
+        threads = [threading.Thread(target=connect, args=(s,))
+                   for s in serials]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+        return [devices[s] for s in serials if s in devices]
+
     def create_test_context(self, **kwargs):
         """ create local test context dictionary, below are defaults:
             {'result': 'empty', 'errors': [], 'logs': []}
@@ -235,7 +595,7 @@ serial=%s and product=%s", serial, product)
         mods = {}
         for m in self.external_lib:
             #TODO: remove this hack
-            mod = m[m.keys()[0]]
+            mod = m[list(m.keys())[0]]
             rel_path = mod["path"][:-3].replace('/', '.')
             self.logger.info("Import library from %s", mod["path"])
             mods[mod["name"]] = importlib.import_module(rel_path, __package__)
@@ -244,27 +604,68 @@ serial=%s and product=%s", serial, product)
         return mods
 
     def handle_case_result(self, case):
-        """Merge case result """
-        self.result['cases'].append(case)
-        self.result['count'][case['result']] += 1
+        """Merge case result, thread safe """
+        with self.result_lock:
+            self.report_sink.append(case)
+            self.result['count'][case['result']] += 1
+        if self.history is not None and "duration" in case:
+            try:
+                self.history.record(self.name, case['id'], case['serial'],
+                                    case['started'], case['duration'],
+                                    case['result'], case.get('rounds', 0))
+            except sqlite3.Error as e:
+                #history is only used for scheduling, a locked or broken
+                #database must not stop the run
+                self.logger.error("Could not save history of case %s, see "
+                                  "%s", case['id'], str(e))
         return
 
+    def schedule_cases(self):
+        """ estimate suite runtime from case history, reorder case queue if
+            schedule set. Without schedule case entries are only streamed.
+        """
+        stats = self.history.stats(self.name)
+        skip = self.case_queue.skip
+        entries = (e for e in iter_suite_cases(self.suite_path)
+                   if list(e.keys())[0] not in skip)
+        if self.schedule is not None:
+            entries = history.order_cases(list(entries), stats, self.schedule)
+            self.case_queue = CaseQueue(entries, len(entries))
+            self.logger.info("Cases reordered %s.", self.schedule)
+        estimate = history.estimate_runtime(entries, stats,
+                                            len(self.devices))
+        self.logger.info("Estimated suite runtime %d seconds on %d devices, "
+                         "%d cases have history.", estimate,
+                         len(self.devices), len(stats))
+        return estimate
+
     def generate_report(self, path, report_type="yaml"):
-        """Generate test report"""
+        """Generate test report from case results in report sink, cases are
+           streamed into the report one by one.
+        """
         #TODO: support other format report files
         report = {"name": self.name,
-                  "device": {"serial": self.device.serial,
-                             "type": self.device.name,
-                             "product_name": self.device_type['product']
+                  "device": {"serial": self.device.serial if self.device
+                                                          else None,
+                             "type": self.device_type['name'],
+                             "product_name": self.device_type.get('product')
                             },
-                  "result": self.result['count'],
-                  "cases": [{c['name']: c} for c in self.result['cases']]
+                  "devices": [d.serial for d in self.devices],
+                  "result": self.report_sink.summary(
+                                        self.result['count']['total'])
                  }
-        time_stamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        report_name = "%s_%s.%s" %(time_stamp, self.name, report_type)
+        report_name = "%s_%s.%s" %(self.time_stamp, self.name, report_type)
         if report_type == "yaml":
+            if not os.path.isdir(path):
+                os.makedirs(path)
             with open(os.path.join(path, report_name), "w") as report_fd:
-                yaml.dump(report, report_fd, default_flow_style=False)
+                yaml.safe_dump(report, report_fd, default_flow_style=False)
+                report_fd.write("cases:\n")
+                for c in self.report_sink.cases():
+                    yaml.safe_dump([{c['name']: c}], report_fd,
+                                   default_flow_style=False)
+            self.logger.info("Report generated: %s",
+                             os.path.join(path, report_name))
         else:
             self.logger.error("Unsupported report format: %s!", report_type)
             self.logger.error("Dump report as below.")
@@ -276,7 +677,7 @@ serial=%s and product=%s", serial, product)
         #Current case result mapping to LAVA case result mapping
         result2LAVA_result = {'pass': 'pass', 'fail': 'fail',
                               'skip': 'block', 'empty': 'unknown'}
-        for c in self.result['cases']:
+        for c in self.report_sink.cases():
             case_lava_result = result2LAVA_result[c['result']]
             case_name = c['name']
             self.logger.info("Generate case %s LAVA result %s",
@@ -287,40 +688,211 @@ serial=%s and product=%s", serial, product)
             _ = [self.logger.info(l) for l in o]
         self.logger.info("LAVA result for all cases generated!")
 
-    def run(self):
-        """Run current test suite"""
-        #TODO: Add suite timeout
-        self.logger.info("Start running test suite %s.", self.name)
-        self.device = self.detect_device(self.device_type)
-        if self.device is None:
-            self.logger.error("Available %s device not found, stop running.",
-                               self.device_type["name"])
-            raise SuiteFailToStartError()
-        while len(self.case_queue) != 0:
-            self.logger.info("%d cases to be executed.", len(self.case_queue))
-            current_case = self.case_queue.pop(0)
-            self.logger.info("Start executing case %s", current_case.name)
-            if not self.device.check_alive():
+    @tracing.traced("TestSuite.run_case")
+    def run_case(self, device, case):
+        """ run case on device, block it if device offline
+            return case result with device serial
+        """
+        self.logger.info("Start executing case %s on %s",
+                         case.name, device.serial)
+        with self.result_lock:
+            self.report_sink.mark_started(case.name)
+        reader = self.logcat_readers.get(device.serial)
+        logcat_start = reader.mark() if reader is not None else None
+        matches = []
+        case.clear_abort()
+        watches = self.__watch_logcat(reader, case, matches) \
+                  if reader is not None else []
+        started = time.time()
+        try:
+            if not device.check_alive():
                 #device offline, so skip and mark this case as block
                 self.logger.error("Device %s not alive, skip current case",
-                                  str(self.device))
-                current_result = {"name": current_case.full_name,
-                                  "result": "block",
-                                  "errors": ["Device %s offline."
-                                             %self.device.serial],
-                                  "logs": []
-                                 }
+                                  str(device))
+                result = {"name": case.full_name,
+                          "result": "block",
+                          "errors": ["Device %s offline." %device.serial],
+                          "logs": []
+                         }
             else:
                 #normal automated case
-                self.test_context = self.create_test_context(
-                                            test_device=self.device,
-                                            logger=current_case.logger,
+                test_context = self.create_test_context(
+                                            test_device=device,
+                                            logger=case.logger,
                                             flash_file=self.flash_file,
                                             case_pass=case_pass,
                                             case_fail=case_fail,
                                             mods=self.mods)
-                current_result = current_case.execute(self.test_context, {})
-            self.handle_case_result(current_result)
+                self.test_context = test_context
+                result = case.execute(test_context, {})
+                result["started"] = started
+                result["duration"] = time.time() - started
+        finally:
+            for watch in watches:
+                reader.unwatch(watch)
+        result["id"] = case.name
+        result["serial"] = device.serial
+        if reader is not None:
+            result["logcat"] = self.__save_logcat(reader, case, logcat_start,
+                                                  started)
+        if matches:
+            result["logcat_matches"] = matches
+        return result
+
+    def __watch_logcat(self, reader, case, matches):
+        """ match logcat against suite and case watch patterns while case
+            runs, matches are appended to matches and abort the case if
+            their pattern says so. return watch handles
+        """
+        def on_match(pattern, line, excerpt):
+            """ called in logcat capture thread """
+            self.logger.warning("Logcat of %s matched %s while running %s: "
+                                "%s", reader.serial, pattern.name, case.name,
+                                line)
+            if len(matches) < MAX_LOGCAT_MATCHES:
+                matches.append({"name": pattern.name, "line": line})
+            if pattern.abort:
+                case.abort("logcat matched %s: %s" %(pattern.name, line),
+                           excerpt)
+        return [reader.watch(watch, on_match)
+                for watch in (self.watch, case.watch)]
+
+    def __logcat_dir(self):
+        """ directory of logcat spools and case windows of this run """
+        return os.path.join(self.report_dir, "%s_%s_logcat" %(self.time_stamp,
+                                                              self.name))
+
+    def __start_logcat(self):
+        """ start one background logcat reader per device """
+        directory = self.__logcat_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        started = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        for device in self.devices:
+            spool = os.path.join(directory, "%s_%s.logcat.gz"
+                                 %(device.serial, started))
+            self.logcat_readers[device.serial] = \
+                LogcatReader(device.serial, spool).start()
+            self.logger.info("Capture logcat of %s to %s",
+                             device.serial, spool)
+
+    def __stop_logcat(self):
+        """ stop every logcat reader """
+        for reader in self.logcat_readers.values():
+            reader.stop()
+        self.logcat_readers = {}
+
+    def __save_logcat(self, reader, case, start, started):
+        """ save log lines captured while case ran, file is named after case,
+            serial and time case started, so a case run again does not
+            overwrite it. return file path
+        """
+        path = os.path.join(self.__logcat_dir(), "%s_%s_%s.logcat.gz"
+                            %(case.name.replace(os.sep, "_"), reader.serial,
+                              datetime.datetime.fromtimestamp(started)
+                              .strftime("%Y-%m-%d-%H-%M-%S")))
+        try:
+            count = reader.save_window(start, reader.mark(), path)
+        except (IOError, OSError) as e:
+            self.logger.error("Could not save logcat of case %s, see %s",
+                              case.name, str(e))
+            return None
+        self.logger.debug("Saved %d logcat lines of case %s to %s",
+                          count, case.name, path)
+        return path
+
+    def __pop_case(self):
+        """ pop next case from queue, None if queue empty, thread safe """
+        with self.queue_lock:
+            while len(self.case_queue) != 0:
+                self.logger.info("%d cases to be executed.",
+                                 len(self.case_queue))
+                try:
+                    return self.case_queue.pop(0)
+                except CaseNotImplementedError as e:
+                    case_id, full_name, reason = e.args
+                    self.logger.error("Case %s could not be loaded: %s",
+                                      full_name, reason)
+                    self.handle_case_result({"id": case_id,
+                                             "name": full_name,
+                                             "result": "fail",
+                                             "errors": [reason],
+                                             "logs": []})
+            return None
+
+    def __device_worker(self, device, workers, waiter):
+        """ run cases from queue on device until queue is empty, retire if
+            device goes offline while other workers still running. waiter
+            is the thread joining workers
+        """
+        tracing.link_thread(waiter)
+        while True:
+            case = self.__pop_case()
+            if case is None:
+                break
+            if not device.check_alive():
+                with self.queue_lock:
+                    if len(workers) > 1:
+                        self.logger.error("Device %s offline, give case %s "
+                                          "back and retire.",
+                                          device.serial, case.name)
+                        self.case_queue.insert(0, case)
+                        workers.remove(device.serial)
+                        return
+            self.handle_case_result(self.run_case(device, case))
+        with self.queue_lock:
+            if device.serial in workers:
+                workers.remove(device.serial)
+
+    def __run_parallel(self):
+        """ run cases with one worker thread per device """
+        workers = [d.serial for d in self.devices]
+        threads = [threading.Thread(target=self.__device_worker,
+                                    args=(d, workers,
+                                          threading.current_thread()),
+                                    name="worker-%s" %d.serial)
+                   for d in self.devices]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+
+    @tracing.traced("TestSuite.run")
+    def run(self):
+        """Run current test suite"""
+        #TODO: Add suite timeout
+        self.logger.info("Start running test suite %s.", self.name)
+        if self.parallel:
+            self.devices = self.detect_devices(self.device_type)
+            self.device = self.devices[0] if self.devices else None
+        else:
+            self.device = self.detect_device(self.device_type)
+            self.devices = [self.device] if self.device else []
+        if self.device is None:
+            self.logger.error("Available %s device not found, stop running.",
+                               self.device_type["name"])
+            raise SuiteFailToStartError()
+        if self.history is not None:
+            self.schedule_cases()
+        self.report_sink.open({"name": self.name,
+                               "suite_path": self.suite_path,
+                               "time_stamp": self.time_stamp})
+        try:
+            if self.logcat:
+                self.__start_logcat()
+            if self.parallel:
+                self.logger.info("Run cases on %d devices in parallel.",
+                                 len(self.devices))
+                self.__run_parallel()
+            while True:
+                current_case = self.__pop_case()
+                if current_case is None:
+                    break
+                self.handle_case_result(self.run_case(self.device,
+                                                      current_case))
+        finally:
+            self.__stop_logcat()
+            self.report_sink.close()
+            if self.history is not None:
+                self.history.close()
         self.logger.info("Total %d cases of suite has been executed.",
                          self.result['count']['total'])
         self.logger.info("Total pass: %d", self.result['count']['pass'])
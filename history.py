@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+""" Historical case results in a local SQLite database and a scheduler
+    which orders cases and estimates suite runtime from them.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("History")
+logger.setLevel(logging.INFO)
+
+DEFAULT_HISTORY_DB = os.path.join(os.path.expanduser("~"), ".cache",
+                                  "android_bat", "history.db")
+DURATION_WEIGHT = 0.3
+#weight of latest run in moving average of case duration
+RECENT_FAIL_WINDOW = 7 * 24 * 3600
+#failures within this many seconds count as recent
+SCHEDULE_LONGEST_FIRST = "longest-first"
+SCHEDULE_FAILING_FIRST = "failing-first"
+SCHEDULES = (SCHEDULE_LONGEST_FIRST, SCHEDULE_FAILING_FIRST)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    suite TEXT, case_id TEXT, serial TEXT, started REAL,
+    duration REAL, result TEXT, rounds INTEGER);
+CREATE INDEX IF NOT EXISTS runs_case ON runs (suite, case_id, started);
+CREATE TABLE IF NOT EXISTS case_stats (
+    suite TEXT, case_id TEXT, runs INTEGER, avg_duration REAL,
+    last_result TEXT, last_fail REAL,
+    PRIMARY KEY (suite, case_id));
+"""
+
+
+class CaseHistory(object):
+    """ Per case duration, outcome and retry count of every run, plus a
+        summary row per case kept up to date for cheap scheduling reads.
+    """
+    def __init__(self, path=DEFAULT_HISTORY_DB):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def record(self, suite, case_id, serial, started, duration, result,
+               rounds):
+        """ save one case run and update its summary """
+        with self.lock:
+            with self.conn:
+                self.conn.execute("INSERT INTO runs VALUES (?,?,?,?,?,?,?)",
+                                  (suite, case_id, serial, started, duration,
+                                   result, rounds))
+                row = self.conn.execute(
+                    "SELECT runs, avg_duration, last_fail FROM case_stats "
+                    "WHERE suite=? AND case_id=?", (suite, case_id)).fetchone()
+                runs, avg_duration, last_fail = row if row else (0, None, None)
+                if avg_duration is None:
+                    avg_duration = duration
+                else:
+                    avg_duration += DURATION_WEIGHT * (duration - avg_duration)
+                if result in ("fail", "block"):
+                    last_fail = started
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO case_stats VALUES (?,?,?,?,?,?)",
+                    (suite, case_id, runs + 1, avg_duration, result,
+                     last_fail))
+
+    def stats(self, suite):
+        """ {case id: {"runs", "avg_duration", "last_result", "last_fail"}} """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT case_id, runs, avg_duration, last_result, last_fail "
+                "FROM case_stats WHERE suite=?", (suite,)).fetchall()
+        return dict((r[0], {"runs": r[1], "avg_duration": r[2],
+                            "last_result": r[3], "last_fail": r[4]})
+                    for r in rows)
+
+    def close(self):
+        """ close database """
+        with self.lock:
+            self.conn.close()
+
+
+def _case_id(entry):
+    """ suite YAML key of a case entry """
+    return list(entry.keys())[0]
+
+def estimate_duration(entry, stats, default):
+    """ expected seconds of case entry, default if no history """
+    case_stats = stats.get(_case_id(entry))
+    if case_stats is None or case_stats["avg_duration"] is None:
+        return default
+    return case_stats["avg_duration"]
+
+def default_duration(stats):
+    """ median duration of known cases, used for cases without history """
+    durations = sorted(s["avg_duration"] for s in stats.values()
+                       if s["avg_duration"] is not None)
+    return durations[len(durations) // 2] if durations else 0
+
+def order_cases(entries, stats, schedule):
+    """ return case entries ordered by schedule
+        longest-first: longest expected duration first, so a greedy device
+                       pool finishes close together
+        failing-first: cases failed last time, then ones failed recently,
+                       then the rest, each group keeps suite order
+    """
+    default = default_duration(stats)
+    if schedule == SCHEDULE_LONGEST_FIRST:
+        return sorted(entries, key=lambda e: -estimate_duration(e, stats,
+                                                                default))
+    if schedule == SCHEDULE_FAILING_FIRST:
+        now = time.time()
+        def priority(entry):
+            """ 0 failed last run, 1 failed recently, 2 others """
+            case_stats = stats.get(_case_id(entry))
+            if case_stats is None:
+                return 2
+            if case_stats["last_result"] in ("fail", "block"):
+                return 0
+            if case_stats["last_fail"] is not None and \
+               now - case_stats["last_fail"] < RECENT_FAIL_WINDOW:
+                return 1
+            return 2
+        return sorted(entries, key=priority)
+    raise ValueError("Unknown schedule %s" %schedule)
+
+def estimate_runtime(entries, stats, device_count=1):
+    """ expected suite seconds if entries run in given order on a pool of
+        device_count devices, each case goes to the first free device
+    """
+    default = default_duration(stats)
+    loads = [0.0] * max(device_count, 1)
+    for entry in entries:
+        index = loads.index(min(loads))
+        loads[index] += estimate_duration(entry, stats, default)
+    return max(loads)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+""" Host wide cache of flash images, every entry holds the downloaded zip
+    and its extracted tree. Entries are keyed by checksum if known, else by
+    url and ETag or Last-Modified, shared between concurrent flashes through
+    file locks and evicted least recently used first to stay under a disk
+    budget. An image the server gives no validator for is not cached.
+"""
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import logging
+import contextlib
+
+import requests
+
+import utils
+
+logger = logging.getLogger("ImageCache")
+logger.setLevel(logging.INFO)
+
+DEFAULT_IMAGE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+                                       "android_bat", "images")
+DEFAULT_IMAGE_CACHE_BUDGET = 30 * 1024 * 1024 * 1024
+META_FILE = "meta.json"
+
+
+class ImageCacheError(Exception):
+    """Image could not be fetched into cache"""
+    pass
+
+
+def _dir_size(path):
+    """ total bytes of files under path """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ImageCache(object):
+    """ <root>/<key>/ holds image zip, extracted tree and meta.json,
+        <root>/<key>.lock is held shared while an entry is in use and
+        exclusive while it is populated or evicted.
+    """
+    def __init__(self, root=DEFAULT_IMAGE_CACHE_DIR,
+                 max_bytes=DEFAULT_IMAGE_CACHE_BUDGET):
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    @staticmethod
+    def key(url, validator=None, checksum=None):
+        """ cache key of image, None if neither validator nor checksum is
+            known, content of url could change under the same key then
+        """
+        if checksum is not None:
+            return hashlib.sha1(checksum.lower().encode("utf-8")).hexdigest()
+        if validator is None:
+            return None
+        return hashlib.sha1(("%s\n%s" %(url, validator)).encode("utf-8")) \
+                      .hexdigest()
+
+    def entry_dir(self, key):
+        """ directory of cache entry """
+        return os.path.join(self.root, key)
+
+    def __read_meta(self, key):
+        """ meta of complete entry, None if entry missing or incomplete """
+        try:
+            with open(os.path.join(self.entry_dir(key), META_FILE)) as meta_fd:
+                meta = json.load(meta_fd)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta if meta.get("complete") else None
+
+    def __write_meta(self, key, meta):
+        """ write meta atomically """
+        meta_file = os.path.join(self.entry_dir(key), META_FILE)
+        with open(meta_file + ".tmp", "w") as meta_fd:
+            json.dump(meta, meta_fd)
+        os.rename(meta_file + ".tmp", meta_file)
+
+    @staticmethod
+    def probe_validator(url, auth=None, ssl_verify=False):
+        """ ETag of url, else its Last-Modified and Content-Length, None if
+            server gives neither
+        """
+        try:
+            r = requests.head(url, auth=auth, allow_redirects=True,
+                              verify=ssl_verify)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning("Could not get ETag of %s, see %s", url, str(e))
+            return None
+        if r.headers.get("ETag"):
+            return r.headers["ETag"]
+        if r.headers.get("Last-Modified"):
+            return "%s\n%s" %(r.headers["Last-Modified"],
+                              r.headers.get("Content-Length"))
+        return None
+
+    def populate(self, key, url, auth=None, checksum=None, ssl_verify=False):
+        """ download image into entry and extract it while it downloads,
+            caller holds exclusive entry lock. return meta
+        """
+        entry = self.entry_dir(key)
+        if not os.path.isdir(entry):
+            os.makedirs(entry)
+        user, password = auth if auth is not None else (None, None)
+        zip_file = os.path.join(entry, url.split('/')[-1])
+        is_zip = zip_file.endswith(".zip")
+        image_dir = zip_file[:-4] if is_zip else zip_file
+        extractor = utils.StreamingZipExtractor(zip_file, image_dir).start() \
+                    if is_zip else None
+        downloaded = False
+        try:
+            utils.download_image(url, path=entry, user=user,
+                                 password=password, ssl_verify=ssl_verify,
+                                 checksum=checksum,
+                                 progress_callback=extractor.feed
+                                 if extractor is not None else None)
+            downloaded = True
+        except utils.DownloadError as e:
+            raise ImageCacheError(str(e))
+        finally:
+            if extractor is not None and not downloaded:
+                #extractor thread waits for data which will never come
+                extractor.abort()
+        if extractor is not None:
+            try:
+                extractor.finish()
+            except (IOError, OSError, zipfile.BadZipfile) as e:
+                raise ImageCacheError("Extract %s failed, see %s"
+                                      %(zip_file, str(e)))
+        meta = {"url": url, "checksum": checksum, "complete": True,
+                "zip": os.path.basename(zip_file),
+                "image_dir": os.path.basename(image_dir),
+                "size": _dir_size(entry), "created": time.time()}
+        self.__write_meta(key, meta)
+        return meta
+
+    @contextlib.contextmanager
+    def __lock(self, key, mode):
+        """ flock <key>.lock with mode """
+        with open(os.path.join(self.root, key + ".lock"), "a") as lock_fd:
+            fcntl.flock(lock_fd, mode)
+            try:
+                yield lock_fd
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def open(self, url, auth=None, checksum=None, ssl_verify=False):
+        """ yield extracted image directory of url, fetching it on miss.
+            Entry could not be evicted while the context is active.
+        """
+        validator = None if checksum is not None else \
+                    self.probe_validator(url, auth, ssl_verify)
+        key = self.key(url, validator, checksum)
+        if key is None:
+            with self.__uncached(url, auth, ssl_verify) as image_dir:
+                yield image_dir
+            return
+        while True:
+            with self.__lock(key, fcntl.LOCK_EX) as lock_fd:
+                meta = self.__read_meta(key)
+                if meta is None:
+                    logger.info("Image cache miss %s, fetch into %s",
+                                url, self.entry_dir(key))
+                    meta = self.populate(key, url, auth, checksum,
+                                         ssl_verify)
+                    self.evict(keep=key)
+                else:
+                    logger.info("Image cache hit %s: %s",
+                                url, self.entry_dir(key))
+                os.utime(os.path.join(self.entry_dir(key), META_FILE), None)
+                fcntl.flock(lock_fd, fcntl.LOCK_SH)
+                #converting the lock is not atomic, another process could
+                #evict the entry in between
+                if self.__read_meta(key) is None:
+                    logger.info("Image %s evicted while locking, fetch "
+                                "again.", key)
+                    continue
+                yield os.path.join(self.entry_dir(key), meta["image_dir"])
+                return
+
+    @contextlib.contextmanager
+    def __uncached(self, url, auth, ssl_verify):
+        """ yield image of url fetched into a private entry, removed when
+            the context ends
+        """
+        logger.warning("No ETag or Last-Modified of %s, it is not cached.",
+                       url)
+        key = os.path.basename(tempfile.mkdtemp(prefix="uncached-",
+                                                dir=self.root))
+        try:
+            with self.__lock(key, fcntl.LOCK_EX):
+                meta = self.populate(key, url, auth, None, ssl_verify)
+                yield os.path.join(self.entry_dir(key), meta["image_dir"])
+        finally:
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            try:
+                os.remove(os.path.join(self.root, key + ".lock"))
+            except OSError:
+                pass
+
+    def entries(self):
+        """ [(last used, size, key)] of complete entries """
+        result = []
+        for key in os.listdir(self.root):
+            meta = self.__read_meta(key) if os.path.isdir(
+                                            self.entry_dir(key)) else None
+            if meta is not None:
+                last_used = os.path.getmtime(os.path.join(self.entry_dir(key),
+                                                          META_FILE))
+                result.append((last_used, meta["size"], key))
+        return result
+
+    def evict(self, keep=None):
+        """ remove incomplete entries left by failed fetches, then least
+            recently used entries not in use until total size fits in
+            budget, keep is never removed.
+        """
+        for key in os.listdir(self.root):
+            if key != keep and os.path.isdir(self.entry_dir(key)) and \
+               self.__read_meta(key) is None:
+                self.__remove_unused(key, "incomplete image")
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            if self.__remove_unused(key, "image, %d bytes" %size):
+                total -= size
+        return total
+
+    def __remove_unused(self, key, what):
+        """ remove entry if nobody holds its lock, return True if removed """
+        lock_file = os.path.join(self.root, key + ".lock")
+        with open(lock_file, "a") as lock_fd:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                logger.info("Image %s in use, not evicted.", key)
+                return False
+            logger.info("Evict %s %s.", what, key)
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        return True
+
+
+_default_cache = []
+
+def default_cache():
+    """ process wide ImageCache in DEFAULT_IMAGE_CACHE_DIR """
+    if not _default_cache:
+        _default_cache.append(ImageCache())
+    return _default_cache[0]
+
+@contextlib.contextmanager
+def stage_image(image, auth=None, checksum=None):
+    """ yield absolute directory of extracted image, raise ImageCacheError if
+        it could not be staged
+        image: url link fetched through default cache, local zip file
+               extracted next to it or local directory
+        auth: (username, password)
+        checksum: "<algorithm>:<hex digest>" of url image, optional
+    """
+    if image.startswith("http://") or image.startswith("https://"):
+        logger.info("Got image url link, fetch it to image cache.")
+        with default_cache().open(image, auth=auth,
+                                  checksum=checksum) as image_dir:
+            yield image_dir
+        return
+    image_dir = image
+    if image.endswith(".zip"):
+        logger.info("Local image %s is a zip file, extract it first", image)
+        try:
+            image_dir = utils.extract_zip(image, image[:-4])
+        except (IOError, OSError, zipfile.BadZipfile) as e:
+            raise ImageCacheError("Extract %s failed, see %s" %(image, str(e)))
+    yield os.path.abspath(image_dir)
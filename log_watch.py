@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+""" Watch patterns matched against logcat as it is captured. Patterns are
+    compiled into one combined regex when they are loaded, so a batch of
+    lines is scanned once no matter how many patterns there are. Only lines
+    the combined regex hits are matched again one pattern at a time to tell
+    which pattern fired. Patterns with groups, backreferences or inline
+    flags can not be combined safely and are searched one by one.
+
+    Suite yaml:
+    logcat_watch:                    #suite-wide, default DEFAULT_PATTERNS
+      anr: "ANR in "
+      low_memory: {pattern: "lowmemorykiller: Kill", abort: false}
+    case:
+    - boot:
+        logcat_watch: ["Watchdog: \\*\\*\\* WATCHDOG KILLING"]
+"""
+
+import re
+import bisect
+import logging
+
+logger = logging.getLogger("LogWatch")
+logger.setLevel(logging.INFO)
+
+DEFAULT_PATTERNS = {
+    "crash": r"FATAL EXCEPTION",
+    "native_crash": r"Fatal signal \d+",
+    "tombstone": r"Tombstone written to",
+    "anr": r"ANR in ",
+    "kernel_panic": r"Kernel panic",
+    "watchdog": r"WATCHDOG KILLING SYSTEM PROCESS",
+}
+EXCERPT_LINES = 20
+#log lines up to and including the matching one given to callbacks
+INLINE_FLAGS_RE = re.compile(r"\(\?[aiLmsux]+\)")
+#global inline flags such as (?i) apply to the whole combined regex
+
+
+class WatchPatternError(Exception):
+    """Watch pattern could not be compiled"""
+    pass
+
+
+class WatchPattern(object):
+    """ one named pattern, abort: matching aborts current case """
+    def __init__(self, name, pattern, abort=True):
+        self.name = name
+        self.pattern = pattern
+        self.abort = abort
+        try:
+            self.regex = re.compile(pattern, re.M)
+        except re.error as e:
+            raise WatchPatternError("Bad watch pattern %s: %s, see %s"
+                                    %(name, pattern, str(e)))
+        self.combinable = not self.regex.groups and \
+                          not INLINE_FLAGS_RE.search(pattern)
+
+def load_patterns(config):
+    """ [WatchPattern] of logcat_watch yaml value: a list of patterns or a
+        mapping of name to pattern or {pattern: ..., abort: bool}
+    """
+    if not config:
+        return []
+    if isinstance(config, (list, tuple)):
+        config = dict((p, p) for p in config)
+    patterns = []
+    for name in sorted(config):
+        value = config[name]
+        if isinstance(value, dict):
+            patterns.append(WatchPattern(name, value["pattern"],
+                                         value.get("abort", True)))
+        else:
+            patterns.append(WatchPattern(name, value))
+    return patterns
+
+
+class LogWatch(object):
+    """ combined matcher of patterns, raise WatchPatternError if they could
+        not be combined
+        for index, pattern, line in LogWatch(patterns).scan(lines):
+            ...
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.separate = [p for p in self.patterns if not p.combinable]
+        combined = [p for p in self.patterns if p.combinable]
+        self.combined = None
+        if combined:
+            try:
+                self.combined = (re.compile("|".join("(?:%s)" %p.pattern
+                                                     for p in combined),
+                                            re.M), combined)
+            except (re.error, OverflowError, RuntimeError) as e:
+                raise WatchPatternError("Watch patterns %s could not be "
+                                        "combined, see %s"
+                                        %(", ".join(p.name for p in combined),
+                                          str(e)))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def scan(self, lines):
+        """ [(line index, WatchPattern, line)] of lines any pattern matches,
+            ordered by line
+        """
+        hits = []
+        if self.combined is not None:
+            regex, patterns = self.combined
+            text, starts = "\n".join(lines), None
+            match = regex.search(text)
+            while match is not None:
+                if starts is None:
+                    starts = [0]
+                    for line in lines[:-1]:
+                        starts.append(starts[-1] + len(line) + 1)
+                index = bisect.bisect_right(starts, match.start()) - 1
+                hits.extend((index, p, lines[index]) for p in patterns
+                            if p.regex.search(lines[index]))
+                if index + 1 >= len(lines):
+                    break
+                match = regex.search(text, starts[index + 1])
+        if self.separate:
+            hits.extend((index, p, line) for index, line in enumerate(lines)
+                        for p in self.separate if p.regex.search(line))
+            hits.sort(key=lambda hit: hit[0])
+        return hits
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+""" Background logcat capture of one device. Binary logcat output
+    ("logcat -B") is read in a daemon thread and parsed into threadtime
+    style lines, kept in a bounded in-memory ring and appended to a gzip
+    spool on disk. Lines are numbered, so a case marks where its window
+    starts and ends and gets exactly those lines back.
+"""
+
+import os
+import gzip
+import zlib
+import time
+import struct
+import socket
+import logging
+import itertools
+import threading
+import collections
+
+import adb
+import utils
+import log_watch
+
+logger = logging.getLogger("Logcat")
+logger.setLevel(logging.INFO)
+
+LOGCAT_BUFFERS = "main,system,crash"
+LOGCAT_CMD = "logcat -B -b %s -T 1"
+DEFAULT_RING_SIZE = 100000
+SPOOL_COMPRESS_LEVEL = 1
+#cheapest gzip level, spool has to keep up with a chatty device
+RECONNECT_INTERVAL = 1
+READ_SIZE = 256 * 1024
+
+ENTRY_PREFIX = struct.Struct("<HH")
+ENTRY_FIELDS = struct.Struct("<iIII")
+#logger_entry: payload length, header size (0 in v1), pid, tid, sec, nsec,
+#then lid (v3) and uid (v4), payload is priority, tag\0, message\0
+ENTRY_V1_HEADER_SIZE = 20
+ENTRY_HEADER_SIZES = (20, 24, 28)
+PRIORITIES = "??VDIWEFS"
+
+
+class LogcatFormatError(Exception):
+    """Logcat stream is not in binary format or out of sync"""
+    pass
+
+
+def parse_entries(data, offset=0):
+    """ parse complete binary log entries in data from offset
+        return: ([(sec, nsec, pid, tid, priority, tag, message)],
+                 offset of first incomplete entry)
+    """
+    entries = []
+    size = len(data)
+    while offset + ENTRY_V1_HEADER_SIZE <= size:
+        payload_size, header_size = ENTRY_PREFIX.unpack_from(data, offset)
+        header_size = header_size or ENTRY_V1_HEADER_SIZE
+        if header_size not in ENTRY_HEADER_SIZES:
+            raise LogcatFormatError("Bad log entry header size %d"
+                                    %header_size)
+        end = offset + header_size + payload_size
+        if end > size:
+            break
+        pid, tid, sec, nsec = ENTRY_FIELDS.unpack_from(data, offset + 4)
+        payload = data[offset + header_size:end]
+        tag_end = payload.find(b"\0", 1)
+        if tag_end < 0:
+            tag_end = len(payload)
+        priority = PRIORITIES[payload[0]] if payload and \
+                   payload[0] < len(PRIORITIES) else "?"
+        entries.append((sec, nsec, pid, tid, priority,
+                        payload[1:tag_end].decode("utf-8", "replace"),
+                        payload[tag_end + 1:].rstrip(b"\0\n")
+                                             .decode("utf-8", "replace")))
+        offset = end
+    return entries, offset
+
+def format_entry(entry):
+    """ threadtime style lines of entry, one per message line """
+    sec, nsec, pid, tid, priority, tag, message = entry
+    prefix = "%s.%03d %5d %5d %s %s: " %(
+        time.strftime("%m-%d %H:%M:%S", time.localtime(sec)),
+        nsec // 1000000, pid, tid, priority, tag)
+    return [prefix + line for line in message.split("\n")]
+
+
+class LogcatReader(object):
+    """ Capture logcat of serial in background.
+        spool_path: gzip file every line is appended to, None keeps ring only
+        ring_size: lines kept in memory
+
+        reader = LogcatReader(serial, "device.logcat.gz").start()
+        start = reader.mark()
+        ...run case...
+        lines = reader.window(start, reader.mark())
+        reader.stop()
+    """
+    def __init__(self, serial, spool_path=None, ring_size=DEFAULT_RING_SIZE,
+                 buffers=LOGCAT_BUFFERS):
+        self.serial = serial
+        self.spool_path = spool_path
+        self.command = LOGCAT_CMD %buffers
+        self.ring = collections.deque(maxlen=ring_size)
+        self.seq = 0
+        #number of lines captured so far, line n has seq n
+        self.lock = threading.Lock()
+        self.spool_lock = threading.Lock()
+        self.spool = None
+        self.stopped = threading.Event()
+        self.stream = None
+        self.thread = None
+        self.watches = []
+
+    def start(self):
+        """ start capture thread """
+        if self.spool_path is not None:
+            self.spool = gzip.open(self.spool_path, "wb",
+                                   compresslevel=SPOOL_COMPRESS_LEVEL)
+        self.thread = threading.Thread(target=self.__run,
+                                       name="logcat-%s" %self.serial)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ stop capture, close stream and spool """
+        self.stopped.set()
+        self.__close_stream()
+        if self.thread is not None:
+            self.thread.join()
+        with self.spool_lock:
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
+
+    def __open_stream(self):
+        """ (read function, stream) of logcat output, native exec: service
+            if possible, else adb binary
+        """
+        if adb.NATIVE_CLIENT:
+            try:
+                sock = adb.open_transport(self.serial, "exec:%s"
+                                          %self.command)
+                return sock.recv, sock
+            except (socket.error, adb.ADBConnectionException,
+                    adb.ADBProtocolException) as e:
+                logger.debug("Native logcat of %s failed, use adb binary. "
+                             "See %s", self.serial, str(e))
+        process = utils.ShellCommand("adb -s %s exec-out %s"
+                                     %(self.serial, self.command)).start()
+        fd = process.process.stdout.fileno()
+        return lambda size: os.read(fd, size), process
+
+    def __close_stream(self):
+        """ unblock capture thread reading current stream """
+        stream = self.stream
+        if isinstance(stream, utils.ShellCommand):
+            stream.kill()
+        elif stream is not None:
+            try:
+                stream.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __run(self):
+        """ capture thread body, reconnect while device reboots """
+        while not self.stopped.is_set():
+            try:
+                read, self.stream = self.__open_stream()
+                self.__capture(read)
+            except (OSError, ValueError, socket.error,
+                    adb.ADBConnectionException, adb.ADBProtocolException,
+                    LogcatFormatError) as e:
+                logger.debug("Logcat of %s interrupted, see %s",
+                             self.serial, str(e))
+            finally:
+                self.__close_stream()
+                if isinstance(self.stream, utils.ShellCommand):
+                    self.stream.wait()
+                elif self.stream is not None:
+                    self.stream.close()
+                self.stream = None
+            self.stopped.wait(RECONNECT_INTERVAL)
+
+    def __capture(self, read):
+        """ read and parse stream until it ends """
+        pending = bytearray()
+        while not self.stopped.is_set():
+            data = read(READ_SIZE)
+            if not data:
+                return
+            pending.extend(data)
+            entries, offset = parse_entries(pending)
+            del pending[:offset]
+            if entries:
+                self.__append([line for entry in entries
+                               for line in format_entry(entry)])
+
+    def __append(self, lines):
+        """ number lines, add them to ring and spool """
+        with self.lock:
+            first = self.seq
+            self.ring.extend(lines)
+            self.seq += len(lines)
+        with self.spool_lock:
+            if self.spool is not None:
+                self.spool.write("".join("%d\t%s\n" %(first + i, line)
+                                         for i, line in enumerate(lines))
+                                 .encode("utf-8"))
+        for watch, callback in list(self.watches):
+            for index, pattern, line in watch.scan(lines):
+                excerpt = self.window(first + index - log_watch.EXCERPT_LINES
+                                      + 1, first + index + 1)
+                try:
+                    callback(pattern, line, excerpt)
+                except Exception as e:
+                    logger.error("Logcat watch callback of %s failed, see %s",
+                                 self.serial, str(e))
+
+    def watch(self, watch, callback):
+        """ match captured lines against log_watch.LogWatch watch from now
+            on, callback(pattern, line, excerpt lines) is called in capture
+            thread on every match. return handle for unwatch()
+        """
+        handle = (watch, callback)
+        if len(watch):
+            self.watches.append(handle)
+        return handle
+
+    def unwatch(self, handle):
+        """ stop matching watch of handle """
+        if handle in self.watches:
+            self.watches.remove(handle)
+
+    def mark(self):
+        """ seq of next captured line, a window boundary """
+        return self.seq
+
+    def window(self, start, end=None):
+        """ captured lines with start <= seq < end (up to now if None),
+            lines already dropped from ring are read back from spool
+        """
+        with self.lock:
+            end = self.seq if end is None else min(end, self.seq)
+            oldest = self.seq - len(self.ring)
+            lines = list(itertools.islice(self.ring, max(start - oldest, 0),
+                                          max(end - oldest, 0)))
+        if start < oldest:
+            lines = self.__spool_lines(start, min(oldest, end)) + lines
+        return lines
+
+    def __spool_lines(self, start, end):
+        """ lines with start <= seq < end from spool """
+        lines = []
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return lines
+        with self.spool_lock:
+            if self.spool is not None:
+                self.spool.flush(zlib.Z_SYNC_FLUSH)
+        spool = gzip.open(self.spool_path, "rb")
+        try:
+            for record in spool:
+                seq, line = record.decode("utf-8").rstrip("\n").split("\t", 1)
+                if int(seq) >= end:
+                    break
+                if int(seq) >= start:
+                    lines.append(line)
+        except (EOFError, IOError, zlib.error):
+            pass #spool is still being written, its end is not closed
+        finally:
+            spool.close()
+        return lines
+
+    def save_window(self, start, end, path):
+        """ write window lines to gzip file path, return line count """
+        lines = self.window(start, end)
+        with gzip.open(path, "wb", compresslevel=SPOOL_COMPRESS_LEVEL) \
+             as window_fd:
+            for line in lines:
+                window_fd.write((line + "\n").encode("utf-8"))
+        return len(lines)
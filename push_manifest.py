@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+""" Files pushed to each device, kept as one JSON file per serial, so a
+    sync push could tell a file is already on device from its host and
+    device size and mtime without reading it.
+"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger("PushManifest")
+logger.setLevel(logging.INFO)
+
+DEFAULT_PUSH_MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+                                         "android_bat", "push_manifest")
+
+
+def list_host_files(local, remote):
+    """ [(host path, device path)] of file or directory tree local pushed to
+        remote, remote ending with "/" is a directory local is pushed into
+    """
+    if remote.endswith("/"):
+        remote = remote + os.path.basename(os.path.normpath(local))
+    if not os.path.isdir(local):
+        return [(local, remote)]
+    files = []
+    for root, dirs, names in os.walk(local):
+        dirs.sort()
+        relative = os.path.relpath(root, local)
+        for name in sorted(names):
+            device_dir = remote if relative == "." else \
+                         "%s/%s" %(remote, relative.replace(os.sep, "/"))
+            files.append((os.path.join(root, name),
+                          "%s/%s" %(device_dir, name)))
+    return files
+
+
+class PushManifest(object):
+    """ {device path: {"size", "mtime", "hash", "device_size",
+                       "device_mtime"}} of files pushed to serial,
+        host size/mtime and device size/mtime as they were right after push
+    """
+    def __init__(self, serial, manifest_dir=None):
+        self.serial = serial
+        self.path = os.path.join(manifest_dir or DEFAULT_PUSH_MANIFEST_DIR,
+                                 "%s.json" %serial)
+        self.files = {}
+
+    def load(self):
+        """ read manifest of serial, empty if missing or broken """
+        try:
+            with open(self.path, "r") as manifest_fd:
+                self.files = json.load(manifest_fd)["files"]
+        except (IOError, OSError, ValueError, KeyError):
+            self.files = {}
+        return self
+
+    def save(self):
+        """ write manifest atomically """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w") as manifest_fd:
+            json.dump({"serial": self.serial, "files": self.files},
+                      manifest_fd)
+        os.rename(self.path + ".tmp", self.path)
+
+    def unchanged(self, host_path, device_path, device_stat):
+        """ True if host file and device file are both as they were when
+            host file was pushed, device_stat: (size, mtime) or None
+        """
+        entry = self.files.get(device_path)
+        if entry is None or device_stat is None:
+            return False
+        stat = os.stat(host_path)
+        return (entry["size"], entry["mtime"]) == \
+               (stat.st_size, stat.st_mtime) and \
+               (entry["device_size"], entry["device_mtime"]) == device_stat
+
+    def record(self, host_path, device_path, device_stat, digest=None):
+        """ host file and device file are in sync """
+        stat = os.stat(host_path)
+        self.files[device_path] = {"size": stat.st_size,
+                                   "mtime": stat.st_mtime,
+                                   "hash": digest,
+                                   "device_size": device_stat[0],
+                                   "device_mtime": device_stat[1]}
+
+    def forget(self, device_path):
+        """ device file state unknown """
+        self.files.pop(device_path, None)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+""" Crash safe report sink: every case result is appended to a JSON lines
+    file as soon as it completes, final reports are derived from that file.
+"""
+
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger("Report")
+logger.setLevel(logging.INFO)
+
+DEFAULT_FSYNC_COUNT = 10
+DEFAULT_FSYNC_INTERVAL = 5
+#fsync after this many records or seconds, whichever comes first
+
+RECORD_SUITE = "suite"
+RECORD_START = "start"
+RECORD_CASE = "case"
+
+
+class ReportSink(object):
+    """ Append-only JSON lines result file.
+        first record: {"type": "suite", ...suite info}
+        then per case {"type": "start", "id": <case id>} when it starts and
+        {"type": "case", "case": <case result>} when it completes.
+        Every record is flushed right away, fsync is batched, so the file is
+        also the checkpoint a run is resumed from.
+    """
+    def __init__(self, path, fsync_count=DEFAULT_FSYNC_COUNT,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_count = fsync_count
+        self.fsync_interval = fsync_interval
+        self.fd = None
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def open(self, suite_info):
+        """ open sink for appending, write suite record if file is new """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        is_new = not os.path.exists(self.path) or \
+                 os.path.getsize(self.path) == 0
+        self.fd = open(self.path, "a")
+        if is_new:
+            self.__write(dict(suite_info, type=RECORD_SUITE))
+            self.sync()
+        logger.info("Case results are written to %s", self.path)
+        return self
+
+    def __write(self, record):
+        """ append one record and flush it to OS """
+        self.fd.write(json.dumps(record, default=str) + "\n")
+        self.fd.flush()
+
+    def __append(self, record):
+        """ append record, fsync if batch is full or too old """
+        self.__write(record)
+        self.pending += 1
+        if self.pending >= self.fsync_count or \
+           time.time() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def append(self, case_result):
+        """ append case result """
+        self.__append({"type": RECORD_CASE, "case": case_result})
+
+    def mark_started(self, case_id):
+        """ record that case started, batched like results since a case
+            without final result is run again on resume anyway
+        """
+        self.__append({"type": RECORD_START, "id": case_id})
+
+    def sync(self):
+        """ fsync pending records """
+        if self.fd is not None:
+            os.fsync(self.fd.fileno())
+        self.pending = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        """ fsync and close """
+        if self.fd is not None:
+            self.sync()
+            self.fd.close()
+            self.fd = None
+
+    def records(self):
+        """ yield every complete record in file, a torn last line left by a
+            crash is skipped.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as sink_fd:
+            for line in sink_fd:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.warning("Skip broken record in %s", self.path)
+
+    def suite_info(self):
+        """ suite record of file, {} if none """
+        for record in self.records():
+            if record.get("type") == RECORD_SUITE:
+                return record
+        return {}
+
+    def cases(self):
+        """ yield case results in completion order """
+        for record in self.records():
+            if record.get("type") == RECORD_CASE:
+                yield record["case"]
+
+    def progress(self):
+        """ return (ids of cases with final result, ids of started but not
+            finished cases) for resuming a run
+        """
+        finished, started = set(), set()
+        for record in self.records():
+            if record.get("type") == RECORD_START:
+                started.add(record["id"])
+            elif record.get("type") == RECORD_CASE and "id" in record["case"]:
+                finished.add(record["case"]["id"])
+        return finished, started - finished
+
+    def summary(self, total=None):
+        """ result counts derived from file """
+        count = {'pass': 0, 'fail': 0, 'empty': 0, 'block': 0}
+        for case in self.cases():
+            count[case['result']] = count.get(case['result'], 0) + 1
+        count['total'] = total if total is not None else sum(count.values())
+        return count
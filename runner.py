@@ -7,6 +7,8 @@ import logging
 import argparse
 
 from framework import TestSuite
+import history
+import tracing
 
 LOG_FMT = '%(asctime)-15s Android_BAT %(name)-10s %(levelname)-8s %(message)s'
 
@@ -19,6 +21,26 @@ def parse_args(arg_list):
                         help="test_suite yaml file")
     parser.add_argument("-l", "--lava", dest="lava_output",
                         action="store_true", help="generate lava output")
+    parser.add_argument("-p", "--parallel", dest="parallel",
+                        action="store_true",
+                        help="run cases on every matched device in parallel")
+    parser.add_argument("-r", "--resume", dest="resume", action="store",
+                        help="results/<time>_<suite>.jsonl of an interrupted "
+                             "run to resume")
+    parser.add_argument("--history-db", dest="history_db", action="store",
+                        default=history.DEFAULT_HISTORY_DB,
+                        help="case history database, default %(default)s")
+    parser.add_argument("--no-history", dest="history_db",
+                        action="store_const", const=None,
+                        help="do not record or use case history")
+    parser.add_argument("-s", "--schedule", dest="schedule",
+                        choices=history.SCHEDULES,
+                        help="reorder cases by history")
+    parser.add_argument("--no-logcat", dest="logcat", action="store_false",
+                        help="do not capture device logcat")
+    parser.add_argument("--trace", dest="trace", action="store",
+                        help="record framework spans and save them to TRACE "
+                             "as Chrome trace JSON")
     return parser.parse_args(arg_list)
 
 def main(arg_list):
@@ -26,10 +48,25 @@ def main(arg_list):
     logging.basicConfig(format=LOG_FMT, level=logging.DEBUG)
     args = parse_args(arg_list)
     test_suite = args.test_suite
-    suite = TestSuite(suite_path=test_suite)
-    suite.run()
     result_path = os.path.join(os.getcwd(), "results")
-    suite.generate_report(path=result_path)
+    if args.trace:
+        tracing.enable()
+    suite = TestSuite(suite_path=test_suite, parallel=args.parallel,
+                      report_dir=result_path, resume_path=args.resume,
+                      history_path=args.history_db, schedule=args.schedule,
+                      logcat=args.logcat)
+    try:
+        suite.run()
+    finally:
+        #results of finished cases are already on disk, report them even
+        #if run was interrupted
+        suite.generate_report(path=result_path)
+        if args.trace:
+            tracing.log_summary()
+            logging.info("Trace of %d spans saved to %s, open it in "
+                         "ui.perfetto.dev", tracing.export(args.trace),
+                         args.trace)
+            tracing.disable()
     if args.lava_output:
         suite.generate_lava_output()
     return
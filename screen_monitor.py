@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+""" Screen change detection: low resolution raw screencaps are polled and
+    compared with NumPy, so a case could wait until the screen is stable,
+    until it changed, or check that it keeps changing (video playback)
+    instead of sleeping for a fixed time.
+"""
+
+import time
+import struct
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("ScreenMonitor")
+logger.setLevel(logging.INFO)
+
+DEFAULT_FRAME_WIDTH = 120
+#frames are downsampled to about this many pixels per row
+PIXEL_THRESHOLD = 16
+#a pixel changed if its gray level moved by more than this (0-255)
+STABLE_THRESHOLD = 0.002
+CHANGE_THRESHOLD = 0.01
+#fraction of changed pixels below which frames are the same / above which
+#the screen changed
+RAW_SCREENCAP_FORMATS = {1: ("RGBA", "RGBA", 4), 2: ("RGB", "RGBX", 4),
+                         3: ("RGB", "RGB", 3), 4: ("RGB", "BGR;16", 2),
+                         5: ("RGBA", "BGRA", 4)}
+#raw screencap pixel format -> (PIL mode, PIL raw mode, bytes per pixel)
+
+
+def parse_raw_screencap(data):
+    """ (width, height, pixel format, memoryview of pixels) of raw
+        "screencap" output: header is width, height and format as 32 bit
+        ints, followed by color space since Android P
+    """
+    width, height, pixel_format = struct.unpack_from("<III", data)
+    if pixel_format not in RAW_SCREENCAP_FORMATS:
+        raise ValueError("Unknown screencap pixel format %d" %pixel_format)
+    pixel_size = RAW_SCREENCAP_FORMATS[pixel_format][2]
+    header = len(data) - width * height * pixel_size
+    if header not in (12, 16):
+        raise ValueError("Screencap of %dx%d has %d bytes"
+                         %(width, height, len(data)))
+    return width, height, pixel_format, memoryview(data)[header:]
+
+def gray_array(pixels, width, height, pixel_format, step=1):
+    """ gray level float32 array of raw pixels, every step-th column and
+        row is kept
+    """
+    pixel_size = RAW_SCREENCAP_FORMATS[pixel_format][2]
+    if pixel_size == 2:
+        rgb565 = np.frombuffer(pixels, dtype="<u2").reshape(
+                     height, width)[::step, ::step]
+        return (((rgb565 >> 11) & 0x1f) * 8.0 + ((rgb565 >> 5) & 0x3f) * 4.0
+                + (rgb565 & 0x1f) * 8.0).astype(np.float32) / 3
+    rgb = np.frombuffer(pixels, dtype=np.uint8).reshape(
+              height, width, pixel_size)[::step, ::step, :3]
+    return rgb.mean(axis=2, dtype=np.float32)
+
+def frame_array(data, width=DEFAULT_FRAME_WIDTH):
+    """ downsampled gray level float32 array of raw screencap output """
+    frame_width, frame_height, pixel_format, pixels = \
+        parse_raw_screencap(data)
+    step = max(1, frame_width // width)
+    return gray_array(pixels, frame_width, frame_height, pixel_format, step)
+
+def changed_fraction(frame, other):
+    """ fraction of pixels which differ between two frames """
+    return float((np.abs(frame - other) > PIXEL_THRESHOLD).mean())
+
+
+class ScreenMonitor(object):
+    """ Poll device screen every interval seconds.
+        monitor = ScreenMonitor(device)
+        monitor.wait_until_stable(timeout=60)
+        monitor.wait_until_changed(timeout=10)
+        monitor.keeps_changing(duration=10)
+        region: (left, top, right, bottom) fractions of screen to compare,
+                e.g. (0, 0.05, 1, 1) leaves status bar out
+    """
+    def __init__(self, dut, interval=0.5, width=DEFAULT_FRAME_WIDTH,
+                 region=None):
+        if np is None:
+            raise ImportError("NumPy is required by ScreenMonitor, install "
+                              "with pip install numpy")
+        self.device = dut
+        self.interval = interval
+        self.width = width
+        self.region = region
+
+    def grab(self):
+        """ current frame, None if capture failed """
+        data = self.device.screencap_data(raw=True)
+        if data is None:
+            return None
+        try:
+            frame = frame_array(data, self.width)
+        except (ValueError, struct.error) as e:
+            logger.error("Could not decode screencap, see %s", str(e))
+            return None
+        if self.region is not None:
+            height, width = frame.shape
+            left, top, right, bottom = self.region
+            frame = frame[int(top * height):int(bottom * height),
+                          int(left * width):int(right * width)]
+        return frame
+
+    def frames(self, duration):
+        """ yield (time, frame) every interval for duration seconds """
+        deadline = time.time() + duration
+        while True:
+            started = time.time()
+            frame = self.grab()
+            if frame is not None:
+                yield started, frame
+            if time.time() >= deadline:
+                return
+            time.sleep(max(0, min(self.interval - (time.time() - started),
+                                  deadline - time.time())))
+
+    def wait_until_stable(self, timeout=60, stable_time=3,
+                          threshold=STABLE_THRESHOLD):
+        """ wait until screen did not change for stable_time seconds,
+            return True if it settled within timeout
+        """
+        last, stable_since = None, None
+        for now, frame in self.frames(timeout):
+            if last is not None and \
+               changed_fraction(frame, last) <= threshold:
+                if stable_since is None:
+                    stable_since = now
+                elif now - stable_since >= stable_time:
+                    logger.info("Screen stable for %.1f seconds.",
+                                now - stable_since)
+                    return True
+            else:
+                stable_since = None
+            last = frame
+        logger.warning("Screen not stable in %d seconds.", timeout)
+        return False
+
+    def wait_until_changed(self, timeout=10, reference=None,
+                           threshold=CHANGE_THRESHOLD):
+        """ wait until screen differs from reference frame (current frame if
+            None), return True if it changed within timeout
+        """
+        if reference is None:
+            reference = self.grab()
+        for _, frame in self.frames(timeout):
+            if reference is None:
+                reference = frame
+            elif changed_fraction(frame, reference) > threshold:
+                logger.info("Screen changed.")
+                return True
+        logger.warning("Screen did not change in %d seconds.", timeout)
+        return False
+
+    def change_ratio(self, duration=10, threshold=STABLE_THRESHOLD):
+        """ fraction of consecutive frame pairs in duration seconds which
+            differ
+        """
+        last, pairs, changes = None, 0, 0
+        for _, frame in self.frames(duration):
+            if last is not None:
+                pairs += 1
+                if changed_fraction(frame, last) > threshold:
+                    changes += 1
+            last = frame
+        return float(changes) / pairs if pairs else 0.0
+
+    def keeps_changing(self, duration=10, min_ratio=0.8,
+                       threshold=STABLE_THRESHOLD):
+        """ True if screen changed between at least min_ratio of the frames
+            polled in duration seconds, such as a playing video
+        """
+        ratio = self.change_ratio(duration, threshold)
+        logger.info("Screen changed in %.0f%% of frames.", ratio * 100)
+        return ratio >= min_ratio
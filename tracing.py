@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+""" Span tracing of framework hot paths: shell commands, adb calls, Device
+    methods, case rounds and suite run. Spans are recorded into a buffer
+    preallocated when tracing is enabled, so recording one is a few list
+    stores, and nothing but a None check is done while tracing is off.
+    Recorded spans are exported as Chrome trace JSON, which loads in
+    chrome://tracing and ui.perfetto.dev.
+
+    tracing.enable()
+    with tracing.span("flash", "device", image):
+        ...
+    tracing.export("trace.json")
+    for name, count, total, self_time in tracing.summary():
+        ...
+"""
+
+import json
+import time
+import logging
+import functools
+import itertools
+import threading
+
+logger = logging.getLogger("Tracing")
+logger.setLevel(logging.INFO)
+
+DEFAULT_TRACE_CAPACITY = 1 << 18
+#spans kept, later ones are counted as dropped
+TOP_SINKS = 15
+clock = getattr(time, "perf_counter", time.time)
+
+_buffer = None
+
+
+class SpanBuffer(object):
+    """ fixed size columns of (name, category, thread, start, duration,
+        argument) of finished spans
+    """
+    def __init__(self, capacity=DEFAULT_TRACE_CAPACITY):
+        self.capacity = capacity
+        self.names = [None] * capacity
+        self.categories = [None] * capacity
+        self.threads = [None] * capacity
+        self.starts = [0.0] * capacity
+        self.durations = [0.0] * capacity
+        self.args = [None] * capacity
+        self.slots = itertools.count()
+        #next() on count is atomic, every span gets its own slot
+        self.dropped = 0
+        self.waiters = {}
+        #{thread: thread waiting on it}, see link_thread
+        self.origin = clock()
+        self.wall_origin = time.time()
+
+    def record(self, name, category, start, duration, arg=None):
+        """ store one finished span """
+        slot = next(self.slots)
+        if slot >= self.capacity:
+            self.dropped += 1
+            return
+        self.names[slot] = name
+        self.categories[slot] = category
+        self.threads[slot] = threading.current_thread()
+        self.starts[slot] = start
+        self.durations[slot] = duration
+        self.args[slot] = arg
+
+    def spans(self):
+        """ yield (name, category, thread, start, duration, arg), slots
+            not written yet are skipped
+        """
+        for i in range(self.capacity):
+            if self.threads[i] is not None:
+                yield (self.names[i], self.categories[i], self.threads[i],
+                       self.starts[i], self.durations[i], self.args[i])
+
+
+class Span(object):
+    """ context manager recording its block as a span """
+    __slots__ = ("name", "category", "arg", "start")
+
+    def __init__(self, name, category, arg):
+        self.name = name
+        self.category = category
+        self.arg = arg
+        self.start = None
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        buf = _buffer
+        if buf is not None:
+            buf.record(self.name, self.category, self.start,
+                       clock() - self.start, self.arg)
+        return False
+
+
+class NoSpan(object):
+    """ shared do nothing context manager while tracing is off """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NO_SPAN = NoSpan()
+
+
+def enable(capacity=DEFAULT_TRACE_CAPACITY):
+    """ start recording spans into a new buffer """
+    global _buffer
+    _buffer = SpanBuffer(capacity)
+    return _buffer
+
+def disable():
+    """ stop recording, return buffer of recorded spans """
+    global _buffer
+    buf, _buffer = _buffer, None
+    return buf
+
+def enabled():
+    """ True while spans are recorded """
+    return _buffer is not None
+
+def link_thread(waiter):
+    """ mark current thread as one thread waiter blocks on, such as a case
+        round worker joined by TestSuite.run_case. summary() takes its top
+        level spans out of self time of the waiter span they ran under.
+    """
+    buf = _buffer
+    if buf is not None:
+        buf.waiters[threading.current_thread()] = waiter
+
+def span(name, category="framework", arg=None):
+    """ context manager recording its block as span name, arg (such as a
+        command line) is shown with the span
+    """
+    if _buffer is None:
+        return NO_SPAN
+    return Span(name, category, arg)
+
+def traced(name=None, category="framework", arg_index=None):
+    """ decorator recording every call of function as a span, positional
+        argument arg_index of the call is shown with the span
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            buf = _buffer
+            if buf is None:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                buf.record(span_name, category, start, clock() - start,
+                           args[arg_index] if arg_index is not None and
+                           arg_index < len(args) else None)
+        return wrapper
+    return decorator
+
+def trace_methods(cls, category=None):
+    """ class decorator tracing every method defined in cls, private ones
+        included, span name is Class.method
+    """
+    category = category or cls.__name__
+    for attr, value in list(vars(cls).items()):
+        if not callable(value) or isinstance(value, type) or \
+           (attr.startswith("__") and attr.endswith("__")):
+            continue
+        method = attr.split("__", 1)[-1] if attr.startswith("_%s__"
+                                                           %cls.__name__) \
+                 else attr
+        setattr(cls, attr, traced("%s.%s" %(cls.__name__, method),
+                                  category)(value))
+    return cls
+
+def export(path, buf=None):
+    """ write spans of buf (current one if None) to path as Chrome trace
+        JSON, return number of spans written
+    """
+    buf = buf if buf is not None else _buffer
+    if buf is None:
+        return 0
+    events, threads = [], {}
+    for name, category, thread, start, duration, arg in buf.spans():
+        tid = threads.setdefault(thread, len(threads) + 1)
+        event = {"name": name, "cat": category, "ph": "X", "pid": 1,
+                 "tid": tid, "ts": (start - buf.origin) * 1e6,
+                 "dur": duration * 1e6}
+        if arg is not None:
+            event["args"] = {"arg": str(arg)}
+        events.append(event)
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1,
+                       "tid": tid, "args": {"name": thread.name}})
+    with open(path, "w") as trace_fd:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": {"started": buf.wall_origin,
+                                 "dropped": buf.dropped}}, trace_fd)
+    return len(events) - len(threads)
+
+def summary(buf=None, top=TOP_SINKS):
+    """ [(span name, calls, total seconds, self seconds)] of the top time
+        sinks by self time, time spent in a span minus its child spans on
+        the same thread and top level spans of threads linked to it, see
+        link_thread(). e.g. sleeps in Device.reboot show up as its self
+        time while adb commands it runs are their own spans
+    """
+    buf = buf if buf is not None else _buffer
+    if buf is None:
+        return []
+    per_thread = {}
+    for name, _, thread, start, duration, _ in buf.spans():
+        per_thread.setdefault(thread, []).append((start, 0, -duration, name))
+    for thread in list(per_thread):
+        waiter = buf.waiters.get(thread)
+        if waiter is None:
+            continue
+        for start, duration in _top_level(per_thread[thread]):
+            #probe for the waiter span open when linked span started
+            per_thread.setdefault(waiter, []).append((start, 1, -duration,
+                                                      None))
+    stats = {}
+    for spans in per_thread.values():
+        spans.sort()
+        stack = []
+        #[end, name, self time, [waited intervals]] of open parent spans
+        for start, probe, duration, name in spans:
+            duration = -duration
+            while stack and stack[-1][0] <= start:
+                _close_span(stack.pop(), stats)
+            if probe:
+                if stack:
+                    stack[-1][3].append((start, min(start + duration,
+                                                    stack[-1][0])))
+                continue
+            if stack:
+                stack[-1][2] -= duration
+            stack.append([start + duration, name, duration, []])
+        while stack:
+            _close_span(stack.pop(), stats)
+    totals = {}
+    for name, _, thread, start, duration, _ in buf.spans():
+        calls, total = totals.get(name, (0, 0.0))
+        totals[name] = (calls + 1, total + duration)
+    rows = [(name, totals[name][0], totals[name][1], self_time)
+            for name, self_time in stats.items()]
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows[:top]
+
+def _top_level(spans):
+    """ [(start, duration)] of spans of one thread not inside another """
+    outer, end = [], None
+    for start, _, duration, _ in sorted(spans):
+        if end is None or start >= end:
+            outer.append((start, -duration))
+            end = start - duration
+    return outer
+
+def _close_span(entry, stats):
+    """ add self time of a closed span to stats, time it waited on linked
+        threads is not its own
+    """
+    waited, last = 0.0, None
+    for start, end in sorted(entry[3]):
+        start = max(start, last) if last is not None else start
+        if end > start:
+            waited += end - start
+            last = end
+    stats[entry[1]] = stats.get(entry[1], 0.0) + max(entry[2] - waited, 0.0)
+
+def log_summary(buf=None, top=TOP_SINKS):
+    """ log top time sinks """
+    rows = summary(buf, top)
+    if not rows:
+        return
+    logger.info("Top %d time sinks by self time:", len(rows))
+    logger.info("%-40s %8s %10s %10s", "span", "calls", "total s", "self s")
+    for name, calls, total, self_time in rows:
+        logger.info("%-40s %8d %10.3f %10.3f", name, calls, total, self_time)
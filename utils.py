@@ -1,16 +1,29 @@
 #!/usr/bin/env python
 """ Utils module, including:
     Exception classes,
-    timeout decorator,
-    shell_cmd_executor
+    thread cancellation for timeouts,
+    shell_cmd_executor with deadline and streaming output
 """
 
 import subprocess
+import collections
+import contextlib
+import threading
+import hashlib
 import logging
 import requests
+import zipfile
+import struct
+import json
+import zlib
+import signal
+import socket
 import time
+import sys
 import os
 
+import tracing
+
 logger = logging.getLogger("Utils")
 logger.setLevel(logging.INFO)
 
@@ -19,60 +32,682 @@ class TimeoutException(Exception):
     """Timeout exception"""
     pass
 
-def execute_shell_cmd(command, use_shell=False,
-                      decoder="utf-8", rt_output=False):
+class DownloadError(Exception):
+    """Download failed or downloaded file is corrupted"""
+    pass
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+DOWNLOAD_RETRY_COUNT = 3
+
+ZIP_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+ZIP_LOCAL_SIGNATURE = 0x04034b50
+ZIP_FLAG_ENCRYPTED = 0x1
+ZIP_FLAG_DATA_DESCRIPTOR = 0x8
+ZIP_FLAG_UTF8 = 0x800
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+
+#thread ident -> child processes/sockets the thread is blocked on
+_thread_children = {}
+_cancelled_threads = set()
+_thread_lock = threading.Lock()
+
+def _new_session_kwargs():
+    """ Popen kwargs to start child in its own process group """
+    if sys.version_info[0] >= 3:
+        return {"start_new_session": True}
+    return {"preexec_fn": os.setsid}
+
+def _kill_child(child):
+    """ kill process group of Popen child, or shutdown socket child """
+    try:
+        if isinstance(child, subprocess.Popen):
+            os.killpg(child.pid, signal.SIGKILL)
+        else:
+            child.shutdown(socket.SHUT_RDWR)
+    except (OSError, socket.error) as e:
+        logger.debug("Kill child %s failed, see %s", str(child), str(e))
+
+def check_cancelled():
+    """ raise TimeoutException if current thread has been cancelled """
+    if threading.current_thread().ident in _cancelled_threads:
+        raise TimeoutException("Thread %s cancelled."
+                               %threading.current_thread().name)
+
+@contextlib.contextmanager
+def cancellable(child):
+    """ register child (Popen in own process group or socket) as blocking
+        current thread, so cancel_thread() could kill it.
+    """
+    ident = threading.current_thread().ident
+    with _thread_lock:
+        if ident in _cancelled_threads:
+            _kill_child(child)
+            raise TimeoutException("Thread %s cancelled."
+                                   %threading.current_thread().name)
+        _thread_children.setdefault(ident, set()).add(child)
+    try:
+        yield child
+    finally:
+        with _thread_lock:
+            _thread_children.get(ident, set()).discard(child)
+
+def cancel_thread(ident):
+    """ mark thread cancelled and kill everything it is blocked on, further
+        commands from that thread raise TimeoutException.
+    """
+    with _thread_lock:
+        _cancelled_threads.add(ident)
+        children = list(_thread_children.get(ident, ()))
+    for child in children:
+        logger.warning("Kill %s of cancelled thread %d", str(child), ident)
+        _kill_child(child)
+
+def forget_thread(ident=None):
+    """ drop cancel state of thread (current if None) before it exits,
+        thread idents could be reused.
+    """
+    ident = threading.current_thread().ident if ident is None else ident
+    with _thread_lock:
+        _cancelled_threads.discard(ident)
+        _thread_children.pop(ident, None)
+
+class ShellCommand(object):
+    """ Shell command runner with deadline and streaming output.
+        Command runs in its own process group which is killed as a whole
+        when timeout expires. Stdout lines are yielded while command runs,
+        stderr is drained concurrently into a bounded buffer so a full
+        stderr pipe could not block the command.
+
+        cmd = ShellCommand("adb logcat -d", timeout=30)
+        for line in cmd:
+            ...
+        cmd.ret_code, cmd.timed_out, cmd.stderr
+    """
+    def __init__(self, command, use_shell=False, timeout=None,
+                 decoder="utf-8", max_stderr_lines=1000, cwd=None):
+        self.command = command
+        self.use_shell = use_shell
+        self.cwd = cwd
+        self.timeout = timeout
+        self.decoder = decoder
+        self.process = None
+        self.ret_code = None
+        self.timed_out = False
+        self.stderr = collections.deque(maxlen=max_stderr_lines)
+        self.__stderr_thread = None
+        self.__timer = None
+
+    def start(self):
+        """ start command, raise OSError/ValueError if could not start """
+        check_cancelled()
+        logger.debug("Execute shell command: %s", self.command)
+        process_cmd = self.command if self.use_shell else self.command.split()
+        self.process = subprocess.Popen(process_cmd, shell=self.use_shell,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        cwd=self.cwd,
+                                        **_new_session_kwargs())
+        self.__stderr_thread = threading.Thread(target=self.__drain_stderr)
+        self.__stderr_thread.daemon = True
+        self.__stderr_thread.start()
+        if self.timeout is not None:
+            self.__timer = threading.Timer(self.timeout, self.__expire)
+            self.__timer.daemon = True
+            self.__timer.start()
+        return self
+
+    def __drain_stderr(self):
+        """ stderr reader thread body """
+        for line in iter(self.process.stderr.readline, b''):
+            self.stderr.append(line.decode(self.decoder, "replace")
+                               .rstrip("\n"))
+
+    def __expire(self):
+        """ deadline reached, kill whole process group """
+        if self.process.poll() is None:
+            logger.error("Command %s timeout after %s seconds, kill it.",
+                         self.command, str(self.timeout))
+            self.timed_out = True
+            _kill_child(self.process)
+
+    def kill(self):
+        """ kill whole process group of command """
+        _kill_child(self.process)
+
+    def __iter__(self):
+        """ yield stdout lines without line break until command exits """
+        if self.process is None:
+            self.start()
+        finished = False
+        try:
+            with cancellable(self.process):
+                for line in iter(self.process.stdout.readline, b''):
+                    yield line.decode(self.decoder, "replace").rstrip("\n")
+            finished = True
+        finally:
+            if not finished:
+                #iteration stopped early, nobody reads stdout any more
+                self.kill()
+            self.wait()
+
+    def read(self):
+        """ whole stdout of command as bytes, waits for command exit """
+        if self.process is None:
+            self.start()
+        data = None
+        try:
+            with cancellable(self.process):
+                data = self.process.stdout.read()
+        finally:
+            if data is None:
+                self.kill()
+            self.wait()
+        return data
+
+    def wait(self):
+        """ wait command exit and stderr drained, return return code """
+        if self.ret_code is None:
+            self.ret_code = self.process.wait()
+            if self.__timer is not None:
+                self.__timer.cancel()
+            self.__stderr_thread.join()
+            self.process.stdout.close()
+            self.process.stderr.close()
+        return self.ret_code
+
+
+@tracing.traced("execute_shell_cmd", "shell", arg_index=0)
+def execute_shell_cmd(command, use_shell=False, decoder="utf-8",
+                      rt_output=False, timeout=None, line_callback=None,
+                      max_lines=None, cwd=None):
     """ shell command executor
-        params: command(str), use_shell(bool)
-        return: (return_code(int), output(list of strs))
+        params: command(str), use_shell(bool),
+                timeout(seconds): kill command process group after it,
+                line_callback(callable): called with every output line,
+                max_lines(int): keep only last max_lines lines of output,
+                cwd(str): working directory of command, process working
+                          directory is never changed
+        return: (return_code(int), output(list of strs)), output of a
+                timed out command is what it printed before being killed
     """
-    logger.debug("Execute shell command: %s", command)
     if use_shell:
         logger.info("Command execution use shell = %s", str(use_shell))
-    process_cmd = command if use_shell else command.split()
-    ret_code, output = 1, ''
+    output = collections.deque(maxlen=max_lines)
+    cmd = ShellCommand(command, use_shell=use_shell, timeout=timeout,
+                       decoder=decoder, cwd=cwd)
     try:
-        process = subprocess.Popen(process_cmd, shell=use_shell,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        while True:
-            tmp_out = process.stdout.readline()
-            if tmp_out == '' and process.poll() is not None:
-                #End of output
-                break
-            if tmp_out:
-                if rt_output:
-                    logger.info("Shell_RT>%s", tmp_out)
-                output += tmp_out
-        ret_code = process.poll()
+        for line in cmd.start():
+            if rt_output:
+                logger.info("Shell_RT>%s", line)
+            if line_callback is not None:
+                line_callback(line)
+            output.append(line)
     except (OSError, ValueError) as e:
         logger.error("Exception raised when execute command %s. See %s",
                      command, str(e))
-        ret_code, output = 1, str(e)
-    finally:
-        output = output.decode(decoder).split("\n")
-        if output[-1] == '':
-            output = output[:-1]
-        return ret_code, output
+        return 1, str(e).split("\n")
+    for line in cmd.stderr:
+        logger.debug("Shell_ERR>%s", line)
+    if cmd.timed_out:
+        logger.warning("Command %s timed out, return code %s and output "
+                       "of %d lines are incomplete.", command,
+                       str(cmd.ret_code), len(output))
+    return cmd.ret_code, list(output)
+
+class ChunkedDownload(object):
+    """ Download url into local_file with HTTP Range requests over several
+        pooled connections. File is preallocated, every worker writes its
+        chunks in place and finished chunks are saved in local_file.state
+        so an interrupted download resumes from where it stopped.
+        progress_callback(bytes) is called whenever the contiguous prefix of
+        file which is already on disk grows, chunks are fetched in order so
+        a consumer could read the file while it is downloading.
+    """
+    def __init__(self, url, local_file, auth=None, ssl_verify=False,
+                 workers=DEFAULT_DOWNLOAD_WORKERS,
+                 chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE,
+                 progress_callback=None):
+        self.url = url
+        self.local_file = local_file
+        self.state_file = local_file + ".state"
+        self.auth = auth
+        self.ssl_verify = ssl_verify
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.size = None
+        self.etag = None
+        self.done = set()
+        self.prefix_chunks = 0
+        self.lock = threading.Lock()
+        self.errors = []
+
+    def session(self):
+        """ new session with connection pool for one worker """
+        s = requests.Session()
+        s.auth = self.auth
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=1)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s
+
+    def probe(self, session):
+        """ HEAD url, return True if server supports Range requests, False
+            if HEAD is not answered, then url is fetched with one GET
+        """
+        try:
+            r = session.head(self.url, allow_redirects=True,
+                             verify=self.ssl_verify)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning("HEAD %s failed, see %s", self.url, str(e))
+            return False
+        self.etag = r.headers.get("ETag")
+        if "Content-Length" in r.headers:
+            self.size = int(r.headers["Content-Length"])
+        return self.size is not None and \
+               r.headers.get("Accept-Ranges", "").lower() == "bytes"
 
-def download_image(url, path=None, user=None, password=None, ssl_verify=False):
+    def chunk_count(self):
+        """ number of chunks of file """
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def load_state(self):
+        """ restore finished chunks of an earlier attempt at same file """
+        if not os.path.exists(self.state_file) or \
+           not os.path.exists(self.local_file):
+            return
+        try:
+            with open(self.state_file, "r") as state_fd:
+                state = json.load(state_fd)
+        except ValueError:
+            return
+        if (state.get("url"), state.get("size"), state.get("etag"),
+                state.get("chunk_size")) == (self.url, self.size, self.etag,
+                                             self.chunk_size):
+            self.done = set(state["done"])
+            logger.info("Resume download, %d of %d chunks already done.",
+                        len(self.done), self.chunk_count())
+
+    def save_state(self):
+        """ persist finished chunks, called with self.lock held """
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as state_fd:
+            json.dump({"url": self.url, "size": self.size, "etag": self.etag,
+                       "chunk_size": self.chunk_size,
+                       "done": sorted(self.done)}, state_fd)
+        os.rename(tmp_file, self.state_file)
+
+    def prefix_bytes(self):
+        """ length of downloaded prefix, called with self.lock held """
+        while self.prefix_chunks in self.done:
+            self.prefix_chunks += 1
+        return min(self.prefix_chunks * self.chunk_size, self.size)
+
+    def report_progress(self, downloaded):
+        """ pass downloaded prefix length to progress_callback """
+        if self.progress_callback is not None:
+            self.progress_callback(downloaded)
+
+    def fetch_chunk(self, session, fd, index):
+        """ download one chunk and write it at its offset """
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        r = session.get(self.url, stream=True, verify=self.ssl_verify,
+                        headers={"Range": "bytes=%d-%d" %(start, end)})
+        try:
+            if r.status_code != 206:
+                raise DownloadError("Range request got status %d"
+                                    %r.status_code)
+            fd.seek(start)
+            received = 0
+            for data in r.iter_content(chunk_size=DOWNLOAD_BUFFER_SIZE):
+                fd.write(data)
+                received += len(data)
+            if received != end - start + 1:
+                raise DownloadError("Chunk %d got %d of %d bytes"
+                                    %(index, received, end - start + 1))
+        finally:
+            r.close()
+
+    def worker(self, pending):
+        """ worker thread body, record error instead of dying silently """
+        try:
+            self.fetch_pending(pending)
+        except Exception as e:
+            logger.error("Download worker failed, see %s", str(e))
+            with self.lock:
+                self.errors.append(str(e))
+
+    def fetch_pending(self, pending):
+        """ fetch chunks from pending until it is empty """
+        session = self.session()
+        with open(self.local_file, "r+b") as fd:
+            while True:
+                with self.lock:
+                    if not pending or self.errors:
+                        return
+                    index = pending.pop()
+                for retry in range(DOWNLOAD_RETRY_COUNT):
+                    try:
+                        self.fetch_chunk(session, fd, index)
+                        fd.flush()
+                        break
+                    except (requests.RequestException, DownloadError) as e:
+                        logger.warning("Chunk %d failed (%d), see %s",
+                                       index, retry + 1, str(e))
+                else:
+                    with self.lock:
+                        self.errors.append("Chunk %d failed." %index)
+                    return
+                with self.lock:
+                    self.done.add(index)
+                    self.save_state()
+                    downloaded = self.prefix_bytes()
+                self.report_progress(downloaded)
+
+    def run(self):
+        """ download, return local file, raise DownloadError if failed """
+        session = self.session()
+        if not self.probe(session):
+            logger.info("Server does not support range requests, use one "
+                        "stream.")
+            return self.stream(session)
+        self.load_state()
+        if not self.done:
+            with open(self.local_file, "wb") as fd:
+                fd.truncate(self.size)
+        else:
+            self.report_progress(self.prefix_bytes())
+        pending = sorted(set(range(self.chunk_count())) - self.done,
+                         reverse=True)
+        threads = [threading.Thread(target=self.worker, args=(pending,))
+                   for _ in range(min(self.workers, len(pending)))]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+        if self.errors:
+            raise DownloadError("Download %s failed, rerun to resume: %s"
+                                %(self.url, "; ".join(self.errors)))
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        return self.local_file
+
+    def stream(self, session):
+        """ plain single connection download """
+        r = session.get(self.url, stream=True, verify=self.ssl_verify)
+        r.raise_for_status()
+        downloaded = 0
+        with open(self.local_file, "wb") as fd:
+            for data in r.iter_content(chunk_size=DOWNLOAD_BUFFER_SIZE):
+                fd.write(data)
+                fd.flush()
+                downloaded += len(data)
+                self.report_progress(downloaded)
+        return self.local_file
+
+
+def file_checksum(path, algorithm="sha256"):
+    """ hex digest of file """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as fd:
+        for data in iter(lambda: fd.read(DOWNLOAD_BUFFER_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+#(algorithm, path, size, mtime) -> hex digest
+_checksums = {}
+_checksum_lock = threading.Lock()
+
+def cached_file_checksum(path, algorithm="sha256"):
+    """ file_checksum memoized by file size and mtime, a file is read once
+        per process while it is unchanged
+    """
+    stat = os.stat(path)
+    key = (algorithm, os.path.abspath(path), stat.st_size, stat.st_mtime)
+    with _checksum_lock:
+        if key in _checksums:
+            return _checksums[key]
+    digest = file_checksum(path, algorithm)
+    with _checksum_lock:
+        _checksums[key] = digest
+    return digest
+
+def download_image(url, path=None, user=None, password=None, ssl_verify=False,
+                   checksum=None, workers=DEFAULT_DOWNLOAD_WORKERS,
+                   chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE,
+                   progress_callback=None):
+    """ download image with parallel range requests, resume partial file
+        left by an interrupted download of the same url.
+        checksum: "<algorithm>:<hex digest>" such as "sha256:1f2e...",
+                  file is verified against it after download
+        progress_callback: see ChunkedDownload
+        return: local file path, raise DownloadError if failed
+    """
     filename = url.split('/')[-1]
     if not filename or not filename.endswith(".zip"):
         logger.error("Looks like this is not a image url, please check!")
         logger.error(url)
     else:
         logger.info("Donwload image from url %s", url)
-    s = requests.Session()
+    auth = None
     if user is not None and password is not None:
-        s.auth = (user, password)
+        auth = (user, password)
         logger.info("Login session with user %s and password.", user)
     start_time = time.time()
-    r = s.get(url, stream=True, verify=ssl_verify)
     local_file = os.path.join(path, filename) if path else filename
-    with open(local_file, 'wb') as fd:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                fd.write(chunk)
+    try:
+        ChunkedDownload(url, local_file, auth=auth, ssl_verify=ssl_verify,
+                        workers=workers, chunk_size=chunk_size,
+                        progress_callback=progress_callback).run()
+    except requests.RequestException as e:
+        raise DownloadError("Download %s failed, see %s" %(url, str(e)))
     end_time = time.time()
     logger.info("Download finished, file here %s, cost %s seconds.",
                 local_file, str(end_time-start_time))
+    if checksum is not None:
+        algorithm, expected = checksum.split(":", 1)
+        actual = file_checksum(local_file, algorithm)
+        if actual.lower() != expected.lower():
+            raise DownloadError("Checksum mismatch of %s: %s expected, got %s"
+                                %(local_file, expected, actual))
+        logger.info("Checksum %s verified.", checksum)
     return local_file
+
+
+def _member_path(target_dir, name):
+    """ path of zip member under target_dir, None if it would escape it """
+    parts = [p for p in name.replace("\\", "/").split("/")
+             if p not in ("", ".")]
+    if not parts or ".." in parts or name.startswith("/"):
+        return None
+    return os.path.join(target_dir, *parts)
+
+def _zip64_sizes(extra, size, compress_size):
+    """ (size, compress_size) of local header, 64 bit values taken from its
+        zip64 extra field
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack("<HH", extra[pos:pos + 4])
+        if tag == ZIP64_EXTRA_ID:
+            values = extra[pos + 4:pos + 4 + length]
+            fields = list(struct.unpack("<%dQ" %(len(values) // 8),
+                                        values[:len(values) // 8 * 8]))
+            if size == ZIP64_LIMIT:
+                size = fields.pop(0)
+            if compress_size == ZIP64_LIMIT:
+                compress_size = fields.pop(0)
+            return size, compress_size
+        pos += 4 + length
+    raise ValueError("Zip64 extra field missing")
+
+
+class StreamingZipExtractor(object):
+    """ Extract a zip file while it is still being downloaded.
+        Members are read one by one from their local headers as the
+        downloaded prefix of file grows (see feed()). Streaming stops at the
+        first member whose sizes are not in its local header (data
+        descriptor), which is encrypted or not stored/deflated, since the
+        next member could not be located without the central directory.
+        finish() extracts every member not streamed with zipfile once the
+        download is complete.
+
+        extractor = StreamingZipExtractor(zip_file, target_dir).start()
+        download_image(url, progress_callback=extractor.feed)
+        extractor.finish()
+    """
+    def __init__(self, zip_file, target_dir):
+        self.zip_file = zip_file
+        self.target_dir = target_dir
+        self.available = 0
+        self.complete = False
+        self.aborted = False
+        self.cond = threading.Condition()
+        self.extracted = {}
+        self.thread = None
+
+    def feed(self, available, complete=False):
+        """ first available bytes of zip file are on disk """
+        with self.cond:
+            self.available = max(self.available, available)
+            self.complete = self.complete or complete
+            self.cond.notify_all()
+
+    def wait_for(self, end):
+        """ block until first end bytes are on disk, False if they never
+            will be
+        """
+        with self.cond:
+            while self.available < end and not self.complete and \
+                  not self.aborted:
+                self.cond.wait()
+            return self.available >= end and not self.aborted
+
+    def start(self):
+        """ stream members in a daemon thread """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        """ streaming thread body, a failure only ends streaming """
+        try:
+            self.stream_members()
+        except (IOError, OSError, ValueError, struct.error, zlib.error) as e:
+            logger.warning("Stop extracting %s while downloading, see %s",
+                           self.zip_file, str(e))
+
+    def stream_members(self):
+        """ extract members in file order until streaming is not possible """
+        offset = 0
+        if not self.wait_for(ZIP_LOCAL_HEADER.size):
+            return
+        with open(self.zip_file, "rb") as fd:
+            while self.wait_for(offset + ZIP_LOCAL_HEADER.size):
+                fd.seek(offset)
+                (signature, _, flags, method, _, _, crc, compress_size, size,
+                 name_length, extra_length) = ZIP_LOCAL_HEADER.unpack(
+                                            fd.read(ZIP_LOCAL_HEADER.size))
+                if signature != ZIP_LOCAL_SIGNATURE:
+                    return #central directory reached
+                if flags & (ZIP_FLAG_ENCRYPTED | ZIP_FLAG_DATA_DESCRIPTOR) or \
+                   method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    logger.info("Zip member at %d could not be streamed, "
+                                "extract the rest after download.", offset)
+                    return
+                data_start = offset + ZIP_LOCAL_HEADER.size + name_length + \
+                             extra_length
+                if not self.wait_for(data_start):
+                    return
+                name = fd.read(name_length).decode(
+                           "utf-8" if flags & ZIP_FLAG_UTF8 else "cp437")
+                extra = fd.read(extra_length)
+                if ZIP64_LIMIT in (size, compress_size):
+                    size, compress_size = _zip64_sizes(extra, size,
+                                                       compress_size)
+                if not self.extract_member(fd, name, method, data_start,
+                                           compress_size, size, crc):
+                    return
+                offset = data_start + compress_size
+
+    def extract_member(self, fd, name, method, data_start, compress_size,
+                       size, crc):
+        """ extract one member as its data arrives, return False if download
+            ended before it
+        """
+        path = _member_path(self.target_dir, name)
+        if path is None:
+            return True #left to zipfile which sanitizes the name
+        if name.endswith("/"):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.extracted[name] = 0
+            return True
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) \
+                       if method == zipfile.ZIP_DEFLATED else None
+        pos, end = data_start, data_start + compress_size
+        crc_value, written = 0, 0
+        with open(path, "wb") as out:
+            while pos < end:
+                if not self.wait_for(pos + 1):
+                    return False
+                with self.cond:
+                    ready = min(self.available, end,
+                                pos + DOWNLOAD_BUFFER_SIZE)
+                fd.seek(pos)
+                data = fd.read(ready - pos)
+                pos += len(data)
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                crc_value = zlib.crc32(data, crc_value)
+                written += len(data)
+                out.write(data)
+            if decompressor is not None:
+                data = decompressor.flush()
+                crc_value = zlib.crc32(data, crc_value)
+                written += len(data)
+                out.write(data)
+        if crc_value & 0xFFFFFFFF != crc or written != size:
+            raise ValueError("Zip member %s is corrupted" %name)
+        self.extracted[name] = size
+        return True
+
+    def abort(self):
+        """ stop streaming, download failed """
+        with self.cond:
+            self.aborted = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def finish(self):
+        """ download is complete: drain streaming, then extract members it
+            did not with zipfile. return target_dir
+        """
+        self.feed(os.path.getsize(self.zip_file), complete=True)
+        if self.thread is not None:
+            self.thread.join()
+        rest = 0
+        archive = zipfile.ZipFile(self.zip_file)
+        try:
+            for info in archive.infolist():
+                if self.extracted.get(info.filename) != info.file_size:
+                    archive.extract(info, self.target_dir)
+                    rest += 1
+        finally:
+            archive.close()
+        logger.info("Extracted %s to %s, %d members while downloading, %d "
+                    "after.", self.zip_file, self.target_dir,
+                    len(self.extracted), rest)
+        return self.target_dir
+
+def extract_zip(zip_file, target_dir):
+    """ extract downloaded zip file in-process, return target_dir """
+    return StreamingZipExtractor(zip_file, target_dir).finish()